@@ -0,0 +1,165 @@
+-- maintains the entity_edge table that entity graphs are read from (see model/orm.py and service/graph/entity.py).
+-- every edge is derived from the "data" column of its owner, the entity whose trigger inserts and deletes it.
+-- this file is safe to run more than once (see tool/migration/rebuild_entity_edges.py).
+
+
+-- every prefix of an s3 path, so that the datasets containing it can be found with the dataset.location index
+CREATE OR REPLACE FUNCTION s3_path_prefixes(path TEXT)
+RETURNS TEXT[] AS $$
+    SELECT ARRAY(SELECT left(path, n) FROM generate_series(1, length(path)) n)
+$$ language 'sql' IMMUTABLE;
+
+
+CREATE OR REPLACE FUNCTION jsonb_array_elements_or_empty(value JSONB)
+RETURNS SETOF TEXT AS $$
+    SELECT jsonb_array_elements_text(CASE WHEN jsonb_typeof(value) = 'array' THEN value ELSE '[]'::JSONB END)
+$$ language 'sql' IMMUTABLE;
+
+
+-- only template actions are part of entity graphs
+CREATE OR REPLACE FUNCTION action_entity_edges(a action)
+RETURNS TABLE (src_type VARCHAR, src_id VARCHAR, dst_type VARCHAR, dst_id VARCHAR, relation VARCHAR,
+               owner_type VARCHAR, owner_id VARCHAR, ordinal FLOAT) AS $$
+    SELECT e.src_type, e.src_id, 'action'::VARCHAR, a.id, e.relation, 'action'::VARCHAR, a.id,
+           CAST(a.data->>'order_idx' AS FLOAT)
+      FROM (
+            SELECT 'dataset'::VARCHAR, a.data #>> '{args,dataset_id}', 'dataset_id'::VARCHAR
+             UNION ALL
+            SELECT 'subscription', a.data #>> '{args,subscription_id}', 'subscription_id'
+             UNION ALL
+            SELECT 'workflow', a.data->>'workflow_id', 'workflow_id'
+             UNION ALL
+            SELECT 'dataset', d.id, 'location'
+              FROM dataset d
+             WHERE d.location = ANY(s3_path_prefixes(a.data #>> '{args,destination_s3_path}'))
+           ) e(src_type, src_id, relation)
+     WHERE a.data->>'state' = 'TEMPLATE'
+       AND e.src_id IS NOT NULL
+$$ language 'sql' STABLE;
+
+
+-- the location edges of a dataset are owned by the actions writing to it, but must follow its location too
+CREATE OR REPLACE FUNCTION dataset_entity_edges(d dataset)
+RETURNS TABLE (src_type VARCHAR, src_id VARCHAR, dst_type VARCHAR, dst_id VARCHAR, relation VARCHAR,
+               owner_type VARCHAR, owner_id VARCHAR, ordinal FLOAT) AS $$
+    SELECT 'dataset'::VARCHAR, d.id, 'action'::VARCHAR, a.id, 'location'::VARCHAR, 'action'::VARCHAR, a.id,
+           a.order_idx
+      FROM action a
+     WHERE a.state = 'TEMPLATE'
+       AND d.data->>'location' <> ''
+       AND left(a.data #>> '{args,destination_s3_path}', length(d.data->>'location')) = d.data->>'location'
+$$ language 'sql' STABLE;
+
+
+CREATE OR REPLACE FUNCTION subscription_entity_edges(s subscription)
+RETURNS TABLE (src_type VARCHAR, src_id VARCHAR, dst_type VARCHAR, dst_id VARCHAR, relation VARCHAR,
+               owner_type VARCHAR, owner_id VARCHAR, ordinal FLOAT) AS $$
+    SELECT 'dataset'::VARCHAR, s.data->>'dataset_id', 'subscription'::VARCHAR, s.id, 'dataset_id'::VARCHAR,
+           'subscription'::VARCHAR, s.id, NULL::FLOAT
+     WHERE s.data->>'dataset_id' IS NOT NULL
+$$ language 'sql' STABLE;
+
+
+CREATE OR REPLACE FUNCTION workflow_entity_edges(w workflow)
+RETURNS TABLE (src_type VARCHAR, src_id VARCHAR, dst_type VARCHAR, dst_id VARCHAR, relation VARCHAR,
+               owner_type VARCHAR, owner_id VARCHAR, ordinal FLOAT) AS $$
+    SELECT 'datastore'::VARCHAR, w.data->>'datastore_id', 'workflow'::VARCHAR, w.id, 'datastore_id'::VARCHAR,
+           'workflow'::VARCHAR, w.id, NULL::FLOAT
+     WHERE w.data->>'datastore_id' IS NOT NULL
+$$ language 'sql' STABLE;
+
+
+-- an unqualified "trigger" would name the pseudo-type of trigger functions rather than the table's row type
+CREATE OR REPLACE FUNCTION trigger_entity_edges(t public.trigger)
+RETURNS TABLE (src_type VARCHAR, src_id VARCHAR, dst_type VARCHAR, dst_id VARCHAR, relation VARCHAR,
+               owner_type VARCHAR, owner_id VARCHAR, ordinal FLOAT) AS $$
+    SELECT e.src_type, e.src_id, e.dst_type, e.dst_id, e.relation, 'trigger'::VARCHAR, t.id, NULL::FLOAT
+      FROM (
+            SELECT 'trigger'::VARCHAR, t.id, 'workflow'::VARCHAR, w.id, 'workflow_ids'::VARCHAR
+              FROM jsonb_array_elements_or_empty(t.data->'workflow_ids') w(id)
+             UNION ALL
+            SELECT 'workflow', t.data #>> '{args,completed_workflow_id}', 'trigger', t.id, 'completed_workflow_id'
+             UNION ALL
+            SELECT 'subscription', t.data #>> '{args,subscription_id}', 'trigger', t.id, 'subscription_id'
+             UNION ALL
+            SELECT 'event', t.data #>> '{args,event_id}', 'trigger', t.id, 'event_id'
+             UNION ALL
+            SELECT 'trigger', c.id, 'trigger', t.id, 'completed_trigger_ids'
+              FROM jsonb_array_elements_or_empty(t.data #> '{args,completed_trigger_ids}') c(id)
+           ) e(src_type, src_id, dst_type, dst_id, relation)
+     WHERE e.src_id IS NOT NULL
+       AND e.dst_id IS NOT NULL
+$$ language 'sql' STABLE;
+
+
+-- replaces the edges owned by an action, subscription, workflow or trigger when its data changes
+CREATE OR REPLACE FUNCTION refresh_entity_edges()
+RETURNS TRIGGER AS $$
+DECLARE
+    had_edges BOOLEAN;
+    has_edges BOOLEAN;
+BEGIN
+    had_edges := TG_OP <> 'INSERT';
+    has_edges := TG_OP <> 'DELETE';
+    -- OLD is not assigned in insert triggers, so it is only read inside these blocks
+    IF TG_OP = 'UPDATE' THEN
+        IF NEW.data = OLD.data THEN
+            RETURN NULL;
+        END IF;
+    END IF;
+    -- non-template actions are written far more often than anything else, and never have edges
+    IF TG_TABLE_NAME = 'action' THEN
+        IF had_edges THEN
+            had_edges := COALESCE(OLD.data->>'state' = 'TEMPLATE', FALSE);
+        END IF;
+        IF has_edges THEN
+            has_edges := COALESCE(NEW.data->>'state' = 'TEMPLATE', FALSE);
+        END IF;
+    END IF;
+
+    IF had_edges THEN
+        DELETE FROM entity_edge WHERE owner_type = TG_TABLE_NAME AND owner_id = OLD.id;
+    END IF;
+    IF has_edges THEN
+        EXECUTE format('INSERT INTO entity_edge (src_type, src_id, dst_type, dst_id, relation, owner_type, owner_id, '
+                       || 'ordinal) SELECT * FROM %I($1) ON CONFLICT DO NOTHING', TG_TABLE_NAME || '_entity_edges')
+          USING NEW;
+    END IF;
+    RETURN NULL;
+END;
+$$ language 'plpgsql';
+
+
+CREATE OR REPLACE FUNCTION refresh_dataset_entity_edges()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP = 'UPDATE' THEN
+        IF NEW.data->>'location' IS NOT DISTINCT FROM OLD.data->>'location' THEN
+            RETURN NULL;
+        END IF;
+    END IF;
+
+    IF TG_OP <> 'INSERT' THEN
+        DELETE FROM entity_edge WHERE src_type = 'dataset' AND src_id = OLD.id AND relation = 'location';
+    END IF;
+    IF TG_OP <> 'DELETE' THEN
+        INSERT INTO entity_edge (src_type, src_id, dst_type, dst_id, relation, owner_type, owner_id, ordinal)
+        SELECT * FROM dataset_entity_edges(NEW)
+        ON CONFLICT DO NOTHING;
+    END IF;
+    RETURN NULL;
+END;
+$$ language 'plpgsql';
+
+
+DROP TRIGGER IF EXISTS action_refresh_entity_edges ON action;
+DROP TRIGGER IF EXISTS dataset_refresh_entity_edges ON dataset;
+DROP TRIGGER IF EXISTS subscription_refresh_entity_edges ON subscription;
+DROP TRIGGER IF EXISTS trigger_refresh_entity_edges ON trigger;
+DROP TRIGGER IF EXISTS workflow_refresh_entity_edges ON workflow;
+
+CREATE TRIGGER action_refresh_entity_edges AFTER INSERT OR UPDATE OR DELETE ON action FOR EACH ROW EXECUTE PROCEDURE refresh_entity_edges();
+CREATE TRIGGER dataset_refresh_entity_edges AFTER INSERT OR UPDATE OR DELETE ON dataset FOR EACH ROW EXECUTE PROCEDURE refresh_dataset_entity_edges();
+CREATE TRIGGER subscription_refresh_entity_edges AFTER INSERT OR UPDATE OR DELETE ON subscription FOR EACH ROW EXECUTE PROCEDURE refresh_entity_edges();
+CREATE TRIGGER trigger_refresh_entity_edges AFTER INSERT OR UPDATE OR DELETE ON trigger FOR EACH ROW EXECUTE PROCEDURE refresh_entity_edges();
+CREATE TRIGGER workflow_refresh_entity_edges AFTER INSERT OR UPDATE OR DELETE ON workflow FOR EACH ROW EXECUTE PROCEDURE refresh_entity_edges();
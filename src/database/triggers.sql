@@ -18,3 +18,67 @@ CREATE TRIGGER subscription_element_update_timestamp BEFORE UPDATE ON subscripti
 CREATE TRIGGER trigger_update_timestamp BEFORE UPDATE ON trigger FOR EACH ROW EXECUTE PROCEDURE update_timestamp();
 CREATE TRIGGER workflow_update_timestamp BEFORE UPDATE ON workflow FOR EACH ROW EXECUTE PROCEDURE update_timestamp();
 CREATE TRIGGER workflow_instance_update_timestamp BEFORE UPDATE ON workflow_instance FOR EACH ROW EXECUTE PROCEDURE update_timestamp();
+
+
+-- lets engine workers dispatch queued actions as soon as they are queued or capacity frees up (see worker/engine.py)
+CREATE OR REPLACE FUNCTION notify_action_state_changed()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP = 'INSERT' OR NEW.data->>'state' IS DISTINCT FROM OLD.data->>'state' THEN
+        PERFORM pg_notify('action_state_changed', NEW.id);
+    END IF;
+    RETURN NEW;
+END;
+$$ language 'plpgsql';
+
+
+CREATE TRIGGER action_state_changed_notify AFTER INSERT OR UPDATE ON action FOR EACH ROW EXECUTE PROCEDURE notify_action_state_changed();
+
+
+-- copies the fields used by hot predicates out of the "data" column into indexed columns (see model/orm.py)
+CREATE OR REPLACE FUNCTION copy_action_data_columns()
+RETURNS TRIGGER AS $$
+BEGIN
+    NEW.state = NEW.data->>'state';
+    NEW.datastore_id = NEW.data->>'datastore_id';
+    NEW.workflow_id = NEW.data->>'workflow_id';
+    NEW.workflow_instance_id = NEW.data->>'workflow_instance_id';
+    NEW.order_idx = CAST(NEW.data->>'order_idx' AS FLOAT);
+    RETURN NEW;
+END;
+$$ language 'plpgsql';
+
+
+CREATE OR REPLACE FUNCTION copy_dataset_data_columns()
+RETURNS TRIGGER AS $$
+BEGIN
+    NEW.location = NEW.data->>'location';
+    RETURN NEW;
+END;
+$$ language 'plpgsql';
+
+
+CREATE OR REPLACE FUNCTION copy_trigger_data_columns()
+RETURNS TRIGGER AS $$
+BEGIN
+    NEW.state = NEW.data->>'state';
+    NEW.trigger_type_name = NEW.data->>'trigger_type_name';
+    RETURN NEW;
+END;
+$$ language 'plpgsql';
+
+
+CREATE OR REPLACE FUNCTION copy_workflow_instance_data_columns()
+RETURNS TRIGGER AS $$
+BEGIN
+    NEW.state = NEW.data->>'state';
+    NEW.workflow_id = NEW.data->>'workflow_id';
+    RETURN NEW;
+END;
+$$ language 'plpgsql';
+
+
+CREATE TRIGGER action_copy_data_columns BEFORE INSERT OR UPDATE ON action FOR EACH ROW EXECUTE PROCEDURE copy_action_data_columns();
+CREATE TRIGGER dataset_copy_data_columns BEFORE INSERT OR UPDATE ON dataset FOR EACH ROW EXECUTE PROCEDURE copy_dataset_data_columns();
+CREATE TRIGGER trigger_copy_data_columns BEFORE INSERT OR UPDATE ON trigger FOR EACH ROW EXECUTE PROCEDURE copy_trigger_data_columns();
+CREATE TRIGGER workflow_instance_copy_data_columns BEFORE INSERT OR UPDATE ON workflow_instance FOR EACH ROW EXECUTE PROCEDURE copy_workflow_instance_data_columns();
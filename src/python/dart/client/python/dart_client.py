@@ -1,10 +1,17 @@
+from contextlib import closing
+import errno
+import logging
 import os
 import json
+import random
+import socket
+import threading
 import time
 
 import jsonpatch
 import requests
-from requests.packages.urllib3.exceptions import InsecureRequestWarning
+from requests.adapters import HTTPAdapter
+from requests.packages.urllib3.exceptions import ConnectTimeoutError, InsecureRequestWarning
 from basicauth import encode
 from retrying import retry
 
@@ -31,6 +38,74 @@ auth_config = config['auth']
 if auth_config.get('use_auth') and (auth_config.get('dart_server') == 'https://localhost:5000'):
     requests.packages.urllib3.disable_warnings(InsecureRequestWarning)
 
+_logger = logging.getLogger(__name__)
+
+# ids per request of the bulk get methods, which keeps their urls well under common limits
+_IDS_PER_REQUEST = 100
+# requests that failed to connect, timed out or got one of these statuses are retried with jittered backoff, but
+# only if they are safe to send again (a connection that could not be made never sent its request)
+_RETRY_STATUSES = {429, 502, 503, 504}
+_IDEMPOTENT_METHODS = {'get', 'put', 'delete', 'head', 'options'}
+_MAX_RETRIES = 3
+_RETRY_BASE_SECONDS = 0.5
+_RETRY_MAX_SECONDS = 8
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def _get_session():
+    """ a keep-alive session shared by every client in the process, so that calls reuse pooled connections """
+    global _session
+    with _session_lock:
+        if not _session:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=8, pool_maxsize=16)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            session.headers['Accept-Encoding'] = 'gzip, deflate'
+            _session = session
+    return _session
+
+
+def _send(method, url, **kwargs):
+    """ sends a request on the shared session, retrying transient failures """
+    idempotent = method.lower() in _IDEMPOTENT_METHODS
+    for attempt in range(_MAX_RETRIES + 1):
+        try:
+            response = _get_session().request(method, url, **kwargs)
+            if attempt == _MAX_RETRIES or not idempotent or response.status_code not in _RETRY_STATUSES:
+                return response
+            reason = 'status %s' % response.status_code
+            response.close()
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+            if attempt == _MAX_RETRIES or not (idempotent or _never_connected(e)):
+                raise
+            reason = str(e)
+        # "full jitter" exponential backoff, so that many engines do not retry in lockstep
+        sleep_seconds = random.uniform(0, min(_RETRY_MAX_SECONDS, _RETRY_BASE_SECONDS * 2 ** attempt))
+        _logger.warning('retrying %s %s in %.2f seconds (%s)' % (method.upper(), url, sleep_seconds, reason))
+        time.sleep(sleep_seconds)
+
+
+def _never_connected(e):
+    """ :return: whether the request failed before a connection was made, in which case it was never sent """
+    if isinstance(e, requests.exceptions.ConnectTimeout):
+        return True
+    # requests wraps the urllib3 error, which wraps the socket error, e.g.
+    # ConnectionError(ProtocolError('Connection aborted.', error(111, 'Connection refused')))
+    causes = list(e.args)
+    while causes:
+        cause = causes.pop()
+        if isinstance(cause, (socket.gaierror, ConnectTimeoutError)):
+            return True
+        if isinstance(cause, socket.error) and cause.errno == errno.ECONNREFUSED:
+            return True
+        if isinstance(cause, Exception):
+            causes.extend(cause.args)
+            causes.extend([cause.reason] if getattr(cause, 'reason', None) else [])
+    return False
+
 
 class Dart(object):
     def __init__(self, host, port=80, api_version=1):
@@ -121,6 +196,11 @@ class Dart(object):
             :rtype: dart.model.dataset.Dataset """
         return self._request('get', '/dataset/%s' % dataset_id, model_class=Dataset)
 
+    def get_datasets_by_ids(self, dataset_ids):
+        """ :type dataset_ids: list[str]
+            :rtype: list[dart.model.dataset.Dataset] """
+        return self._get_by_ids('/dataset', dataset_ids, Dataset)
+
     def delete_dataset(self, dataset_id):
         """ :type dataset_id: str """
         self._get_response_data('delete', '/dataset/%s' % dataset_id)
@@ -137,6 +217,11 @@ class Dart(object):
             :rtype: dart.model.datastore.Datastore """
         return self._request('get', '/datastore/%s' % datastore_id, model_class=Datastore)
 
+    def get_datastores_by_ids(self, datastore_ids):
+        """ :type datastore_ids: list[str]
+            :rtype: list[dart.model.datastore.Datastore] """
+        return self._get_by_ids('/datastore', datastore_ids, Datastore)
+
     def patch_datastore(self, datastore, **data_properties):
         """ :type action: dart.model.datastore.Datastore
             :rtype: dart.model.datastore.Datastore """
@@ -153,6 +238,16 @@ class Dart(object):
         p = self._get_patch(action, data_properties)
         return self._request('patch', '/action/%s' % action.id, data=p.patch, model_class=Action)
 
+    def patch_actions(self, actions_and_data_properties):
+        """ patches several actions in one request, each as patch_action would
+            :param actions_and_data_properties: a list of (action, dict of data properties) tuples
+            :rtype: list[dart.model.action.Action] """
+        data = [{'id': a.id, 'patch': self._get_patch(a, data_properties).patch}
+                for a, data_properties in actions_and_data_properties]
+        if not data:
+            return []
+        return self._request_list('patch', '/action', data=data, model_class=Action)
+
     @staticmethod
     def _get_patch(model, data_properties):
         updated_model_dict = model.to_dict()
@@ -189,6 +284,11 @@ class Dart(object):
             :rtype: dart.model.action.Action """
         return self._request('get', '/action/%s' % action_id, model_class=Action)
 
+    def get_actions_by_ids(self, action_ids):
+        """ :type action_ids: list[str]
+            :rtype: list[dart.model.action.Action] """
+        return self._get_by_ids('/action', action_ids, Action)
+
     def find_actions(self, filters=None):
         """ :type filters: list[dart.model.query.Filter]
             :rtype: list[dart.model.action.Action] """
@@ -303,6 +403,11 @@ class Dart(object):
             :rtype: dart.model.subscription.Subscription """
         return self._request('get', '/subscription/%s' % subscription_id, model_class=Subscription)
 
+    def get_subscriptions_by_ids(self, subscription_ids):
+        """ :type subscription_ids: list[str]
+            :rtype: list[dart.model.subscription.Subscription] """
+        return self._get_by_ids('/subscription', subscription_ids, Subscription)
+
     def assign_subscription_elements(self, action_id):
         """ :type action_id: str """
         return self._request('get', '/action/%s/subscription/assign' % action_id)
@@ -317,8 +422,8 @@ class Dart(object):
         :returns True if the subscription has activated
         """
         for _ in xrange(retries+1):
-            response = requests.post(
-                url='{}/GetSubscription'.format(config.get('nudge').get('host_url')),
+            response = _send(
+                'post', '{}/GetSubscription'.format(config.get('nudge').get('host_url')),
                 json={'SubscriptionId': nudge_sub_id},
             )
 
@@ -340,8 +445,7 @@ class Dart(object):
         json_body = {
             'SubscriptionId': nudge_subscription_id
         }
-        return requests.post(url='%s/CreateBatch' % host_url,
-                             json=json_body).json()
+        return _send('post', '%s/CreateBatch' % host_url, json=json_body).json()
 
     @staticmethod
     def get_nudge_batch_elements(nudge_subscription_id, batch_id):
@@ -352,8 +456,8 @@ class Dart(object):
         offset = 0
         host_url = config.get('nudge').get('host_url')
         while True:
-            response = requests.post(
-                url='%s/GetBatchElements' % host_url,
+            response = _send(
+                'post', '%s/GetBatchElements' % host_url,
                 json={
                     'SubscriptionId': nudge_subscription_id,
                     'BatchId': batch_id,
@@ -381,8 +485,7 @@ class Dart(object):
         }
         if prev_batch_id:
             json_body['PreviousBatchId'] = prev_batch_id
-        return requests.post(url='%s/GetSubscriptionBatches' % host_url,
-                             json=json_body).json()['Batches']
+        return _send('post', '%s/GetSubscriptionBatches' % host_url, json=json_body).json()['Batches']
 
     @staticmethod
     def ack_nudge_elements(nudge_subscription_id, batch_id):
@@ -394,45 +497,31 @@ class Dart(object):
             'SubscriptionId': nudge_subscription_id,
             'BatchId': batch_id,
         }
-        return requests.post(url='%s/Consume' % host_url,
-                             json=json_body).json()
+        return _send('post', '%s/Consume' % host_url, json=json_body).json()
 
-    def get_subscription_elements(self, action_id):
+    def get_subscription_elements(self, action_id, fields=None):
         """ :type action_id: str
+            :param fields: the element fields to fetch (all of them by default), the others are left as None
+            :type fields: list[str]
             :rtype: list[dart.model.subscription.SubscriptionElement] """
-        limit = 10000
-        offset = 0
-        while True:
-            params = {'limit': limit, 'offset': offset}
-            results = self._request_list('get', '/action/%s/subscription/elements' % action_id, params=params,
-                                         model_class=SubscriptionElement)
-            if len(results) == 0:
-                break
-            for e in results:
-                yield e
-            offset += limit
+        params = {'fields': ','.join(fields) if fields else None}
+        return self._request_stream('/action/%s/subscription/elements' % action_id, params=params,
+                                    model_class=SubscriptionElement)
 
-    def find_subscription_elements(self, subscription_id, state=None, processed_after_s3_path=None):
+    def find_subscription_elements(self, subscription_id, state=None, processed_after_s3_path=None, fields=None):
         """ :type subscription_id: str
             :type state: str
             :type processed_after_s3_path: str
+            :param fields: the element fields to fetch (all of them by default), the others are left as None
+            :type fields: list[str]
             :rtype: list[dart.model.subscription.SubscriptionElement] """
-        limit = 10000
-        offset = 0
-        while True:
-            params = {
-                'limit': limit,
-                'offset': offset,
-                'state': state,
-                'processed_after_s3_path': processed_after_s3_path if processed_after_s3_path else None
-            }
-            results = self._request_list('get', '/subscription/%s/elements' % subscription_id, params=params,
-                                         model_class=SubscriptionElement)
-            if len(results) == 0:
-                break
-            for e in results:
-                yield e
-            offset += limit
+        params = {
+            'state': state,
+            'processed_after_s3_path': processed_after_s3_path if processed_after_s3_path else None,
+            'fields': ','.join(fields) if fields else None,
+        }
+        return self._request_stream('/subscription/%s/elements' % subscription_id, params=params,
+                                    model_class=SubscriptionElement)
 
     def get_subscription_element_stats(self, subscription_id):
         """ :type subscription_id: str
@@ -497,12 +586,8 @@ class Dart(object):
         return self._request('get', '/graph/%s/%s' % (entity_type, entity_id), model_class=Graph)
 
     def _get_response_data(self, method, url_prefix, data=None, params=None):
-        basic_auth_signature = encode(self._credential, self._secret)
-        headers = {
-            'Authorization': basic_auth_signature
-        }
-        response = requests.request(method, self._base_url + '/' + url_prefix.lstrip('/'), headers=headers, json=data,
-                                    params=params, verify=False)
+        response = _send(method, self._base_url + '/' + url_prefix.lstrip('/'), headers=self._headers(), json=data,
+                         params=params, verify=False)
         try:
             data = response.json()
             if data['results'] == 'ERROR':
@@ -518,3 +603,35 @@ class Dart(object):
     def _request_list(self, method, url_prefix=None, data=None, params=None, model_class=None):
         elements = self._get_response_data(method, url_prefix, data, params)
         return [model_class.from_dict(e) for e in elements]
+
+    def _get_by_ids(self, url_prefix, ids, model_class):
+        """ fetches the models with these ids through the filters of a list endpoint, in the order of the ids """
+        ids = list(ids)
+        models_by_id = {}
+        for i in range(0, len(ids), _IDS_PER_REQUEST):
+            batch = ids[i:i + _IDS_PER_REQUEST]
+            params = {'limit': len(batch), 'offset': 0, 'filters': json.dumps(['id IN %s' % ','.join(batch)])}
+            for m in self._request_list('get', url_prefix, params=params, model_class=model_class):
+                models_by_id[m.id] = m
+        return [models_by_id[i] for i in ids if i in models_by_id]
+
+    def _request_stream(self, url_prefix, params=None, model_class=None):
+        """ yields the models of a newline delimited json response as they arrive """
+        params = dict(params or {}, format='ndjson')
+        response = _send('get', self._base_url + '/' + url_prefix.lstrip('/'), headers=self._headers(),
+                         params=params, verify=False, stream=True)
+        if response.status_code != 200:
+            raise DartRequestException(response)
+        with closing(response):
+            for line in response.iter_lines(chunk_size=65536):
+                if not line:
+                    continue
+                value = json.loads(line)
+                if 'end' in value:
+                    return
+                yield model_class.from_dict(value)
+        # the server always ends a complete response with an "end" line
+        raise DartRequestException(response, 'the response ended before all elements were received')
+
+    def _headers(self):
+        return {'Authorization': encode(self._credential, self._secret)}
@@ -159,9 +159,10 @@ class PartialEnvironmentCreateTool(DeploymentTool):
         time.sleep(5)
 
         _logger.info('creating database triggers')
-        with open(dart_root_relative_path('src', 'database', 'triggers.sql')) as f:
-            engine = sqlalchemy.create_engine('postgresql://dart:%s@%s:5432/dart' % (rds_pwd, rds_host))
-            engine.execute(f.read())
+        engine = sqlalchemy.create_engine('postgresql://dart:%s@%s:5432/dart' % (rds_pwd, rds_host))
+        for sql_file in ['triggers.sql', 'entity_edge.sql']:
+            with open(dart_root_relative_path('src', 'database', sql_file)) as f:
+                engine.execute(f.read())
         _logger.info('done')
         time.sleep(5)
 
@@ -7,9 +7,9 @@ from dart.engine.emr.mappings import dynamodb_column_type
 
 from dart.engine.emr.step_runner import run_steps
 from dart.engine.emr.steps import prepare_step_paths, python_fix_partition_folder_names, hive_copy_to_table, \
-    impala_copy_to_table, hive_run_script_contents_step, StepWrapper
+    impala_copy_to_table, hive_run_script_contents_step, StepWrapper, LoadedPartitions
 from dart.engine.emr.steps import s3distcp_files_step, hive_table_definition_step,\
-    hive_msck_repair_table_step, impala_invalidate_metadata_step
+    hive_add_partitions_step, impala_refresh_partitions_step
 from dart.model.dataset import Dataset, DataFormat, RowFormat, DataType, FileFormat, Compression, Column
 from dart.util.s3 import yield_s3_keys, get_s3_path, s3_copy_recursive
 from dart.util.s3 import get_bucket
@@ -75,10 +75,14 @@ def prepare_load_dataset_steps(dry_run, args_by_name, datastore, dataset, action
         step_funcs = []
         i = 1
 
+        # the partitions touched are known once the s3distcp step has read the s3 paths, which is before the steps
+        # registering them are created
+        loaded_partitions = LoadedPartitions(dataset, s3_path_and_file_size_gen)
+
         # ------------------------------------------------------------------------------------------------------------
         # all code paths below require copying the data to HDFS, and lowercasing the table is required because of hive
         # ------------------------------------------------------------------------------------------------------------
-        i = add_to(step_funcs, i, s3distcp_files_step, s3_path_and_file_size_gen, first_table_name.lower(), dataset, s3_step_path, local_step_path, action_id)
+        i = add_to(step_funcs, i, s3distcp_files_step, loaded_partitions, first_table_name.lower(), dataset, s3_step_path, local_step_path, action_id)
 
         # ------------------------------------------------------------------------------------------------------------
         # not all folder structures on s3 are hive compatible... if not, rename directories after copying
@@ -100,7 +104,7 @@ def prepare_load_dataset_steps(dry_run, args_by_name, datastore, dataset, action
 
             i = add_to(step_funcs, i, hive_table_definition_step, stage_table_name, dataset, s3_step_path, local_step_path, action_id, False)
             i = add_to(step_funcs, i, hive_table_definition_step, target_table_name, dyn_dataset, s3_step_path, local_step_path, action_id, True)
-            i = add_to(step_funcs, i, hive_msck_repair_table_step, stage_table_name, s3_step_path, action_id)
+            i = add_to(step_funcs, i, hive_add_partitions_step, stage_table_name, dataset, loaded_partitions, s3_step_path, local_step_path, action_id)
             i = add_to(step_funcs, i, hive_copy_to_table, dataset, stage_table_name, dyn_dataset, target_table_name, s3_step_path, local_step_path, action_id, set_hive_vars)
 
         # ------------------------------------------------------------------------------------------------------------
@@ -108,7 +112,7 @@ def prepare_load_dataset_steps(dry_run, args_by_name, datastore, dataset, action
         # ------------------------------------------------------------------------------------------------------------
         elif staging_not_needed:
             i = add_to(step_funcs, i, hive_table_definition_step, target_table_name, dataset, s3_step_path, local_step_path, action_id, False)
-            i = add_to(step_funcs, i, hive_msck_repair_table_step, target_table_name, s3_step_path, action_id)
+            i = add_to(step_funcs, i, hive_add_partitions_step, target_table_name, dataset, loaded_partitions, s3_step_path, local_step_path, action_id)
 
         # ------------------------------------------------------------------------------------------------------------
         # one or more staging tables are needed
@@ -133,7 +137,7 @@ def prepare_load_dataset_steps(dry_run, args_by_name, datastore, dataset, action
 
             i = add_to(step_funcs, i, hive_table_definition_step, stage_table_name, stage_dataset, s3_step_path, local_step_path, action_id, False)
             i = add_to(step_funcs, i, hive_table_definition_step, target_table_name, target_dataset, s3_step_path, local_step_path, action_id, False)
-            i = add_to(step_funcs, i, hive_msck_repair_table_step, stage_table_name, s3_step_path, action_id)
+            i = add_to(step_funcs, i, hive_add_partitions_step, stage_table_name, dataset, loaded_partitions, s3_step_path, local_step_path, action_id)
 
             # --------------------------------------------------------------------------------------------------------
             # hive has issues creating parquet files
@@ -182,7 +186,7 @@ def prepare_load_dataset_steps(dry_run, args_by_name, datastore, dataset, action
         # inform impala about changes
         # ------------------------------------------------------------------------------------------------------------
         if not target_is_dynamodb:
-            i = add_to(step_funcs, i, impala_invalidate_metadata_step, s3_step_path, action_id)
+            i = add_to(step_funcs, i, impala_refresh_partitions_step, target_table_name, dataset, loaded_partitions, s3_step_path, local_step_path, action_id)
 
         total_steps = i - 1
         steps = []
@@ -1,54 +1,158 @@
-import re
+import logging
 import time
+
+import dateutil.parser
+from boto.emr.emrobject import ClusterStatus, EmrObject, StepSummary, StepSummaryList
+from boto.resultset import ResultSet
+
 from dart.model.exception import DartActionException
 
+_logger = logging.getLogger(__name__)
+
+# the ListSteps StepIds filter takes at most 10 ids
+_MAX_STEP_IDS_PER_LIST = 10
+_MIN_POLL_SECONDS = 5
+_MAX_POLL_SECONDS = 60
+# a step is polled again after this fraction of the time it has been running, so short steps are noticed quickly
+# and long ones are not polled more often than their duration warrants
+_POLL_FRACTION = 0.1
+_ACTIVE_STATES = ['PENDING', 'RUNNING']
+
 
 def run_steps(emr_engine, datastore, action, step_wrappers):
     """
+    Submits the steps to the cluster in one request and tracks them until they all complete.  EMR runs them one
+    after another.  If one fails, the action's remaining steps are cancelled (only those, since other actions may
+    have steps queued on the same cluster).  Progress is patched onto the action as each step completes, along with
+    how long each step ran according to EMR (in extra_data['emr_steps']).
+
     :type emr_engine: dart.engine.emr.emr.EmrEngine
     :type datastore: dart.model.datastore.Datastore
     :type action: dart.model.action.Action
     :type step_wrappers: list[dart.engine.emr.steps.StepWrapper]
     """
-    for step_wrapper in step_wrappers:
+    if not step_wrappers:
+        return
+    cluster_id = datastore.data.extra_data['cluster_id']
+    try:
+        result = emr_engine.conn.add_jobflow_steps(cluster_id, [sw.step for sw in step_wrappers])
+        step_ids = [step_id.value for step_id in result.stepids]
+    except Exception as e:
+        raise DartActionException(e.message, step_wrappers[0])
+
+    pending = zip(step_ids, step_wrappers)
+    durations = []
+    # the poll interval follows how long the current step has been tracked, so it restarts as each step completes
+    started = time.time()
+    while pending:
+        time.sleep(_poll_seconds(time.time() - started))
         try:
-            run_step(emr_engine, datastore, action, step_wrapper)
+            summaries = _get_step_summaries(emr_engine.conn, cluster_id,
+                                            [i for i, sw in pending[:_MAX_STEP_IDS_PER_LIST]])
         except Exception as e:
-            raise DartActionException(e.message, step_wrapper)
+            raise DartActionException(e.message, pending[0][1])
+
+        states = {step_id: s.status.state for step_id, s in summaries.items()}
+        completed = 0
+        while pending and states.get(pending[0][0]) == 'COMPLETED':
+            step_id, step_wrapper = pending.pop(0)
+            seconds = _run_seconds(summaries[step_id])
+            durations.append({'step_num': step_wrapper.step_num, 'name': step_wrapper.step.name, 'seconds': seconds})
+            _logger.info('action (id=%s) completed step %s of %s in %s seconds'
+                         % (action.id, step_wrapper.step_num, step_wrapper.steps_total, seconds))
+            started = time.time()
+            completed += 1
+        if completed:
+            try:
+                _patch_progress(emr_engine, action, step_wrapper.step_num, step_wrapper.steps_total, durations)
+            except Exception as e:
+                raise DartActionException(e.message, step_wrapper)
+
+        if pending and states.get(pending[0][0]) not in _ACTIVE_STATES:
+            step_id, step_wrapper = pending[0]
+            _cancel_steps(emr_engine.conn, cluster_id, [i for i, sw in pending[1:]])
+            values = (action.id, step_wrapper.step_num, states.get(step_id))
+            raise DartActionException('action (id=%s) failed on step %s with state: %s' % values, step_wrapper)
 
 
-def run_step(emr_engine, datastore, action, step_wrapper):
+def _poll_seconds(running_seconds):
+    return min(_MAX_POLL_SECONDS, max(_MIN_POLL_SECONDS, running_seconds * _POLL_FRACTION))
+
+
+def _get_step_summaries(conn, cluster_id, step_ids):
     """
-    :type emr_engine: dart.engine.emr.emr.EmrEngine
-    :type datastore: dart.model.datastore.Datastore
-    :type action: dart.model.action.Action
-    :type step_wrapper: dart.engine.emr.steps.StepWrapper
+    boto's list_steps cannot filter by step id, so this makes the ListSteps request itself
+
+    :type conn: boto.emr.EmrConnection
+    :return: step id -> step summary
     """
-    cluster_id = datastore.data.extra_data['cluster_id']
-    emr_engine.conn.add_jobflow_steps(cluster_id, step_wrapper.step)
-    while True:
-        time.sleep(30)
-        # http://docs.aws.amazon.com/ElasticMapReduce/latest/DeveloperGuide/emr-steps.html
-        step_state = _get_step_state(action, step_wrapper, emr_engine.conn.list_steps(cluster_id))
-        if step_state == 'COMPLETED':
-            progress = "%.2f" % round(float(step_wrapper.step_num) / float(step_wrapper.steps_total), 2)
-            updated_action = emr_engine.dart.patch_action(action, progress=progress)
-
-            # do this so callers see an in-place update of the action
-            action.data = updated_action.data
-
-            return
-        elif step_state not in ['RUNNING', 'PENDING']:
-            values = (action.id, step_wrapper.step_num, step_state)
-            raise Exception('action (id=%s) failed on step %s with state: %s' % values)
-
-
-def _get_step_state(action, step_wrapper, emr_steps_summary):
-    for emr_step in emr_steps_summary.steps:
-        m = re.search(r'\(action_id=(.+?),step_num=(.+?),steps_total=(.+?)\)', emr_step.name)
-        if not m:
-            continue
-        action_id, step_num, steps_total = m.group(1), int(m.group(2)), int(m.group(3))
-        if action_id != action.id or step_num != step_wrapper.step_num:
-            continue
-        return emr_step.status.state
+    params = {'ClusterId': cluster_id}
+    conn.build_list_params(params, step_ids, 'StepIds.member')
+    summary = conn.get_object('ListSteps', params, _StepSummaryList)
+    return {s.id: s for s in summary.steps}
+
+
+def _run_seconds(step_summary):
+    """ how long EMR says the step ran, which leaves out the time it was queued behind other steps """
+    timeline = step_summary.status.timeline
+    if not timeline or not timeline.startdatetime or not timeline.enddatetime:
+        return None
+    delta = dateutil.parser.parse(timeline.enddatetime) - dateutil.parser.parse(timeline.startdatetime)
+    return round(delta.total_seconds(), 1)
+
+
+def _cancel_steps(conn, cluster_id, step_ids):
+    """
+    Cancels steps that have not started yet.  Steps are submitted with ActionOnFailure=CONTINUE, because
+    CANCEL_AND_WAIT would cancel the pending steps of every action on the cluster, so the action's own steps are
+    cancelled here instead.  boto has no CancelSteps call, so this makes the request itself.
+
+    :type conn: boto.emr.EmrConnection
+    """
+    if not step_ids:
+        return
+    params = {'ClusterId': cluster_id}
+    conn.build_list_params(params, step_ids, 'StepIds.member')
+    try:
+        conn.get_status('CancelSteps', params)
+    except Exception:
+        _logger.exception('failed to cancel steps %s on cluster %s' % (step_ids, cluster_id))
+
+
+class _StepTimeline(EmrObject):
+    # boto parses step timelines as cluster timelines, which have no StartDateTime
+    Fields = set(['CreationDateTime', 'StartDateTime', 'EndDateTime'])
+
+
+class _StepStatus(ClusterStatus):
+    def startElement(self, name, attrs, connection):
+        if name == 'Timeline':
+            self.timeline = _StepTimeline()
+            return self.timeline
+        return super(_StepStatus, self).startElement(name, attrs, connection)
+
+
+class _StepSummary(StepSummary):
+    def startElement(self, name, attrs, connection):
+        if name == 'Status':
+            self.status = _StepStatus()
+            return self.status
+        return super(_StepSummary, self).startElement(name, attrs, connection)
+
+
+class _StepSummaryList(StepSummaryList):
+    def startElement(self, name, attrs, connection):
+        if name == 'Steps':
+            self.steps = ResultSet([('member', _StepSummary)])
+            return self.steps
+        return super(_StepSummaryList, self).startElement(name, attrs, connection)
+
+
+def _patch_progress(emr_engine, action, step_num, steps_total, durations):
+    progress = "%.2f" % round(float(step_num) / float(steps_total), 2)
+    extra_data = dict(action.data.extra_data or {})
+    extra_data['emr_steps'] = list(durations)
+    updated_action = emr_engine.dart.patch_action(action, progress=progress, extra_data=extra_data)
+
+    # do this so callers see an in-place update of the action
+    action.data = updated_action.data
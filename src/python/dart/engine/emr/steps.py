@@ -2,7 +2,9 @@ import gzip
 import json
 import ntpath
 import os
+import re
 import shutil
+import urllib
 
 from boto.emr import JarStep as BotoJarStep
 
@@ -14,6 +16,10 @@ _title_data = lambda action_id, n, t: 'action_id=%s,step_num=%s,steps_total=%s'
 _hive_args = ['hive-script', '--run-hive-script', '--args', '-f']
 _script_runner_jar = 's3n://us-east-1.elasticmapreduce/libs/script-runner/script-runner.jar'
 _command_runner_jar = 'command-runner.jar'
+# partitions per ALTER TABLE ... ADD statement
+_partitions_per_statement = 100
+_integer_re = re.compile(r'^[+-]?\d+$')
+_decimal_re = re.compile(r'^[+-]?(\d+\.?\d*|\.\d+)([eE][+-]?\d+)?$')
 
 
 @dictable
@@ -56,6 +62,77 @@ def prepare_step_paths(datastore, tempdir):
     return local_step_path, s3_step_path, s3_temp_path
 
 
+class LoadedPartitions(object):
+    def __init__(self, dataset, s3_path_and_file_size_generator):
+        """
+        Passes the (s3_path, file_size) tuples of a load through, recording the partition folders they are in, so
+        that later steps can register just those partitions rather than rescanning the whole table.  The partitions
+        are unknown (None) if the dataset is not partitioned, a path is not under enough partition folders, or a
+        folder's value does not fit the type of its partition column.
+
+        :type dataset: dart.model.dataset.Dataset
+        """
+        self._dataset = dataset
+        self._s3_path_and_file_size_generator = s3_path_and_file_size_generator
+        self._partitions = set()
+        self._known = bool(dataset.data.partitions)
+
+    def __iter__(self):
+        for s3_path, file_size in self._s3_path_and_file_size_generator:
+            if self._known:
+                values = self._partition_values(s3_path)
+                if values is None:
+                    self._known = False
+                else:
+                    self._partitions.add(values)
+            yield s3_path, file_size
+
+    @property
+    def partitions(self):
+        """ :return: the sorted partition value tuples seen, or None if they are unknown """
+        return sorted(self._partitions) if self._known else None
+
+    def _partition_values(self, s3_path):
+        partitions = self._dataset.data.partitions
+        folders = s3_path.split(self._dataset.data.location + '/')[1].split('/')[:-1]
+        if len(folders) < len(partitions):
+            return None
+        values = []
+        for partition, folder in zip(partitions, folders):
+            if self._dataset.data.hive_compatible_partition_folders:
+                folder_name, sep, folder = folder.partition('=')
+                if not sep or folder_name.lower() != partition.name.lower():
+                    return None
+            # hive escapes special characters in partition folder names
+            value = urllib.unquote(folder)
+            if _partition_literal(partition, value) is None:
+                return None
+            values.append(value)
+        return tuple(values)
+
+
+def _partition_literal(column, value):
+    """
+    impala rejects quoted values for numeric partition columns, so values are written as literals of the column's type
+
+    :type column: dart.model.dataset.Column
+    :return: the literal, or None if the value does not fit the column's type
+    """
+    mapped_type = mapped_column_type(column)
+    if mapped_type in ['BIGINT', 'INT']:
+        return value if _integer_re.match(value) else None
+    if mapped_type in ['DOUBLE', 'FLOAT'] or mapped_type.startswith('DECIMAL'):
+        return value if _decimal_re.match(value) else None
+    if mapped_type == 'BOOLEAN':
+        return value.lower() if value.lower() in ['true', 'false'] else None
+    return "'%s'" % value.replace('\\', '\\\\').replace("'", "\\'")
+
+
+def _partition_spec(partitions, values):
+    literals = ['%s=%s' % (p.name, _partition_literal(p, v)) for p, v in zip(partitions, values)]
+    return 'PARTITION (%s)' % ', '.join(literals)
+
+
 def s3distcp_files_step(s3_path_and_file_size_generator, table_name, dataset, s3_step_path, local_step_path, action_id,
                         step_num, steps_total):
     values = (action_id, dataset.data.name, dataset.id)
@@ -291,6 +368,34 @@ def hive_msck_repair_table_step(table_name, s3_step_path, action_id, step_num, s
     )
 
 
+def hive_add_partitions_step(table_name, dataset, loaded_partitions, s3_step_path, local_step_path, action_id,
+                             step_num, steps_total):
+    """ registers the partitions the load touched, or repairs the whole table if they are not known """
+    partitions = loaded_partitions.partitions
+    if partitions is None:
+        return hive_msck_repair_table_step(table_name, s3_step_path, action_id, step_num, steps_total)
+
+    statements = []
+    for i in range(0, len(partitions), _partitions_per_statement):
+        specs = [_partition_spec(dataset.data.partitions, v) for v in partitions[i:i + _partitions_per_statement]]
+        statements.append('ALTER TABLE %s ADD IF NOT EXISTS\n  %s;' % (table_name, '\n  '.join(specs)))
+
+    hive_script_path = os.path.join(local_step_path, 'hive', 'add_partitions_%s.hql' % table_name)
+    with open(hive_script_path, 'w') as f:
+        f.write('\n'.join(statements) + '\n')
+
+    return StepWrapper(
+        JarStep(
+            name='dart: (%s) add_partitions_%s.hql' % (_title_data(action_id, step_num, steps_total), table_name),
+            jar=_command_runner_jar,
+            action_on_failure='CONTINUE',
+            step_args=_hive_args + [s3_step_path + '/hive/add_partitions_%s.hql' % table_name],
+        ),
+        step_num,
+        steps_total
+    )
+
+
 def hive_run_script_contents_step(script_contents, s3_step_path, local_step_path, action_id, step_num, steps_total):
     hive_script_path = os.path.join(local_step_path, 'hive', 'run_hive_script_%s.hql' % action_id)
     with open(hive_script_path, 'w') as f:
@@ -375,6 +480,37 @@ def impala_invalidate_metadata_step(s3_step_path, action_id, step_num, steps_tot
     )
 
 
+def impala_refresh_partitions_step(table_name, dataset, loaded_partitions, s3_step_path, local_step_path, action_id,
+                                   step_num, steps_total):
+    """ refreshes the partitions the load touched, or invalidates all metadata if they are not known """
+    partitions = loaded_partitions.partitions
+    if partitions is None and dataset.data.partitions:
+        return impala_invalidate_metadata_step(s3_step_path, action_id, step_num, steps_total)
+
+    if partitions is None:
+        statements = ['REFRESH %s;' % table_name]
+    else:
+        statements = ['REFRESH %s %s;' % (table_name, _partition_spec(dataset.data.partitions, v)) for v in partitions]
+    impala_script_path = os.path.join(local_step_path, 'impala', 'refresh_partitions_%s.sql' % table_name)
+    with open(impala_script_path, 'w') as f:
+        f.write('\n'.join(statements) + '\n')
+
+    return StepWrapper(
+        JarStep(
+            name='dart: (%s) refresh_partitions_%s.sql' % (_title_data(action_id, step_num, steps_total), table_name),
+            jar=_script_runner_jar,
+            action_on_failure='CONTINUE',
+            step_args=[
+                s3_step_path + '/python/refresh_impala_table.py',
+                s3_step_path + '/impala/refresh_partitions_%s.sql' % table_name,
+                table_name
+            ],
+        ),
+        step_num,
+        steps_total
+    )
+
+
 def pyspark_run_script_contents_step(script_contents, s3_step_path, local_step_path, action_id, step_num, steps_total):
     pyspark_script_path = os.path.join(local_step_path, 'misc', 'run_pyspark_script_%s.py' % action_id)
     with open(pyspark_script_path, 'w') as f:
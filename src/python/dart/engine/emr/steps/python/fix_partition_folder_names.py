@@ -1,16 +1,23 @@
 #!/usr/bin/env python27
 
-import sys
+import getpass
+import httplib
+import json
 import subprocess
+import sys
+import time
+import urllib
+import urlparse
 
 __author__ = 'dmcpherson'
 
 
-def call(cmd):
+def call(cmd, print_result=True):
     try:
         print cmd
         result = subprocess.check_output(cmd, stderr=subprocess.STDOUT, shell=True)
-        print result
+        if print_result:
+            print result
         return result
     except subprocess.CalledProcessError as e:
         print e.output
@@ -20,23 +27,84 @@ hdfs_root = sys.argv[1].rstrip('/')
 partition_names = sys.argv[2].split(',')
 
 
-def rename_from_root(root, partitions):
-    if not partitions:
-        return
-
-    dir_lines = call('hdfs dfs -ls %s' % root)
-    for line in dir_lines.split('\n'):
-        parts = line.split()
+def list_directories(root, depth):
+    """ lists the tree once (a single JVM), returning the relative paths of directories down to the given depth """
+    directories = []
+    for line in call('hdfs dfs -ls -R %s' % root, print_result=False).split('\n'):
+        parts = line.split(None, 7)
         # skip lines without real file/dir data
-        if len(parts) < 8:
+        if len(parts) < 8 or line[0] != 'd':
             continue
+        path = parts[7].strip()
+        relative = path.split(urlparse.urlparse(root).path + '/', 1)[-1]
+        if len(relative.split('/')) <= depth:
+            directories.append(relative)
+    return directories
+
+
+def plan_renames(directories, partitions):
+    """
+    Folder n levels down is renamed to partitions[n]=folder.  Renames are listed parents first, with the paths the
+    folders will have by then, so applying them in order moves every folder once.  Folders already named after their
+    partition are left alone, so running this again after a failure finishes the job.
+    """
+    renames = []
+    for relative in sorted(directories, key=lambda d: (d.count('/'), d)):
+        folders = relative.split('/')
+        renamed = ['%s=%s' % (p, f) if not f.startswith(p + '=') else f for p, f in zip(partitions, folders)]
+        if renamed[-1] != folders[-1]:
+            renames.append(('/'.join(renamed[:-1] + folders[-1:]), '/'.join(renamed)))
+    return renames
+
+
+class WebHdfsClient(object):
+    """ renames over one keep-alive connection to the namenode's webhdfs api, rather than a JVM per rename """
+    def __init__(self):
+        address = call('hdfs getconf -confKey dfs.namenode.http-address').strip().split('\n')[-1]
+        host, port = address.rsplit(':', 1)
+        self._conn = httplib.HTTPConnection('localhost' if host == '0.0.0.0' else host, int(port), timeout=60)
+        self._user_name = getpass.getuser()
+
+    def get_file_status(self, path):
+        return self._request('GET', path, {'op': 'GETFILESTATUS'})
+
+    def rename(self, src, dest):
+        if not self._request('PUT', src, {'op': 'RENAME', 'destination': dest}).get('boolean'):
+            raise Exception('failed to rename %s to %s' % (src, dest))
+
+    def _request(self, method, path, params):
+        params = urllib.urlencode(dict(params, **{'user.name': self._user_name}))
+        self._conn.request(method, '/webhdfs/v1%s?%s' % (urllib.quote(path), params))
+        response = self._conn.getresponse()
+        body = response.read()
+        if response.status != 200:
+            raise Exception('webhdfs %s %s failed: %s %s' % (method, path, response.status, body))
+        return json.loads(body)
+
+
+def get_rename_function(root):
+    root_path = urlparse.urlparse(root).path
+    try:
+        client = WebHdfsClient()
+        client.get_file_status(root_path)
+        return lambda src, dest: client.rename(root_path + '/' + src, root_path + '/' + dest)
+    except Exception as e:
+        print 'webhdfs is not available (%s), renaming with hdfs dfs -mv' % e
+        return lambda src, dest: call('hdfs dfs -mv "%s/%s" "%s/%s"' % (root, src, root, dest))
+
+
+def apply_renames(root, renames):
+    if not renames:
+        return
+    rename = get_rename_function(root)
+    start = time.time()
+    for i, (src, dest) in enumerate(renames, 1):
+        rename(src, dest)
+        if i % 1000 == 0 or i == len(renames):
+            print 'renamed %s of %s folders in %.1f seconds' % (i, len(renames), time.time() - start)
+            sys.stdout.flush()
 
-        if line[0] == 'd':
-            file_path = parts[-1]
-            dir_name = file_path.split('/')[-1]
-            prefix = file_path.rsplit(dir_name, 1)[0].rstrip('/')
-            new_path = prefix + '/' + partitions[0] + '=' + dir_name
-            call('hdfs dfs -mv %s %s' % (file_path, new_path))
-            rename_from_root(new_path, partitions[1:])
 
-rename_from_root(hdfs_root, partition_names)
+planned_renames = plan_renames(list_directories(hdfs_root, len(partition_names)), partition_names)
+print 'renaming %s folders under %s' % (len(planned_renames), hdfs_root)
+apply_renames(hdfs_root, planned_renames)
@@ -0,0 +1,29 @@
+#!/usr/bin/env python27
+
+import subprocess
+import sys
+
+
+def call(cmd):
+    try:
+        print cmd
+        result = subprocess.check_output(cmd, stderr=subprocess.STDOUT, shell=True)
+        print result
+        return result
+    except subprocess.CalledProcessError as e:
+        print e.output
+        raise e
+
+
+s3_key = sys.argv[1]
+table_name = sys.argv[2].lower()
+file_name = s3_key.split('/')[-1]
+impala_script = '/tmp/%s' % file_name
+
+# REFRESH only works for tables impala already knows about, so a table new to impala is loaded instead
+tables = call('impala-shell -B -q "SHOW TABLES LIKE \'%s\'"' % table_name)
+if table_name in [line.strip().lower() for line in tables.split('\n')]:
+    call('aws s3 cp %s %s' % (s3_key, impala_script))
+    call('impala-shell -f %s' % impala_script)
+else:
+    call('impala-shell -q "INVALIDATE METADATA %s"' % table_name)
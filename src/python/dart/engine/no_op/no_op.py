@@ -35,7 +35,7 @@ class NoOpEngine(ActionRunner):
                 error_message = '%s failed as expected' % NoOpActionTypes.action_that_fails.name
 
             if action.data.action_type_name == NoOpActionTypes.consume_subscription.name:
-                subscription_elements = self.dart.get_subscription_elements(action.id)
+                subscription_elements = self.dart.get_subscription_elements(action.id, fields=['s3_path'])
                 _logger.info('consuming subscription, size = %s' % len(list(subscription_elements)))
 
         except Exception as e:
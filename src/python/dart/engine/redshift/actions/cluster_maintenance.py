@@ -1,7 +1,8 @@
 import logging
+import time
 
 from dart.engine.redshift.admin.cluster import RedshiftCluster
-from dart.engine.redshift.admin.utils import sanitized_query
+from dart.engine.redshift.command.maintenance import MaintenanceRunner
 _logger = logging.getLogger(__name__)
 
 
@@ -11,6 +12,7 @@ def cluster_maintenance (redshift_engine, datastore, action):
     :type datastore: dart.model.datastore.Datastore
     :type action: dart.model.action.Action
     """
+    start_time = time.time()
     cluster = RedshiftCluster(redshift_engine, datastore)
     conn = cluster.get_db_connection()
     try:
@@ -33,80 +35,26 @@ def cluster_maintenance (redshift_engine, datastore, action):
                 conn.execute(sql.format(*args))
 
         action = redshift_engine.dart.patch_action(action, progress=.3)
-        if(action.data.args['Vacuum']):
-            if(not check_if_vacuum_is_running(conn)):
-                run_vacuum(conn)
-        action = redshift_engine.dart.patch_action(action, progress=.6)
-        if(action.data.args['Analyze']):
-            run_analyze(conn)
+        run_vacuum = action.data.args['Vacuum'] and not check_if_vacuum_is_running(conn)
+        run_analyze = action.data.args['Analyze']
+        if run_vacuum or run_analyze:
+            budget_seconds = action.data.args.get('Time_Budget_Seconds')
+            runner = MaintenanceRunner(conn, cluster.get_db_connection,
+                                       start_time + budget_seconds if budget_seconds else None,
+                                       action.data.args.get('Analyze_Concurrency') or 4)
+            vacuums, analyzes = runner.load_plan()
+            _logger.info('planned %s vacuums and %s analyzes' % (len(vacuums) if run_vacuum else 0,
+                                                                 len(analyzes) if run_analyze else 0))
+            action = redshift_engine.dart.patch_action(action, progress=.4)
+            results = runner.run(vacuums if run_vacuum else [], analyzes if run_analyze else [])
+            extra_data = dict(action.data.extra_data or {}, maintenance=results)
+            action = redshift_engine.dart.patch_action(action, extra_data=extra_data)
 
         redshift_engine.dart.patch_action(action, progress=1)
-    except:
-        raise
+    finally:
+        conn.close()
 
 
-def run_analyze(conn):
-    statements = []
-    query = """SELECT DISTINCT 'analyze ' + feedback_tbl.schema_name + '."' + feedback_tbl.table_name + '" ; '
-                                    + '/* '+ ' Table Name : ' + info_tbl."schema" + '.\"' + info_tbl."table"
-                                        + '\", Stats_Off : ' + CAST(info_tbl."stats_off" AS VARCHAR(10)) + ' */ ;'
-            FROM ((SELECT TRIM(n.nspname) schema_name,
-                  c.relname table_name
-           FROM (SELECT TRIM(SPLIT_PART(SPLIT_PART(a.plannode,':',2),' ',2)) AS Table_Name,
-                        COUNT(a.query),
-                        DENSE_RANK() OVER (ORDER BY COUNT(a.query) DESC) AS qry_rnk
-                 FROM stl_explain a,
-                      stl_query b
-                 WHERE a.query = b.query
-                 AND   CAST(b.starttime AS DATE) >= dateadd (DAY,30,CURRENT_DATE)
-                 AND   a.userid > 1
-                 AND   a.plannode LIKE '%%missing statistics%%'
-                 AND   a.plannode NOT LIKE '%%_bkp_%%'
-                 GROUP BY Table_Name) miss_tbl
-             LEFT JOIN pg_class c ON c.relname = TRIM (miss_tbl.table_name)
-             LEFT JOIN pg_catalog.pg_namespace n ON n.oid = c.relnamespace
-           WHERE miss_tbl.qry_rnk <= 200)
-           -- Get the top N rank tables based on the stl_alert_event_log alerts
-           UNION
-           SELECT schema_name,
-                  table_name
-           FROM (SELECT TRIM(n.nspname) schema_name,
-                        c.relname table_name,
-                        DENSE_RANK() OVER (ORDER BY COUNT(*) DESC) AS qry_rnk,
-                        COUNT(*)
-                 FROM stl_alert_event_log AS l
-                   JOIN (SELECT query,
-                                tbl,
-                                perm_table_name
-                         FROM stl_scan
-                         WHERE perm_table_name <> 'Internal Worktable'
-                         GROUP BY query,
-                                  tbl,
-                                  perm_table_name) AS s ON s.query = l.query
-                   JOIN pg_class c ON c.oid = s.tbl
-                   JOIN pg_catalog.pg_namespace n ON n.oid = c.relnamespace
-                 WHERE l.userid > 1
-                 AND   l.event_time >= dateadd (DAY,30,CURRENT_DATE)
-                 AND   l.Solution LIKE '%%ANALYZE command%%'
-                 GROUP BY TRIM(n.nspname),
-                          c.relname) anlyz_tbl
-           WHERE anlyz_tbl.qry_rnk < 200) feedback_tbl
-      JOIN svv_table_info info_tbl
-        ON info_tbl.schema = feedback_tbl.schema_name
-       AND info_tbl.table = feedback_tbl.table_name
-    WHERE info_tbl.stats_off::DECIMAL (32,4) > 10::DECIMAL (32,4)
-
-    ORDER BY info_tbl.size ASC  ;"""
-    analyze_statements = list(conn.execute(query))
-
-    print analyze_statements
-    for analyze_statement in analyze_statements:
-        print analyze_statement
-        statements.append(analyze_statement[0])
-
-    if not run_commands(conn, statements):
-        return 'ERROR'
-
 def check_if_vacuum_is_running(conn):
     query = """Select count(1) from SVV_VACUUM_PROGRESS
                where time_remaining_estimate IS NOT NULL"""
@@ -115,70 +63,3 @@ def check_if_vacuum_is_running(conn):
         if int(row[0]) > 0:
             return True
     return False
-
-def run_vacuum(conn):
-    statements = []
-    query = """Select Distinct query from
-    (
-    SELECT  DISTINCT \"schema_name\", 'vacuum ' + \"schema_name\" + '.' + \"table_name\" + ';' as query
-    FROM   (SELECT TRIM(n.nspname)             schema_name,
-                   c.relname                   table_name,
-                   DENSE_RANK()
-                     OVER (
-                       ORDER BY COUNT(*) DESC) AS qry_rnk,
-                   Count(*)
-            FROM   stl_alert_event_log AS l
-                   JOIN (SELECT query,
-                                tbl,
-                                perm_table_name
-                         FROM   stl_scan
-                         WHERE  perm_table_name <> 'Internal Worktable'
-                         GROUP  BY query,
-                                   tbl,
-                                   perm_table_name) AS s
-                     ON s.query = l.query
-                   JOIN pg_class c
-                     ON c.oid = s.tbl
-                   JOIN PG_CATALOG.pg_namespace n
-                     ON n.oid = c.relnamespace
-            WHERE  l.userid > 1
-                   AND l.event_time >= DATEADD(DAY, 30  , CURRENT_DATE)
-                   AND l.Solution LIKE '%%VACUUM command%%'
-            GROUP  BY TRIM(n.nspname),
-                      c.relname) anlyz_tbl
-    WHERE  anlyz_tbl.qry_rnk < 200
-
-    UNION
-
-    SELECT DISTINCT \"schema\" as schema_name, 'vacuum ' + \"schema\" + '.' + \"table\" + ';' as query
-    FROM   svv_table_info
-    WHERE
-      ( unsorted > 10 OR stats_off > 10 )
-      )
-      where schema_name NOT IN ('metadata')
-      """
-    vacuum_statements = list(conn.execute(query))
-    print vacuum_statements
-    for vs in vacuum_statements:
-        print vs
-        statements.append(vs[0])
-
-    if not run_commands(conn, statements):
-        return 'ERROR'
-
-
-def run_commands(conn, commands):
-    for idx, c in enumerate(commands, start=1):
-        if c != None:
-
-            print('Running %s out of %s commands: %s' % (idx, len(commands), c))
-            try:
-                print(c)
-                conn.execution_options(isolation_level='AUTOCOMMIT').execute(c)
-                print('Success.')
-            except Exception as e:
-                # cowardly bail on errors
-                print e
-                return False
-
-    return True
\ No newline at end of file
@@ -3,6 +3,7 @@ import logging
 from datetime import datetime
 from dart.engine.redshift.admin.cluster import RedshiftCluster
 from dart.engine.redshift.command.copy import copy_from_s3, core_counts_by_instance_type
+from dart.engine.redshift.command.manifest import S3CopyFile
 from dart.engine.redshift.command.ddl import create_schemas_and_tables, create_tracking_schema_and_table, \
     get_tracking_schema_and_table_name
 from dart.model.subscription import SubscriptionElementState
@@ -22,7 +23,7 @@ def consume_subscription(redshift_engine, datastore, action):
     nudge_id = subscription.data.nudge_id
     dataset = dart.get_dataset(subscription.data.dataset_id)
     cluster = RedshiftCluster(redshift_engine, datastore)
-    batch_size = cluster.get_number_of_nodes() * core_counts_by_instance_type.get(datastore.data.args['node_type'])
+    slices = cluster.get_number_of_nodes() * core_counts_by_instance_type.get(datastore.data.args['node_type'])
     conn = cluster.get_db_connection()
     try:
         _logger.info('setting up schemas, tables, s3_path generator')
@@ -42,14 +43,11 @@ def consume_subscription(redshift_engine, datastore, action):
                         'Id': response['BatchId'],
                         'State': 'UNCONSUMED',
                     }]
-            s3_path_and_updated_generator = _nudge_s3_path_and_updated_generator(dart, nudge_id, nudge_batches)
+            s3_copy_file_generator = _nudge_s3_copy_file_generator(dart, nudge_id, nudge_batches)
         else:
             most_recent_s3_path = get_most_recently_processed_s3_path(conn, action)
-            s3_path_and_updated_generator = _s3_path_and_updated_generator(dart,
-                                                                           subscription.id,
-                                                                           action.id,
-                                                                           most_recent_s3_path)
-        copy_from_s3(dart, datastore, action, dataset, conn, batch_size, s3_path_and_updated_generator, nudge_id)
+            s3_copy_file_generator = _s3_copy_file_generator(dart, subscription.id, action.id, most_recent_s3_path)
+        copy_from_s3(dart, datastore, action, dataset, conn, slices, s3_copy_file_generator, nudge_id)
         if nudge_batches:
             for b in nudge_batches:
                 if b['State'] != 'CONSUMED':
@@ -70,22 +68,25 @@ def get_most_recently_processed_nudge_batch(conn, action):
     return result[0][0] if result else None
 
 
-def _s3_path_and_updated_generator(dart, subscription_id, action_id, processed_after_s3_path):
+def _s3_copy_file_generator(dart, subscription_id, action_id, processed_after_s3_path):
+    fields = ['s3_path', 'updated', 'file_size']
     # first process anything we have missed (e.g. the cluster has been restored from a backup)
     if processed_after_s3_path:
         for e in dart.find_subscription_elements(subscription_id,
                                                  SubscriptionElementState.CONSUMED,
-                                                 processed_after_s3_path):
-            yield e.s3_path, e.updated
+                                                 processed_after_s3_path,
+                                                 fields=fields):
+            yield S3CopyFile(e.s3_path, e.updated, e.file_size)
 
     dart.assign_subscription_elements(action_id)
-    for e in dart.get_subscription_elements(action_id):
-        yield e.s3_path, e.updated
+    for e in dart.get_subscription_elements(action_id, fields=fields):
+        yield S3CopyFile(e.s3_path, e.updated, e.file_size)
 
 
-def _nudge_s3_path_and_updated_generator(dart, nudge_subscription_id, batches):
+def _nudge_s3_copy_file_generator(dart, nudge_subscription_id, batches):
     for batch in batches:
         for e in dart.get_nudge_batch_elements(nudge_subscription_id, batch['Id']):
-            yield 's3://{bucket}/{key}'.format(bucket=e['Bucket'], key=e['Key']), \
-                  datetime.utcnow(), \
-                  batch['Id']
+            yield S3CopyFile('s3://{bucket}/{key}'.format(bucket=e['Bucket'], key=e['Key']),
+                             datetime.utcnow(),
+                             e.get('Size'),
+                             batch['Id'])
@@ -13,7 +13,8 @@ def data_check(redshift_engine, datastore, action):
     :type action: dart.model.action.Action
     """
     cluster = RedshiftCluster(redshift_engine, datastore)
-    conn = cluster.get_db_connection()
+    # user SQL may leave session state, such as temporary tables, behind
+    conn = cluster.get_db_connection(reusable=False)
     try:
         action = redshift_engine.dart.patch_action(action, progress=.1)
         result = list(conn.execute(sanitized_query(action.data.args['sql_script'])))[0][0]
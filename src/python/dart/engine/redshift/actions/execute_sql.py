@@ -13,7 +13,8 @@ def execute_sql(redshift_engine, datastore, action):
     :type action: dart.model.action.Action
     """
     cluster = RedshiftCluster(redshift_engine, datastore)
-    conn = cluster.get_db_connection()
+    # user SQL may leave session state, such as temporary tables, behind
+    conn = cluster.get_db_connection(reusable=False)
     txn = conn.begin()
     try:
         action = redshift_engine.dart.patch_action(action, progress=.1)
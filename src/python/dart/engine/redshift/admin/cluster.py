@@ -4,7 +4,7 @@ import logging
 import boto3
 from botocore.exceptions import ClientError, WaiterError
 from retrying import retry
-import sqlalchemy
+from dart.engine.redshift.admin.pool import redshift_engine_pool
 from dart.model.datastore import Datastore
 
 _logger = logging.getLogger(__name__)
@@ -32,6 +32,11 @@ class RedshiftCluster(object):
         dsid = datastore.data.workflow_datastore_id or self.datastore.id
         self.password_key = 'dart-datastore-%s-master_user_password' % dsid
 
+        # keys of the lookups memoized by redshift_engine_pool, which are forgotten when the cluster is stopped
+        self._endpoint_key = ('endpoint', self.cluster_identifier)
+        self._number_of_nodes_key = ('number_of_nodes', self.cluster_identifier)
+        self._password_key = ('password', self.password_key)
+
     def start_or_resume(self, snapshot_name=None):
         if self.cluster_exists():
             _logger.info("**** cluster %s: is already running" % self.cluster_identifier)
@@ -83,6 +88,9 @@ class RedshiftCluster(object):
             raise Exception('redshift cluster with identifier %s was not found' % self.cluster_identifier)
 
         _logger.info("Stopping cluster %s" % self.cluster_identifier)
+        host, port, db = self.get_host_port_db()
+        redshift_engine_pool.dispose_engine(host, port, db, self.master_user_name)
+        redshift_engine_pool.forget(self._endpoint_key, self._number_of_nodes_key, self._password_key)
 
         boto3.client('redshift').delete_cluster(
             ClusterIdentifier=self.cluster_identifier,
@@ -110,21 +118,27 @@ class RedshiftCluster(object):
             )
 
     def get_number_of_nodes(self):
-        response = boto3.client('redshift').describe_clusters(ClusterIdentifier=self.cluster_identifier)
-        return response['Clusters'][0]['NumberOfNodes']
+        return redshift_engine_pool.memoize(self._number_of_nodes_key,
+                                            lambda: self.describe_cluster()['NumberOfNodes'])
 
     def get_host_port_db(self):
-        cluster = self.describe_cluster()
-        host = cluster['Endpoint']['Address']
-        port = cluster['Endpoint']['Port']
+        def get_endpoint():
+            cluster = self.describe_cluster()
+            return cluster['Endpoint']['Address'], cluster['Endpoint']['Port']
+
+        host, port = redshift_engine_pool.memoize(self._endpoint_key, get_endpoint)
         return host, port, self.master_db_name
 
     def get_master_password(self):
-        return self.redshift_engine.secrets.get(self.password_key)
+        return redshift_engine_pool.memoize(self._password_key,
+                                            lambda: self.redshift_engine.secrets.get(self.password_key))
 
-    def get_db_connection(self):
-        self.wait_for_cluster_available()
-        return self.get_db_engine().connect()
+    def get_db_connection(self, reusable=True):
+        """ :param reusable: False if the connection will run user SQL (see RedshiftEnginePool.connect) """
+        # a recently seen endpoint means the cluster was available, and stale connections fail their health check
+        if not redshift_engine_pool.is_memoized(self._endpoint_key):
+            self.wait_for_cluster_available()
+        return redshift_engine_pool.connect(self.get_db_engine(), reusable)
 
     @retry(wait_fixed=10000, stop_max_attempt_number=7, retry_on_exception=_retry_waiter_error)
     def wait_for_cluster_available(self):
@@ -141,10 +155,7 @@ class RedshiftCluster(object):
 
     def get_db_engine(self):
         host, port, db = self.get_host_port_db()
-        connection_string = 'redshift+psycopg2://{username}:{password}@{host}:{port}/{database}'.format(
-            username=self.master_user_name, password=self.get_master_password(), host=host, port=port, database=db
-        )
-        return sqlalchemy.create_engine(connection_string)
+        return redshift_engine_pool.get_engine(host, port, db, self.master_user_name, self.get_master_password())
 
     def get_snapshot_or_latest(self, snapshot_name):
         snapshots = self.get_snapshots_ordered_by_most_recent()
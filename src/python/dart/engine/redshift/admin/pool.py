@@ -0,0 +1,140 @@
+import logging
+import threading
+import time
+
+import sqlalchemy
+from sqlalchemy import event, exc, select
+
+_logger = logging.getLogger(__name__)
+
+_DISCARD_ON_CHECKIN = 'dart_discard_on_checkin'
+
+
+class RedshiftEnginePool(object):
+    """
+    Keeps one sqlalchemy engine, and so one connection pool, per redshift cluster endpoint and user for the life of
+    the engine process, so that actions (and their retries) reuse open connections rather than connecting again.
+
+    Cluster lookups such as endpoints and master passwords are memoized for ttl_seconds.  When the password of an
+    endpoint changes, its engine is disposed and replaced.  Pooled connections are checked with a SELECT 1 before
+    use and recycled after pool_recycle_seconds, so that connections closed by the cluster are replaced.
+
+    Session state must not leak from one action into the next, so connections run RESET ALL when they are returned
+    to the pool.  That does not drop temporary tables, so connections that ran user SQL are closed rather than
+    returned (see connect).
+    """
+    def __init__(self, ttl_seconds=300, pool_recycle_seconds=1800):
+        self._ttl_seconds = ttl_seconds
+        self._pool_recycle_seconds = pool_recycle_seconds
+        self._lock = threading.Lock()
+        self._engines_by_endpoint = {}
+        self._memoized_values = {}
+        self.connection_count = 0
+        self.connection_setup_seconds = 0.0
+
+    def memoize(self, key, get_value):
+        """ :return: the value of an earlier call with this key, if it is not older than ttl_seconds, or get_value() """
+        now = time.time()
+        with self._lock:
+            memoized = self._memoized_values.get(key)
+            if memoized and memoized[1] > now:
+                return memoized[0]
+        value = get_value()
+        with self._lock:
+            self._memoized_values[key] = (value, now + self._ttl_seconds)
+        return value
+
+    def is_memoized(self, key):
+        with self._lock:
+            memoized = self._memoized_values.get(key)
+            return bool(memoized and memoized[1] > time.time())
+
+    def forget(self, *keys):
+        with self._lock:
+            for key in keys:
+                self._memoized_values.pop(key, None)
+
+    def get_engine(self, host, port, database, user_name, password):
+        endpoint = (host, port, database, user_name)
+        with self._lock:
+            cached = self._engines_by_endpoint.get(endpoint)
+            if cached and cached[1] == password:
+                return cached[0]
+            if cached:
+                _logger.info('the password for %s@%s:%s/%s changed, replacing its engine'
+                             % (user_name, host, port, database))
+                cached[0].dispose()
+
+            connection_string = 'redshift+psycopg2://{username}:{password}@{host}:{port}/{database}'.format(
+                username=user_name, password=password, host=host, port=port, database=database
+            )
+            engine = sqlalchemy.create_engine(connection_string, pool_recycle=self._pool_recycle_seconds)
+            event.listen(engine, 'engine_connect', _ping_connection)
+            event.listen(engine, 'checkin', _reset_session)
+            self._engines_by_endpoint[endpoint] = (engine, password)
+            return engine
+
+    def dispose_engine(self, host, port, database, user_name):
+        """ closes the pooled connections to an endpoint that is going away, such as a deleted cluster """
+        with self._lock:
+            cached = self._engines_by_endpoint.pop((host, port, database, user_name), None)
+        if cached:
+            cached[0].dispose()
+
+    def connect(self, engine, reusable=True):
+        """
+        checks out a connection, logging how long it took and adding it to connection_setup_seconds
+
+        :param reusable: False for connections that will run user SQL, which may leave behind session state (such as
+                         temporary tables) that RESET ALL does not clear, so they are closed instead of pooled
+        """
+        start = time.time()
+        conn = engine.connect()
+        if not reusable:
+            conn.info[_DISCARD_ON_CHECKIN] = True
+        seconds = time.time() - start
+        with self._lock:
+            self.connection_count += 1
+            self.connection_setup_seconds += seconds
+        _logger.info('redshift connection setup took %.3f seconds (connections=%s, total_setup_seconds=%.3f)'
+                     % (seconds, self.connection_count, self.connection_setup_seconds))
+        return conn
+
+
+def _ping_connection(connection, branch):
+    # the pessimistic disconnect handling recipe from the sqlalchemy documentation
+    if branch:
+        return
+    save_should_close_with_result = connection.should_close_with_result
+    connection.should_close_with_result = False
+    try:
+        connection.scalar(select([1]))
+    except exc.DBAPIError as e:
+        if e.connection_invalidated:
+            # the pool was invalidated, so this connects again
+            connection.scalar(select([1]))
+        else:
+            raise
+    finally:
+        connection.should_close_with_result = save_should_close_with_result
+
+
+def _reset_session(dbapi_connection, connection_record):
+    if dbapi_connection is None:
+        # already invalidated
+        return
+    if connection_record.info.pop(_DISCARD_ON_CHECKIN, False):
+        connection_record.invalidate()
+        return
+    try:
+        cursor = dbapi_connection.cursor()
+        cursor.execute('RESET ALL')
+        cursor.close()
+        # the pool rolled back any open transaction first, and a rollback would undo the RESET ALL too
+        dbapi_connection.commit()
+    except Exception:
+        _logger.exception('failed to reset a redshift session, closing its connection')
+        connection_record.invalidate()
+
+
+redshift_engine_pool = RedshiftEnginePool()
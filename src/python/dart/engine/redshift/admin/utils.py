@@ -1,14 +1,43 @@
 import os
+import threading
+from datetime import datetime, timedelta
 
 import boto3
 import requests
 
+# credentials are looked up again this long before they expire, so that a COPY never starts with stale ones
+_CREDENTIALS_EXPIRY_MARGIN = timedelta(minutes=10)
+_credentials_by_action_id = {}
+_credentials_lock = threading.Lock()
+
 
 def lookup_credentials(action):
-    """ :type action: dart.model.action.Action """
+    """
+    returns the (aws_access_key_id, aws_secret_access_key, security_token) to run the action's COPY and UNLOAD
+    commands with, reusing the temporary credentials of an earlier lookup for the same action until they expire
+
+    :type action: dart.model.action.Action
+    """
+    now = datetime.utcnow()
+    with _credentials_lock:
+        for action_id, (credentials, expiration) in _credentials_by_action_id.items():
+            if expiration - _CREDENTIALS_EXPIRY_MARGIN <= now:
+                del _credentials_by_action_id[action_id]
+        if action.id in _credentials_by_action_id:
+            return _credentials_by_action_id[action.id][0]
+
+    credentials, expiration = _fetch_credentials(action)
+    if expiration:
+        with _credentials_lock:
+            _credentials_by_action_id[action.id] = (credentials, expiration)
+    return credentials
+
+
+def _fetch_credentials(action):
+    """ :return: the credentials, and when they expire (None if they do not) """
     if not action.data.batch_job_id:
         # we are running locally and they should be set on the ENV
-        return os.environ['AWS_ACCESS_KEY_ID'], os.environ['AWS_SECRET_ACCESS_KEY'], None
+        return (os.environ['AWS_ACCESS_KEY_ID'], os.environ['AWS_SECRET_ACCESS_KEY'], None), None
 
     # we are inside AWS using an instance profile... so now we get instance profile data
     results = requests.get('http://169.254.169.254/latest/meta-data/iam/info').json()
@@ -19,7 +48,8 @@ def lookup_credentials(action):
     results = boto3.client('iam').get_instance_profile(InstanceProfileName=instance_profile_name)
     role_name = results['InstanceProfile']['Roles'][0]['RoleName']
     results = requests.get('http://169.254.169.254/latest/meta-data/iam/security-credentials/%s' % role_name).json()
-    return results['AccessKeyId'], results['SecretAccessKey'], results['Token']
+    expiration = datetime.strptime(results['Expiration'], '%Y-%m-%dT%H:%M:%SZ')
+    return (results['AccessKeyId'], results['SecretAccessKey'], results['Token']), expiration
 
 
 def sanitized_query(sql):
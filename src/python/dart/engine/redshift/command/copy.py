@@ -1,15 +1,22 @@
-from itertools import islice
 from dart.util.strings import substitute_date_tokens
+from collections import deque
 from datetime import datetime
+from io import BytesIO
+import csv
+import gzip
 import json
 import logging
-import os
-import tempfile
+import Queue
+import sys
+import threading
+import time
 import boto3
 
 from dart.engine.redshift.admin.utils import lookup_credentials
 from dart.engine.redshift.command.ddl import get_target_schema_and_table_name, get_stage_schema_and_table_name, \
     get_tracking_schema_and_table_name
+from dart.engine.redshift.command.manifest import plan_manifests_by_bytes, plan_manifests_by_count, \
+    plan_manifests_in_order, DEFAULT_TARGET_BYTES_PER_SLICE, S3CopyFile
 from dart.model.dataset import RowFormat, Compression, LoadType
 from dart.util.s3 import get_bucket_name, get_key_name
 
@@ -23,43 +30,69 @@ core_counts_by_instance_type = {
 }
 
 _logger = logging.getLogger(__name__)
+# the stats of the most recent COPYs kept in the action's extra_data, along with totals over all of them
+_RECENT_COPY_MANIFESTS = 20
+_s3_client = None
+_s3_client_lock = threading.Lock()
 
 
-def copy_from_s3(dart, datastore, action, dataset, conn, batch_size, s3_path_and_updated_generator, nudge=None):
+def copy_from_s3(dart, datastore, action, dataset, conn, slices, s3_copy_file_generator, nudge=None):
     """
     :type dart: dart.client.python.dart_client.Dart
     :type datastore: dart.model.datastore.Datastore
     :type action: dart.model.action.Action
     :type dataset: dart.model.dataset.Dataset
+    :param slices: the number of slices in the cluster, used when it can not be read from stv_slices
+    :param s3_copy_file_generator: yields the dart.engine.redshift.command.manifest.S3CopyFile's to load
     """
     _logger.info('starting copy_from_s3')
     if dataset.data.load_type == LoadType.MERGE:
         assert dataset.data.merge_keys, 'load_type was MERGE, but merge_keys is empty!'
 
-    safe_batch_size = batch_size
-    if dataset.data.load_type == LoadType.MERGE and not dataset.data.batch_merge_sort_keys:
-        safe_batch_size = 1
-    elif action.data.args.get('batch_size'):
-        # allow overrides
-        safe_batch_size = action.data.args['batch_size']
+    # later files replace the rows of earlier ones with the same merge keys, see _copy_in_file_order
+    in_file_order = dataset.data.load_type == LoadType.MERGE and not dataset.data.batch_merge_sort_keys
 
-    _logger.info('getting manifests and tracking_sql_files')
-    manifests, tracking_sql_files = \
-        _upload_s3_copy_manifests_and_create_tracking_sql_files(action, dataset, datastore, safe_batch_size,
-                                                                s3_path_and_updated_generator, nudge)
+    if action.data.args.get('batch_size'):
+        # allow overrides
+        plan_manifests = lambda files: plan_manifests_by_count(files, action.data.args['batch_size'])
+    else:
+        slices = _get_slice_count(conn, slices)
+        target_bytes = action.data.args.get('target_bytes_per_copy') or slices * DEFAULT_TARGET_BYTES_PER_SLICE
+        if in_file_order:
+            plan_manifests = lambda files: plan_manifests_in_order(files, slices, target_bytes)
+        else:
+            plan_manifests = lambda files: plan_manifests_by_bytes(files, slices, target_bytes)
+
+    dart = _RateLimitedActionPatcher(dart)
     stage_schema_name, stage_table_name = get_stage_schema_and_table_name(action, dataset)
     target_schema_name, target_table_name = get_target_schema_and_table_name(action, dataset)
-    steps_total = len(manifests) + (5 if dataset.data.load_type == LoadType.MERGE else 4)
+    steps_after_stage = 5 if dataset.data.load_type == LoadType.MERGE else 4
     step_num = 1
 
     # truncate the stage table
     conn.execute("TRUNCATE TABLE %s.%s" % (stage_schema_name, stage_table_name))
-    action = dart.patch_action(action, progress=_get_progress(step_num, steps_total))
-
-    # load the stage table
-    action, step_num = _load_stage_table(
-        action, conn, dart, dataset, datastore, manifests, stage_schema_name, stage_table_name, step_num, steps_total
-    )
+    ordered_table_name = None
+    if in_file_order:
+        ordered_table_name = _create_ordered_stage_table(conn, stage_schema_name, stage_table_name)
+    action = dart.patch_action(action, progress=_get_progress(step_num, step_num + 1 + steps_after_stage))
+
+    # load the stage table while the manifests are still being planned and uploaded
+    _logger.info('planning manifests and tracking rows')
+    if dataset.data.data_format.row_format == RowFormat.JSON:
+        _upload_s3_json_manifest(action, dataset, datastore)
+    manifests = _ManifestPipeline(action, dataset, datastore, plan_manifests, s3_copy_file_generator, nudge)
+    try:
+        action, step_num, split_copies = _load_stage_table(
+            action, conn, dart, dataset, datastore, manifests, stage_schema_name, stage_table_name, steps_after_stage,
+            ordered_table_name
+        )
+    finally:
+        manifests.close()
+    tracking_s3_paths = manifests.tracking_s3_paths
+    steps_total = manifests.count + split_copies + 1 + steps_after_stage
+    if ordered_table_name:
+        conn.execute("DROP TABLE %s.%s" % (stage_schema_name, stage_table_name))
+        stage_table_name = ordered_table_name
     # truncate the target table if this is a reload
     if dataset.data.load_type in [LoadType.RELOAD_ALL, LoadType.RELOAD_LAST]:
         conn.execute("TRUNCATE TABLE %s.%s" % (target_schema_name, target_table_name))
@@ -70,10 +103,8 @@ def copy_from_s3(dart, datastore, action, dataset, conn, batch_size, s3_path_and
         action, step_num = _load_target_table(action, conn, dart, dataset, stage_schema_name, stage_table_name,
                                               step_num, steps_total, target_schema_name, target_table_name)
 
-        for tracking_sql_file in tracking_sql_files:
-            with open(tracking_sql_file) as f:
-                conn.execute(f.read())
-            os.remove(tracking_sql_file)
+        if tracking_s3_paths:
+            _copy_tracking_rows(action, conn, datastore, tracking_s3_paths, nudge)
         step_num += 1
         action = dart.patch_action(action, progress=_get_progress(step_num, steps_total))
 
@@ -103,7 +134,33 @@ def _load_target_table(action, conn, dart, dataset, stage_schema_name, stage_tab
         step_num += 1
         action = dart.patch_action(action, progress=_get_progress(step_num, steps_total))
 
-    if dataset.data.load_type == LoadType.MERGE and dataset.data.batch_merge_sort_keys:
+    if dataset.data.load_type == LoadType.MERGE and not dataset.data.batch_merge_sort_keys:
+        # the rows of a merge key come from the last file that has it, as if the files were merged one at a time.
+        # rows with a null merge key are never deleted by a merge, so all of them are kept.
+        sql = """
+            INSERT INTO {target_schema_name}.{target_table_name} ({columns})
+            SELECT {columns}
+            FROM (
+              SELECT {columns}, dart_file_idx,
+                     MAX(dart_file_idx) OVER (PARTITION BY {merge_keys}) AS dart_last_file_idx
+              FROM {stage_schema_name}.{stage_table_name}
+            ) t
+            WHERE dart_file_idx = dart_last_file_idx OR {any_null_merge_key};
+        """
+        sql = sql.format(
+            stage_schema_name=stage_schema_name,
+            stage_table_name=stage_table_name,
+            target_schema_name=target_schema_name,
+            target_table_name=target_table_name,
+            columns=', '.join([c.name for c in dataset.data.columns]),
+            merge_keys=', '.join(dataset.data.merge_keys),
+            any_null_merge_key=' OR '.join(['%s IS NULL' % k for k in dataset.data.merge_keys]),
+        )
+        conn.execute(sql)
+        step_num += 1
+        action = dart.patch_action(action, progress=_get_progress(step_num, steps_total))
+
+    elif dataset.data.load_type == LoadType.MERGE and dataset.data.batch_merge_sort_keys:
         sql = """
             INSERT INTO {target_schema_name}.{target_table_name} ({columns})
             SELECT DISTINCT {columns}
@@ -143,108 +200,339 @@ def _load_target_table(action, conn, dart, dataset, stage_schema_name, stage_tab
 
 
 def _load_stage_table(action, conn, dart, dataset, datastore, manifests, stage_schema_name, stage_table_name,
-                      step_num, steps_total):
-    for step_num, s3_manifest_path in enumerate(manifests, start=2):
-        aws_access_key_id, aws_secret_access_key, security_token = lookup_credentials(action)
-        sql = _get_copy_from_s3_sql(datastore, action, dataset, stage_schema_name, stage_table_name,
-                                    s3_manifest_path, aws_access_key_id, aws_secret_access_key, security_token)
-        try:
-            conn.execute(sql)
-        except Exception as e:
-            if "Check 'stl_load_errors' system table for details" in e.message:
-                now = datetime.utcnow()
-                filename = substitute_date_tokens(dataset.data.location, now)
-                stl_load_error_sql = "SELECT * FROM pg_catalog.stl_load_errors WHERE filename LIKE '{filename}%%' " \
-                                     "ORDER BY starttime DESC LIMIT 1".format(filename=filename)
-                stl_load_error = conn.execute(stl_load_error_sql).fetchone()
-                exception_message = "Load into {table_name} failed.\n" \
-                                    "stl_load_error:\n" \
-                                    "Start Time: {starttime}\n" \
-                                    "Filename: {filename}\n" \
-                                    "Line No.: {line_number}\n" \
-                                    "Column Name: {colname}\n" \
-                                    "Type: {type}\n" \
-                                    "Column Length: {col_length}\n" \
-                                    "Position: {position}\n" \
-                                    "Raw Line: {raw_line}\n" \
-                                    "Raw Field Value: {raw_field_value}\n" \
-                                    "Error Code: {err_code}\n" \
-                                    "Error Reason: {err_reason}"
-                exception_message = exception_message.format(
-                    table_name=stage_table_name,
-                    starttime=stl_load_error['starttime'],
-                    filename=stl_load_error['filename'],
-                    line_number=stl_load_error['line_number'],
-                    colname=stl_load_error['colname'],
-                    type=stl_load_error['type'],
-                    col_length=stl_load_error['col_length'],
-                    position=stl_load_error['position'],
-                    raw_line=stl_load_error['raw_line'],
-                    raw_field_value=stl_load_error['raw_field_value'],
-                    err_code=stl_load_error['err_code'],
-                    err_reason=stl_load_error['err_reason']
-                )
-                raise Exception(exception_message)
-            else:
-                raise e
-        action = dart.patch_action(action, progress=_get_progress(step_num, steps_total))
+                      steps_after_stage, ordered_table_name):
+    """
+    Runs the COPYs of the manifests, as one step of progress each.  Splitting a manifest (see _copy_in_file_order)
+    adds COPYs, which are added to the steps as they are planned.
 
-    return action, step_num + 1
+    :type manifests: dart.engine.redshift.command.copy._ManifestPipeline
+    :return: the action, the next step number and the number of COPYs added by splits
+    """
+    # every progress patch sends the stats, so they are kept to a fixed size however many manifests there are
+    copy_totals = {'manifests': 0, 'files': 0, 'planned_bytes': 0, 'copies': 0, 'copy_seconds': 0}
+    recent_copy_stats = deque(maxlen=_RECENT_COPY_MANIFESTS)
+    load = {'action': action, 'step_num': 1, 'split_copies': 0}
+
+    def patch_progress(**data_properties):
+        # one step for the manifests that are not planned yet, if any
+        steps_total = manifests.count + load['split_copies'] + (1 if manifests.planning else 0) + 1 + steps_after_stage
+        progress = _get_progress(load['step_num'], steps_total)
+        load['action'] = dart.patch_action(load['action'], progress=progress, **data_properties)
+
+    def copied(added_copies=0):
+        load['step_num'] += 1
+        load['split_copies'] += added_copies
+        patch_progress()
+
+    for s3_manifest_path, plan, first_file_idx in manifests:
+        start = time.time()
+        if ordered_table_name:
+            copies = _copy_in_file_order(load['action'], conn, dataset, datastore, stage_schema_name,
+                                         stage_table_name, ordered_table_name, s3_manifest_path, plan.files,
+                                         first_file_idx, copied)
+        else:
+            _copy_manifest(load['action'], conn, dataset, datastore, stage_schema_name, stage_table_name,
+                           s3_manifest_path)
+            copies = 1
+            copied()
+        copy_seconds = round(time.time() - start, 3)
+        file_count, planned_bytes = len(plan.files), plan.planned_bytes
+        _logger.info('copied %s (files=%s, planned_bytes=%s, copies=%s) in %s seconds'
+                     % (s3_manifest_path, file_count, planned_bytes, copies, copy_seconds))
+        stats = {'files': file_count, 'planned_bytes': planned_bytes, 'copies': copies, 'copy_seconds': copy_seconds}
+        for key, value in stats.iteritems():
+            copy_totals[key] += value
+        copy_totals['manifests'] += 1
+        copy_totals['copy_seconds'] = round(copy_totals['copy_seconds'], 3)
+        recent_copy_stats.append(dict(stats, s3_manifest_path=s3_manifest_path))
+        patch_progress(extra_data=dict(load['action'].data.extra_data or {}, copy_totals=dict(copy_totals),
+                                       copy_manifests=list(recent_copy_stats)))
+
+    return load['action'], load['step_num'] + 1, load['split_copies']
+
+
+def _create_ordered_stage_table(conn, stage_schema_name, stage_table_name):
+    """ creates a copy of the stage table with a dart_file_idx column, the index of the file each row came from """
+    table_name = stage_table_name + '_ordered'
+    conn.execute("DROP TABLE IF EXISTS %s.%s" % (stage_schema_name, table_name))
+    conn.execute("CREATE TABLE %s.%s (LIKE %s.%s)" % (stage_schema_name, table_name, stage_schema_name,
+                                                       stage_table_name))
+    conn.execute("ALTER TABLE %s.%s ADD COLUMN dart_file_idx INTEGER" % (stage_schema_name, table_name))
+    return table_name
+
+
+def _copy_in_file_order(action, conn, dataset, datastore, stage_schema_name, stage_table_name, ordered_table_name,
+                        s3_manifest_path, files, first_file_idx, copied):
+    """
+    Copies the consecutive files of a manifest into the ordered stage table, tagging their rows with the index of
+    the first file.  A COPY does not tell which file a row came from, so that is only correct when no merge key is
+    in more than one row of the COPY: otherwise, the files are split in two and each half is copied again.  Splits
+    stop at single files, whose rows all replace the earlier rows of their merge keys.
+
+    :param copied: called after each COPY with the number of COPYs it added by splitting its files (0 or 2)
+    :return: the number of COPY commands that were run
+    """
+    stage = '%s.%s' % (stage_schema_name, stage_table_name)
+    merge_keys = ', '.join(dataset.data.merge_keys)
+    duplicate_keys_sql = 'SELECT 1 FROM {stage} WHERE {non_null_merge_keys} GROUP BY {merge_keys} ' \
+                         'HAVING COUNT(*) > 1 LIMIT 1'
+    duplicate_keys_sql = duplicate_keys_sql.format(
+        stage=stage,
+        merge_keys=merge_keys,
+        non_null_merge_keys=' AND '.join(['%s IS NOT NULL' % k for k in dataset.data.merge_keys]),
+    )
+
+    copies = 0
+    pending = [(s3_manifest_path, files, first_file_idx)]
+    while pending:
+        s3_manifest_path, files, first_file_idx = pending.pop()
+        _copy_manifest(action, conn, dataset, datastore, stage_schema_name, stage_table_name, s3_manifest_path)
+        copies += 1
+        if len(files) > 1 and conn.execute(duplicate_keys_sql).fetchone():
+            conn.execute("TRUNCATE TABLE %s" % stage)
+            half = len(files) // 2
+            for idx, batch in [(first_file_idx + half, files[half:]), (first_file_idx, files[:half])]:
+                name = 'files-%s-%s' % (idx, idx + len(batch) - 1)
+                pending.append((_upload_s3_copy_manifest(action, datastore, name, batch), batch, idx))
+            copied(2)
+            continue
+
+        conn.execute("INSERT INTO %s.%s SELECT *, %s FROM %s"
+                     % (stage_schema_name, ordered_table_name, first_file_idx, stage))
+        conn.execute("TRUNCATE TABLE %s" % stage)
+        copied(0)
+
+    return copies
+
+
+def _copy_manifest(action, conn, dataset, datastore, stage_schema_name, stage_table_name, s3_manifest_path):
+    aws_access_key_id, aws_secret_access_key, security_token = lookup_credentials(action)
+    sql = _get_copy_from_s3_sql(datastore, action, dataset, stage_schema_name, stage_table_name,
+                                s3_manifest_path, aws_access_key_id, aws_secret_access_key, security_token)
+    try:
+        conn.execute(sql)
+    except Exception as e:
+        if "Check 'stl_load_errors' system table for details" in e.message:
+            now = datetime.utcnow()
+            filename = substitute_date_tokens(dataset.data.location, now)
+            stl_load_error_sql = "SELECT * FROM pg_catalog.stl_load_errors WHERE filename LIKE '{filename}%%' " \
+                                 "ORDER BY starttime DESC LIMIT 1".format(filename=filename)
+            stl_load_error = conn.execute(stl_load_error_sql).fetchone()
+            exception_message = "Load into {table_name} failed.\n" \
+                                "stl_load_error:\n" \
+                                "Start Time: {starttime}\n" \
+                                "Filename: {filename}\n" \
+                                "Line No.: {line_number}\n" \
+                                "Column Name: {colname}\n" \
+                                "Type: {type}\n" \
+                                "Column Length: {col_length}\n" \
+                                "Position: {position}\n" \
+                                "Raw Line: {raw_line}\n" \
+                                "Raw Field Value: {raw_field_value}\n" \
+                                "Error Code: {err_code}\n" \
+                                "Error Reason: {err_reason}"
+            exception_message = exception_message.format(
+                table_name=stage_table_name,
+                starttime=stl_load_error['starttime'],
+                filename=stl_load_error['filename'],
+                line_number=stl_load_error['line_number'],
+                colname=stl_load_error['colname'],
+                type=stl_load_error['type'],
+                col_length=stl_load_error['col_length'],
+                position=stl_load_error['position'],
+                raw_line=stl_load_error['raw_line'],
+                raw_field_value=stl_load_error['raw_field_value'],
+                err_code=stl_load_error['err_code'],
+                err_reason=stl_load_error['err_reason']
+            )
+            raise Exception(exception_message)
+        else:
+            raise e
 
 
 def _get_progress(step_num, steps_total):
     return "%.2f" % round(float(step_num) / float(steps_total), 2)
 
 
-def _upload_s3_copy_manifests_and_create_tracking_sql_files(action, dataset, datastore, batch_size,
-                                                            s3_path_and_updated_generator, nudge=None):
+def _get_slice_count(conn, default):
+    try:
+        return conn.execute('SELECT COUNT(*) FROM stv_slices').scalar() or default
+    except Exception:
+        _logger.warn('could not read stv_slices, assuming %s slices' % default)
+        return default
+
+
+class _RateLimitedActionPatcher(object):
+    """
+    Stands in for dart when patching the action's progress, sending at most one patch every min_interval_seconds
+    (along with the latest values of the patches skipped meanwhile), except for the final one.
+    """
+    def __init__(self, dart, min_interval_seconds=15):
+        """ :type dart: dart.client.python.dart_client.Dart """
+        self._dart = dart
+        self._min_interval_seconds = min_interval_seconds
+        self._last_patch_time = None
+        self._skipped_data_properties = {}
+
+    def patch_action(self, action, **data_properties):
+        now = time.time()
+        self._skipped_data_properties.update(data_properties)
+        if data_properties.get('progress') != 1 and self._last_patch_time is not None \
+                and now - self._last_patch_time < self._min_interval_seconds:
+            return action
+        self._last_patch_time = now
+        data_properties, self._skipped_data_properties = self._skipped_data_properties, {}
+        return self._dart.patch_action(action, **data_properties)
+
+
+class _ManifestPipeline(object):
+    """
+    Plans and uploads the manifests of a load (and their tracking rows) on a background thread, so that
+    the first COPYs run while the later manifests are still being planned, e.g. while paging through subscription
+    elements.  Iterating over it yields the (s3_manifest_path, ManifestPlan, index of its first file) tuples as soon
+    as they are uploaded, and raises any error of the background thread.
+    """
+    _DONE = object()
+    _FAILED = object()
+
+    def __init__(self, action, dataset, datastore, plan_manifests, s3_copy_file_generator, nudge):
+        self.count = 0
+        self.planning = True
+        self.tracking_s3_paths = []
+        self._closed = False
+        self._queue = Queue.Queue()
+        self._thread = threading.Thread(
+            target=self._run,
+            args=(action, dataset, datastore, plan_manifests, s3_copy_file_generator, nudge),
+            name='manifests-for-action-%s' % action.id
+        )
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _run(self, action, dataset, datastore, plan_manifests, s3_copy_file_generator, nudge):
+        try:
+            s3_copy_files = self._until_closed(s3_copy_file_generator)
+            for manifest, tracking_s3_path in _upload_s3_copy_and_tracking_manifests(
+                    action, dataset, datastore, plan_manifests, s3_copy_files, nudge):
+                if self._closed:
+                    return
+                self.tracking_s3_paths.append(tracking_s3_path)
+                self._queue.put(manifest)
+            self._queue.put(self._DONE)
+        except Exception:
+            self._queue.put((self._FAILED, sys.exc_info()))
+
+    def _until_closed(self, s3_copy_file_generator):
+        # checked between s3 files, since planning a single manifest can page through many of them
+        for s3_copy_file in s3_copy_file_generator:
+            if self._closed:
+                return
+            yield s3_copy_file
+
+    def __iter__(self):
+        while True:
+            item = self._queue.get()
+            if item is self._DONE:
+                self.planning = False
+                return
+            if item[0] is self._FAILED:
+                self.planning = False
+                exc_type, exc_value, exc_traceback = item[1]
+                raise exc_type, exc_value, exc_traceback
+            self.count += 1
+            yield item
+
+    def close(self):
+        """ stops planning manifests before the next s3 file, e.g. after a COPY failed """
+        self._closed = True
+
+
+def _upload_s3_copy_and_tracking_manifests(action, dataset, datastore, plan_manifests, s3_copy_file_generator,
+                                           nudge):
     """
     :type action: dart.model.action.Action
     :type dataset: dart.model.dataset.Dataset
     :type datastore: dart.model.datastore.Datastore
+    :param plan_manifests: groups an iterable of S3CopyFile's into ManifestPlan's
+    :return: yields an (s3_manifest_path, ManifestPlan, index of its first file) tuple and the s3 path of the
+             tracking rows of each manifest
     """
-    s3_path_and_updated_iterator = iter(s3_path_and_updated_generator)
+    s3_copy_file_iterator = iter(s3_copy_file_generator)
 
     if dataset.data.load_type == LoadType.RELOAD_LAST:
         last = None
-        for last in s3_path_and_updated_iterator:
+        for last in s3_copy_file_iterator:
             pass
-        s3_path_and_updated_iterator = iter([last] if last else [])
-
-    manifests = []
-    tracking_sql_files = []
-    current_part = 1
-    while True:
-        batch = list(islice(s3_path_and_updated_iterator, batch_size))
-        if not batch:
-            break
-
-        with tempfile.NamedTemporaryFile() as f:
-            values = (datastore.data.s3_artifacts_path, action.id, current_part)
-            s3_manifest_path = '%s/load-manifests/load-manifest-for-action-%s-part-%s.json' % values
-            manifests.append(s3_manifest_path)
-            # http://docs.aws.amazon.com/redshift/latest/dg/loading-data-files-using-manifest.html
-            data = {'entries': [{'mandatory': True, 'url': e[0]} for e in batch]}
-            json.dump(data, f)
-            # now rewind to the beginning of the file so it can be read
-            f.seek(0)
-            bucket_name = get_bucket_name(datastore.data.s3_artifacts_path)
-            key_name = get_key_name(s3_manifest_path)
-            boto3.client('s3').upload_file(f.name, bucket_name, key_name)
-
-        with tempfile.NamedTemporaryFile(delete=False) as f:
-            tracking_sql_files.append(f.name)
-            schema_name, table_name = get_tracking_schema_and_table_name(action)
-            if nudge:
-                sql = 'INSERT INTO %s.%s (s3_path, updated, batch_id) VALUES \n' % (schema_name, table_name)
-                sql += ',\n'.join(["('%s', '%s', '%s')" % (s3_path, updated.isoformat(), batch_id) for s3_path, updated, batch_id in batch])
-            else:
-                sql = 'INSERT INTO %s.%s (s3_path, updated) VALUES \n' % (schema_name, table_name)
-                sql += ',\n'.join(["('%s', %s)" % (s3_path, "'%s'" % updated.isoformat() if updated else 'NULL') for s3_path, updated in batch])
-            f.write(sql)
-
-        current_part += 1
-    return manifests, tracking_sql_files
+        s3_copy_file_iterator = iter([last] if last else [])
+
+    file_idx = 0
+    for current_part, plan in enumerate(plan_manifests(s3_copy_file_iterator), start=1):
+        batch = plan.files
+        s3_manifest_path = _upload_s3_copy_manifest(action, datastore, 'part-%s' % current_part, batch)
+
+        # the tracking rows are kept in memory one manifest at a time, and copied into redshift after the load
+        tracking_s3_path = '%s/load-manifests/tracking-for-action-%s-part-%s.csv.gz' \
+                           % (datastore.data.s3_artifacts_path, action.id, current_part)
+        _put_s3_object(tracking_s3_path, _get_tracking_csv_gz(batch, nudge))
+
+        yield (s3_manifest_path, plan, file_idx), tracking_s3_path
+        file_idx += len(batch)
+
+
+def _get_tracking_csv_gz(s3_copy_files, nudge):
+    """ :return: the gzipped csv (s3_path, updated[, batch_id]) rows of the tracking table for these files """
+    def value(v):
+        # \N is the default NULL AS string of redshift's COPY
+        if v is None:
+            return '\\N'
+        if isinstance(v, datetime):
+            return v.strftime('%Y-%m-%d %H:%M:%S.%f')
+        return v.encode('utf-8') if isinstance(v, unicode) else str(v)
+
+    buf = BytesIO()
+    with gzip.GzipFile(fileobj=buf, mode='wb') as f:
+        writer = csv.writer(f)
+        for e in s3_copy_files:
+            row = [e.s3_path, e.updated, e.batch_id] if nudge else [e.s3_path, e.updated]
+            writer.writerow([value(v) for v in row])
+    return buf.getvalue()
+
+
+def _copy_tracking_rows(action, conn, datastore, tracking_s3_paths, nudge):
+    tracking_manifest_path = _upload_s3_copy_manifest(action, datastore, 'tracking',
+                                                      [S3CopyFile(p, None) for p in tracking_s3_paths])
+    schema_name, table_name = get_tracking_schema_and_table_name(action)
+    aws_access_key_id, aws_secret_access_key, security_token = lookup_credentials(action)
+    sql = "COPY {schema_name}.{table_name} ({columns}) FROM '{s3_manifest_path}' CSV GZIP MANIFEST" \
+          " TIMEFORMAT 'auto'" \
+          " CREDENTIALS 'aws_access_key_id={aws_access_key_id};aws_secret_access_key={aws_secret_access_key}{token}'"
+    conn.execute(sql.format(
+        schema_name=schema_name,
+        table_name=table_name,
+        columns='s3_path, updated, batch_id' if nudge else 's3_path, updated',
+        s3_manifest_path=tracking_manifest_path,
+        aws_access_key_id=aws_access_key_id,
+        aws_secret_access_key=aws_secret_access_key,
+        token=';token=%s' % security_token if security_token else ''
+    ))
+
+
+def _upload_s3_copy_manifest(action, datastore, name, s3_copy_files):
+    values = (datastore.data.s3_artifacts_path, action.id, name)
+    s3_manifest_path = '%s/load-manifests/load-manifest-for-action-%s-%s.json' % values
+    # http://docs.aws.amazon.com/redshift/latest/dg/loading-data-files-using-manifest.html
+    data = {'entries': [{'mandatory': True, 'url': e.s3_path} for e in s3_copy_files]}
+    _put_s3_object(s3_manifest_path, json.dumps(data))
+    return s3_manifest_path
+
+
+def _put_s3_object(s3_path, body):
+    global _s3_client
+    with _s3_client_lock:
+        if not _s3_client:
+            # boto3 clients are thread safe and keep their connections open between requests
+            _s3_client = boto3.client('s3')
+    _s3_client.put_object(Bucket=get_bucket_name(s3_path), Key=get_key_name(s3_path), Body=body)
 
 
 def _get_copy_from_s3_sql(datastore, action, dataset, schema_name, table_name, s3_manifest_path, aws_access_key_id,
@@ -260,7 +548,7 @@ def _get_copy_from_s3_sql(datastore, action, dataset, schema_name, table_name, s
     df = dataset.data.data_format
 
     if df.row_format == RowFormat.JSON:
-        s3_json_manifest_path = _upload_s3_json_manifest(action, dataset, datastore)
+        s3_json_manifest_path = _get_s3_json_manifest_path(action, datastore)
         options.append("FORMAT AS JSON '%s'" % s3_json_manifest_path)
     elif df.row_format == RowFormat.DELIMITED:
         options.append("NULL AS '%s'" % df.null_string)
@@ -301,16 +589,12 @@ def _get_copy_from_s3_sql(datastore, action, dataset, schema_name, table_name, s
     )
 
 
+def _get_s3_json_manifest_path(action, datastore):
+    values = (datastore.data.s3_artifacts_path, action.id)
+    return '%s/json-manifests/json-manifest-for-action-%s.json' % values
+
+
 def _upload_s3_json_manifest(action, dataset, datastore):
     # http://docs.aws.amazon.com/redshift/latest/dg/copy-usage_notes-copy-from-json.html
     data = {'jsonpaths': ['$.%s' % c.path for c in dataset.data.columns]}
-    values = (datastore.data.s3_artifacts_path, action.id)
-    s3_json_manifest_path = '%s/json-manifests/json-manifest-for-action-%s.json' % values
-    with tempfile.NamedTemporaryFile() as f:
-        json.dump(data, f)
-        # now rewind to the beginning of the file so it can be read
-        f.seek(0)
-        bucket_name = get_bucket_name(datastore.data.s3_artifacts_path)
-        key_name = get_key_name(s3_json_manifest_path)
-        boto3.client('s3').upload_file(f.name, bucket_name, key_name)
-    return s3_json_manifest_path
+    _put_s3_object(_get_s3_json_manifest_path(action, datastore), json.dumps(data))
@@ -0,0 +1,250 @@
+from collections import namedtuple
+from datetime import datetime
+import logging
+import math
+import Queue
+import threading
+import time
+
+from sqlalchemy import text
+
+_logger = logging.getLogger(__name__)
+
+VACUUM = 'VACUUM'
+ANALYZE = 'ANALYZE'
+
+# tables are candidates once this percentage of their rows are unsorted, deleted or missing from their statistics
+_THRESHOLD_PCT = 10
+# used to estimate how long a table takes when it has not been vacuumed or analyzed by this planner before
+_DEFAULT_SECONDS_PER_MB = {VACUUM: 0.05, ANALYZE: 0.005}
+# an alert from the query planner counts as much as this many percent unsorted or stale rows
+_ALERT_WEIGHT_PCT = 10
+
+TableStats = namedtuple('TableStats', ['schema_name', 'table_name', 'size_mb', 'unsorted_pct', 'deleted_pct',
+                                       'stats_off_pct', 'scans', 'vacuum_alerts', 'analyze_alerts'])
+TableState = namedtuple('TableState', ['last_seconds', 'deferred_since'])
+
+
+class MaintenanceTask(namedtuple('MaintenanceTask', ['operation', 'schema_name', 'table_name', 'score',
+                                                     'estimated_seconds', 'deferred_since'])):
+    @property
+    def key(self):
+        return self.operation, self.schema_name, self.table_name
+
+    @property
+    def sql(self):
+        return '%s "%s"."%s"' % (self.operation, self.schema_name.replace('"', '""'),
+                                 self.table_name.replace('"', '""'))
+
+
+def plan_maintenance_tasks(tables, states):
+    """
+    Chooses the tables to vacuum and analyze, in the order they should run.  Tasks deferred by an earlier run that
+    ran out of time come first, oldest first, so that every run resumes where the last one stopped.  The others are
+    ranked by their expected benefit per second: how far the table is from sorted (or how stale its statistics are),
+    weighted by how often it is scanned and by planner alerts, over how long the operation took last time (or an
+    estimate from the table's size).
+
+    :type tables: list[dart.engine.redshift.command.maintenance.TableStats]
+    :param states: (operation, schema_name, table_name) -> TableState, as recorded by earlier runs
+    :return: the vacuum tasks and the analyze tasks, each in the order they should run
+    :rtype: (list[MaintenanceTask], list[MaintenanceTask])
+    """
+    vacuums, analyzes = [], []
+    for t in tables:
+        scan_weight = math.log(2 + t.scans)
+        vacuum_pct = t.unsorted_pct + t.deleted_pct
+        if max(t.unsorted_pct, t.deleted_pct) > _THRESHOLD_PCT or t.vacuum_alerts:
+            benefit = (vacuum_pct + _ALERT_WEIGHT_PCT * t.vacuum_alerts) * scan_weight
+            vacuums.append(_task(VACUUM, t, benefit, states, t.size_mb * min(1.0, vacuum_pct / 100.0)))
+        if t.stats_off_pct > _THRESHOLD_PCT or t.analyze_alerts:
+            benefit = (t.stats_off_pct + _ALERT_WEIGHT_PCT * t.analyze_alerts) * scan_weight
+            analyzes.append(_task(ANALYZE, t, benefit, states, t.size_mb))
+
+    order = lambda task: (task.deferred_since is None, task.deferred_since, -task.score, task.key)
+    return sorted(vacuums, key=order), sorted(analyzes, key=order)
+
+
+def _task(operation, table, benefit, states, affected_mb):
+    state = states.get((operation, table.schema_name, table.table_name))
+    if state and state.last_seconds is not None:
+        estimated_seconds = state.last_seconds
+    else:
+        estimated_seconds = affected_mb * _DEFAULT_SECONDS_PER_MB[operation]
+    estimated_seconds = max(1.0, estimated_seconds)
+    return MaintenanceTask(operation, table.schema_name, table.table_name, benefit / estimated_seconds,
+                           estimated_seconds, state.deferred_since if state else None)
+
+
+class MaintenanceRunner(object):
+    """
+    Runs the planned VACUUMs one at a time on the given connection (redshift runs one vacuum at a time anyway) while
+    analyze_concurrency threads run the ANALYZEs on connections of their own.  A table's ANALYZE waits for its
+    VACUUM.  A task is only started if it is expected to finish before the deadline, otherwise it is deferred to
+    the next run.  Failed tasks are logged and do not stop the others.  The time taken by each task, and the tasks
+    deferred, are recorded in the dart.maintenance_state table, which the next run plans from.
+    """
+    def __init__(self, conn, get_db_connection, deadline, analyze_concurrency=4):
+        """
+        :param get_db_connection: returns a new connection to the cluster
+        :param deadline: the time.time() by which maintenance should be over, or None
+        """
+        self._conn = conn
+        self._get_db_connection = get_db_connection
+        self._deadline = deadline
+        self._analyze_concurrency = max(1, analyze_concurrency)
+        self._results_lock = threading.Lock()
+        self.results = []
+
+    def load_plan(self):
+        """ :rtype: (list[MaintenanceTask], list[MaintenanceTask]) """
+        _create_state_table(self._conn)
+        return plan_maintenance_tasks(_get_table_stats(self._conn), _get_states(self._conn))
+
+    def run(self, vacuums, analyzes):
+        analyzes_after_vacuum = {}
+        vacuumed_tables = set((t.schema_name, t.table_name) for t in vacuums)
+        analyze_queue = Queue.PriorityQueue()
+        for rank, task in enumerate(analyzes):
+            if (task.schema_name, task.table_name) in vacuumed_tables:
+                analyzes_after_vacuum[(task.schema_name, task.table_name)] = (rank, task)
+            else:
+                analyze_queue.put((rank, task))
+
+        workers = [threading.Thread(target=self._run_analyzes, args=(analyze_queue,), name='analyze-%s' % i)
+                   for i in range(self._analyze_concurrency)]
+        for worker in workers:
+            worker.daemon = True
+            worker.start()
+
+        try:
+            for task in vacuums:
+                self._run_task(self._conn, task)
+                dependent = analyzes_after_vacuum.pop((task.schema_name, task.table_name), None)
+                if dependent:
+                    analyze_queue.put(dependent)
+        finally:
+            for _ in workers:
+                analyze_queue.put((float('inf'), None))
+            for worker in workers:
+                worker.join()
+        return self.results
+
+    def _run_analyzes(self, analyze_queue):
+        conn = None
+        try:
+            while True:
+                rank, task = analyze_queue.get()
+                if task is None:
+                    return
+                if conn is None:
+                    conn = self._get_db_connection()
+                self._run_task(conn, task)
+        except Exception:
+            _logger.exception('analyze worker failed')
+        finally:
+            if conn is not None:
+                conn.close()
+
+    def _run_task(self, conn, task):
+        if self._deadline is not None and time.time() + task.estimated_seconds > self._deadline:
+            self._defer(conn, task)
+            return
+
+        start = time.time()
+        error = None
+        try:
+            conn.execution_options(isolation_level='AUTOCOMMIT').execute(task.sql)
+        except Exception as e:
+            error = str(e)
+        seconds = round(time.time() - start, 3)
+
+        if error:
+            _logger.error('%s failed after %s seconds: %s' % (task.sql, seconds, error))
+        else:
+            _logger.info('%s took %s seconds (estimated %.1f)' % (task.sql, seconds, task.estimated_seconds))
+            self._save_state(conn, task, seconds, None)
+        self._add_result(task, 'FAILED' if error else 'COMPLETED', seconds)
+
+    def _defer(self, conn, task):
+        _logger.info('%s deferred to the next run, it is expected to take %.1f seconds'
+                     % (task.sql, task.estimated_seconds))
+        self._save_state(conn, task, None, task.deferred_since or datetime.utcnow())
+        self._add_result(task, 'DEFERRED', None)
+
+    @staticmethod
+    def _save_state(conn, task, seconds, deferred_since):
+        # the state only informs the next run's plan, so failing to record it is logged like a failed task and does
+        # not stop the vacuums or the analyze worker
+        try:
+            _save_state(conn, task, seconds, deferred_since)
+        except Exception:
+            _logger.exception('failed to record the state of %s' % task.sql)
+
+    def _add_result(self, task, status, seconds):
+        with self._results_lock:
+            self.results.append({'operation': task.operation, 'schema_name': task.schema_name,
+                                 'table_name': task.table_name, 'status': status, 'seconds': seconds,
+                                 'estimated_seconds': round(task.estimated_seconds, 3)})
+
+
+def _create_state_table(conn):
+    conn.execute('CREATE SCHEMA IF NOT EXISTS dart')
+    conn.execute('CREATE TABLE IF NOT EXISTS dart.maintenance_state (operation VARCHAR(16), schema_name VARCHAR(127),'
+                 ' table_name VARCHAR(127), last_run TIMESTAMP, last_seconds FLOAT, deferred_since TIMESTAMP)')
+
+
+def _get_states(conn):
+    rows = conn.execute('SELECT operation, schema_name, table_name, last_seconds, deferred_since'
+                        ' FROM dart.maintenance_state')
+    return {(r[0], r[1], r[2]): TableState(r[3], r[4]) for r in rows}
+
+
+def _save_state(conn, task, seconds, deferred_since):
+    """ records how long the task took (keeping the previous timing if it did not run), or that it was deferred """
+    params = {'operation': task.operation, 'schema_name': task.schema_name, 'table_name': task.table_name,
+              'last_run': datetime.utcnow() if seconds is not None else None, 'last_seconds': seconds,
+              'deferred_since': deferred_since}
+    result = conn.execute(text("""
+        UPDATE dart.maintenance_state
+           SET last_run = COALESCE(:last_run, last_run),
+               last_seconds = COALESCE(:last_seconds, last_seconds),
+               deferred_since = :deferred_since
+         WHERE operation = :operation AND schema_name = :schema_name AND table_name = :table_name
+        """), params)
+    if not result.rowcount:
+        conn.execute(text("""
+            INSERT INTO dart.maintenance_state (operation, schema_name, table_name, last_run, last_seconds,
+                                                deferred_since)
+            VALUES (:operation, :schema_name, :table_name, :last_run, :last_seconds, :deferred_since)
+            """), params)
+
+
+def _get_table_stats(conn):
+    query = """
+        SELECT TRIM(i."schema"),
+               TRIM(i."table"),
+               COALESCE(i.size, 0),
+               COALESCE(i.unsorted, 0),
+               CASE WHEN i.tbl_rows > 0 THEN 100.0 * (1 - i.estimated_visible_rows::FLOAT / i.tbl_rows) ELSE 0 END,
+               COALESCE(i.stats_off, 0),
+               COALESCE(s.scans, 0),
+               COALESCE(a.vacuum_alerts, 0),
+               COALESCE(a.analyze_alerts, 0)
+          FROM svv_table_info i
+          LEFT JOIN (SELECT tbl, COUNT(DISTINCT query) AS scans
+                       FROM stl_scan
+                      WHERE starttime >= DATEADD(DAY, -7, GETDATE())
+                      GROUP BY tbl) s ON s.tbl = i.table_id
+          LEFT JOIN (SELECT s.tbl,
+                            SUM(CASE WHEN l.solution LIKE '%%VACUUM command%%' THEN 1 ELSE 0 END) AS vacuum_alerts,
+                            SUM(CASE WHEN l.solution LIKE '%%ANALYZE command%%' THEN 1 ELSE 0 END) AS analyze_alerts
+                       FROM stl_alert_event_log l
+                       JOIN (SELECT DISTINCT query, tbl FROM stl_scan
+                              WHERE perm_table_name <> 'Internal Worktable') s ON s.query = l.query
+                      WHERE l.userid > 1
+                        AND l.event_time >= DATEADD(DAY, -30, GETDATE())
+                      GROUP BY s.tbl) a ON a.tbl = i.table_id
+         WHERE TRIM(i."schema") NOT IN ('metadata', 'dart', 'dart_stage', 'dart_tracking')
+    """
+    return [TableStats(*r) for r in conn.execute(query)]
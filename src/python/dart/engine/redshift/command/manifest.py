@@ -0,0 +1,101 @@
+from collections import namedtuple
+from itertools import islice
+
+# 256 MB per slice and COPY, used when the action does not set target_bytes_per_copy
+DEFAULT_TARGET_BYTES_PER_SLICE = 256 * 1024 * 1024
+
+
+class S3CopyFile(namedtuple('S3CopyFile', ['s3_path', 'updated', 'file_size', 'batch_id'])):
+    """ a file to COPY into redshift, file_size (in bytes) and the nudge batch_id are optional """
+    def __new__(cls, s3_path, updated, file_size=None, batch_id=None):
+        return super(S3CopyFile, cls).__new__(cls, s3_path, updated, file_size, batch_id)
+
+
+class ManifestPlan(object):
+    def __init__(self, files, planned_bytes):
+        """
+        :type files: list[dart.engine.redshift.command.manifest.S3CopyFile]
+        :type planned_bytes: int
+        """
+        self.files = files
+        self.planned_bytes = planned_bytes
+
+
+def plan_manifests_by_count(files, batch_size):
+    """ splits the files into manifests of batch_size files, preserving their order """
+    files = iter(files)
+    while True:
+        batch = list(islice(files, batch_size))
+        if not batch:
+            return
+        yield ManifestPlan(batch, sum(f.file_size or 0 for f in batch))
+
+
+def plan_manifests_in_order(files, slices, target_bytes_per_copy, max_files_per_manifest=5000):
+    """
+    Groups consecutive files into manifests of about target_bytes_per_copy bytes, preserving their order, for loads
+    where later files must win over earlier ones.  Files without a size count as target_bytes_per_copy / slices bytes.
+
+    :type files: collections.Iterable[dart.engine.redshift.command.manifest.S3CopyFile]
+    :rtype: collections.Iterable[dart.engine.redshift.command.manifest.ManifestPlan]
+    """
+    unknown_size = max(1, target_bytes_per_copy / max(1, slices))
+    current, current_bytes = [], 0
+    for f in files:
+        current.append(f)
+        current_bytes += f.file_size if f.file_size is not None else unknown_size
+        if current_bytes >= target_bytes_per_copy or len(current) >= max_files_per_manifest:
+            yield ManifestPlan(current, current_bytes)
+            current, current_bytes = [], 0
+    if current:
+        yield ManifestPlan(current, current_bytes)
+
+
+def plan_manifests_by_bytes(files, slices, target_bytes_per_copy, max_files_per_manifest=5000, window_copies=4):
+    """
+    Groups the files into manifests of about target_bytes_per_copy bytes, so that each COPY keeps all of the
+    cluster's slices busy until it completes.  Redshift loads the files of a manifest in parallel, one per slice, so
+    a COPY takes as long as its slowest slice: files are read in windows of a few COPYs worth of bytes, sorted by
+    size, and added to manifests in rounds of one file per slice, so that files of similar sizes are copied
+    together.  The smallest files of a window are carried over to the next one rather than making a small manifest.
+
+    Files without a size count as target_bytes_per_copy / slices bytes, so when no sizes are known, manifests have
+    one file per slice.  The order of the files is not preserved.
+
+    :type files: collections.Iterable[dart.engine.redshift.command.manifest.S3CopyFile]
+    :rtype: collections.Iterable[dart.engine.redshift.command.manifest.ManifestPlan]
+    """
+    slices = max(1, slices)
+    unknown_size = max(1, target_bytes_per_copy / slices)
+    size = lambda f: f.file_size if f.file_size is not None else unknown_size
+
+    window, window_bytes = [], 0
+    for f in files:
+        window.append(f)
+        window_bytes += size(f)
+        if window_bytes >= window_copies * target_bytes_per_copy or len(window) >= window_copies * max_files_per_manifest:
+            plans, window = _pack(window, size, slices, target_bytes_per_copy, max_files_per_manifest)
+            for plan in plans:
+                yield plan
+            window_bytes = sum(size(f) for f in window)
+
+    plans, remainder = _pack(window, size, slices, target_bytes_per_copy, max_files_per_manifest)
+    for plan in plans:
+        yield plan
+    if remainder:
+        yield ManifestPlan(remainder, sum(size(f) for f in remainder))
+
+
+def _pack(window, size, slices, target_bytes_per_copy, max_files_per_manifest):
+    """ :return: the full manifests that could be made from the window, and the files left over """
+    ordered = sorted(window, key=size, reverse=True)
+    plans = []
+    current, current_bytes = [], 0
+    for i in range(0, len(ordered), slices):
+        files_round = ordered[i:i + slices]
+        current.extend(files_round)
+        current_bytes += sum(size(f) for f in files_round)
+        if current_bytes >= target_bytes_per_copy or len(current) >= max_files_per_manifest:
+            plans.append(ManifestPlan(current, current_bytes))
+            current, current_bytes = [], 0
+    return plans, current
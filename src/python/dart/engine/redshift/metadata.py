@@ -94,7 +94,8 @@ class RedshiftActionTypes(object):
                 'sort_keys_interleaved': {'type': ['boolean', 'null'], 'default': False, 'description': 'see AWS Redshift docs'},
                 'truncate_columns': {'type': ['boolean', 'null'], 'default': True},
                 'max_errors': {'type': ['integer', 'null'], 'default': 0, 'minimum': 0},
-                'batch_size': {'type': ['integer', 'null'], 'default': 0, 'minimum': 0},
+                'batch_size': {'type': ['integer', 'null'], 'default': 0, 'minimum': 0, 'description': 'if set, each COPY loads this many files instead of target_bytes_per_copy bytes'},
+                'target_bytes_per_copy': {'type': ['integer', 'null'], 'default': None, 'minimum': 1, 'description': 'files are grouped into COPY commands of about this many bytes, balanced across slices (defaults to 256 MB per slice)'},
             },
             'additionalProperties': False,
             'required': ['dataset_id'],
@@ -122,7 +123,8 @@ class RedshiftActionTypes(object):
                 'sort_keys_interleaved': {'type': ['boolean', 'null'], 'default': False, 'description': 'see AWS Redshift docs'},
                 'truncate_columns': {'type': ['boolean', 'null'], 'default': True},
                 'max_errors': {'type': ['integer', 'null'], 'default': 0, 'minimum': 0},
-                'batch_size': {'type': ['integer', 'null'], 'default': 0, 'minimum': 0},
+                'batch_size': {'type': ['integer', 'null'], 'default': 0, 'minimum': 0, 'description': 'if set, each COPY loads this many files instead of target_bytes_per_copy bytes'},
+                'target_bytes_per_copy': {'type': ['integer', 'null'], 'default': None, 'minimum': 1, 'description': 'files are grouped into COPY commands of about this many bytes, balanced across slices (defaults to 256 MB per slice)'},
             },
             'additionalProperties': False,
             'required': ['subscription_id'],
@@ -181,6 +183,10 @@ class RedshiftActionTypes(object):
                              'description': 'If True, will run Vacuum post load. Recommended True'},
                 'Analyze': {'type': 'boolean', 'default': True,
                            'description': 'If True, will run Analyze post load. Recommended True'},
+                'Time_Budget_Seconds': {'type': ['integer', 'null'], 'default': None, 'minimum': 1,
+                           'description': 'If set, vacuums and analyzes not expected to finish within this many seconds of the start are deferred to the next run'},
+                'Analyze_Concurrency': {'type': ['integer', 'null'], 'default': 4, 'minimum': 1,
+                           'description': 'The number of analyzes to run at the same time, each on its own connection'},
             },
             'additionalProperties': False,
             'required': ['Retention_Policy'],
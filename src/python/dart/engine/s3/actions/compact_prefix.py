@@ -0,0 +1,236 @@
+from datetime import datetime
+import logging
+import re
+import time
+from multiprocessing.pool import ThreadPool
+
+import boto3
+
+from dart.engine.s3.actions.copy import run_bounded, _TASKS_PER_WORKER
+from dart.model.dataset import Compression
+from dart.util.s3 import get_bucket_name, get_key_name
+from dart.util.strings import substitute_date_tokens
+
+_logger = logging.getLogger(__name__)
+
+_EXTENSIONS = {Compression.NONE: '', Compression.GZIP: '.gz', Compression.BZ2: '.bz2'}
+# the smallest part s3 accepts (except for the last one), so at most this much of an output is held per worker
+_PART_BYTES = 8 * 1024 * 1024
+_READ_BYTES = 1024 * 1024
+_MAX_COPY_OBJECT_BYTES = 5 * 1024 * 1024 * 1024
+_PROGRESS_INTERVAL_SECONDS = 30
+_DEFAULT_TARGET_BYTES = 256 * 1024 * 1024
+
+
+def compact_prefix(s3_engine, datastore, action):
+    """
+    :type s3_engine: dart.engine.s3.s3.S3Engine
+    :type datastore: dart.model.datastore.Datastore
+    :type action: dart.model.action.Action
+    """
+    args = action.data.args
+    now = datetime.utcnow()
+    offset = args.get('date_offset_in_seconds')
+    s3_path_prefix = substitute_date_tokens(args['s3_path_prefix'], now, offset)
+    s3_path_regex = substitute_date_tokens(args['s3_path_regex'], now, offset) if args.get('s3_path_regex') else None
+    # outputs keep the folders below the part of the prefix that does not change between runs
+    source_root = args['s3_path_prefix'].split('{', 1)[0].rsplit('/', 1)[0]
+
+    def report_progress(stats, final=False):
+        extra_data = dict(action.data.extra_data or {})
+        extra_data['compaction'] = stats
+        progress = 1 if final else round(stats['written_inputs'] / float(max(1, stats['listed_inputs'])), 2)
+        action.data = s3_engine.dart.patch_action(action, progress=progress, extra_data=extra_data).data
+
+    output_path = args['output_path'].rstrip('/')
+    dataset, compacted_location = None, None
+    if args.get('output_dataset_id'):
+        dataset = s3_engine.dart.get_dataset(args['output_dataset_id'])
+        location = dataset.data.location.rstrip('/')
+        # the outputs never overlap the prefix, so a location under them was switched by an earlier run
+        if location == output_path or location.startswith(output_path + '/'):
+            dataset = None
+        else:
+            compacted_location = _compacted_location(dataset, args, s3_path_prefix, source_root, output_path)
+
+    compaction = S3PrefixCompaction(
+        boto3.client('s3'), s3_path_prefix, s3_path_regex, source_root, output_path,
+        args.get('compression') or Compression.NONE, args.get('target_file_size_in_bytes') or _DEFAULT_TARGET_BYTES,
+        args.get('max_workers') or 8, action.id, report_progress
+    )
+    compaction.run()
+
+    if dataset:
+        _logger.info('setting the location of dataset %s to %s' % (dataset.id, compacted_location))
+        dataset.data.location = compacted_location
+        s3_engine.dart.save_dataset(dataset)
+
+
+def _compacted_location(dataset, args, s3_path_prefix, source_root, output_path):
+    """
+    Outputs keep their path relative to source_root, so the dataset's compacted objects are under output_path plus
+    its location's path relative to source_root.  Once its location is switched, the dataset's loads only see the
+    compacted objects, so unless this run compacts exactly its current location (rather than one day of a dated
+    prefix, the objects matching a regex, or a parent folder that also holds other datasets), the switch must be
+    allowed explicitly.
+
+    :return: the location of the dataset's compacted objects
+    """
+    location = dataset.data.location.rstrip('/')
+    assert location == source_root or location.startswith(source_root + '/'), \
+        'the location %s of dataset %s is not under %s, the folder the outputs are relative to' \
+        % (dataset.data.location, dataset.id, source_root)
+    compacts_location = '{' not in args['s3_path_prefix'] and not args.get('s3_path_regex') \
+        and s3_path_prefix.rstrip('/') == location
+    assert compacts_location or args.get('allow_partial_output_dataset'), \
+        '%s is not exactly the location %s of dataset %s, set allow_partial_output_dataset to switch its location ' \
+        'to the compacted objects anyway' % (s3_path_prefix, dataset.data.location, dataset.id)
+    return output_path + location[len(source_root):]
+
+
+class S3PrefixCompaction(object):
+    """
+    Concatenates the objects under an s3 prefix (optionally matching a regex) into outputs of about
+    target_file_size_in_bytes, so that loads read a few large objects rather than many small ones.  Only objects in
+    the same folder are combined, and each output keeps its folder's path relative to source_root, so partition
+    folders are preserved.  Objects already as large as the target are copied as they are.
+
+    Gzip members and bzip2 streams can be concatenated as they are, so compressed objects are never decompressed.
+    Uncompressed objects are separated by a newline if they do not end with one.  Objects must not have header rows.
+
+    Outputs are streamed to s3 as multipart uploads, on a pool of max_workers threads that each buffer at most one
+    _PART_BYTES part.  Outputs are named after the action, so running the action again replaces its own outputs.
+    """
+    def __init__(self, s3_client, s3_path_prefix, s3_path_regex, source_root, output_path, compression,
+                 target_file_size_in_bytes, max_workers, output_name, report_progress=None):
+        assert compression in _EXTENSIONS, 'objects compressed with %s can not be concatenated' % compression
+        assert s3_path_prefix.startswith(source_root), 'the prefix must be under %s' % source_root
+        # outputs listed under the prefix would be compacted again, and a prefix under the outputs would read them
+        overlap = (output_path + '/').startswith(s3_path_prefix) or s3_path_prefix.startswith(output_path + '/')
+        assert not overlap, 'the output path %s and the prefix %s must not overlap' % (output_path, s3_path_prefix)
+        self._s3_client = s3_client
+        self._bucket = get_bucket_name(s3_path_prefix)
+        self._prefix = get_key_name(s3_path_prefix)
+        self._s3_path_regex = s3_path_regex
+        self._root_key = get_key_name(source_root + '/')
+        self._output_bucket = get_bucket_name(output_path)
+        self._output_key = get_key_name(output_path + '/')
+        self._compression = compression
+        self._target_bytes = target_file_size_in_bytes
+        self._max_workers = max_workers
+        self._output_name = output_name
+        self._report_progress = report_progress
+        self.stats = {'listed_inputs': 0, 'listed_bytes': 0, 'written_inputs': 0, 'written_outputs': 0,
+                      'written_bytes': 0}
+
+    def run(self):
+        start = last_progress = time.time()
+        pool = ThreadPool(self._max_workers)
+        try:
+            for inputs, written_bytes in run_bounded(pool, self._tasks(), self._max_workers * _TASKS_PER_WORKER):
+                self.stats['written_inputs'] += inputs
+                self.stats['written_outputs'] += 1
+                self.stats['written_bytes'] += written_bytes
+                if self._report_progress and time.time() - last_progress >= _PROGRESS_INTERVAL_SECONDS:
+                    self._report_progress(dict(self.stats))
+                    last_progress = time.time()
+        finally:
+            pool.terminate()
+
+        _logger.info('compacted %s objects into %s in %.1f seconds'
+                     % (self.stats['written_inputs'], self.stats['written_outputs'], time.time() - start))
+        if self._report_progress:
+            self._report_progress(dict(self.stats), final=True)
+
+    def _tasks(self):
+        """ yields (function, args) tuples for the pool, one per output """
+        for output_key, group in self._plan_outputs(self._list_inputs()):
+            if len(group) == 1 and group[0][1] <= _MAX_COPY_OBJECT_BYTES:
+                yield self._copy_input, (output_key, group[0])
+            else:
+                yield self._concatenate_inputs, (output_key, group)
+
+    def _list_inputs(self):
+        """ yields the (key, size) of the objects to compact, in key order """
+        s3_paginator = self._s3_client.get_paginator('list_objects')
+        for page in s3_paginator.paginate(Bucket=self._bucket, Prefix=self._prefix):
+            for element in (page.get('Contents') or []):
+                path = 's3://%s/%s' % (self._bucket, element['Key'])
+                if element['Key'].endswith('/') or (self._s3_path_regex and not re.match(self._s3_path_regex, path)):
+                    continue
+                self.stats['listed_inputs'] += 1
+                self.stats['listed_bytes'] += element['Size']
+                yield element['Key'], element['Size']
+
+    def _plan_outputs(self, inputs):
+        """ groups consecutive objects of the same folder into outputs of about target_file_size_in_bytes """
+        # keys are listed in order, but the objects of a folder may be listed before and after those of a subfolder
+        parts_by_folder = {}
+        folder, group, group_bytes = None, [], 0
+        for key, size in inputs:
+            key_folder = key[len(self._root_key):].rpartition('/')[0]
+            if group and (key_folder != folder or group_bytes + size > self._target_bytes):
+                yield self._output_key_for(folder, parts_by_folder), group
+                group, group_bytes = [], 0
+            folder = key_folder
+            group.append((key, size))
+            group_bytes += size
+        if group:
+            yield self._output_key_for(folder, parts_by_folder), group
+
+    def _output_key_for(self, folder, parts_by_folder):
+        part = parts_by_folder.get(folder, 0)
+        parts_by_folder[folder] = part + 1
+        name = 'part-%s-%05d%s' % (self._output_name, part, _EXTENSIONS[self._compression])
+        return self._output_key + (folder + '/' if folder else '') + name
+
+    def _copy_input(self, output_key, input_object):
+        key, size = input_object
+        self._s3_client.copy_object(
+            ACL='bucket-owner-full-control',
+            Bucket=self._output_bucket,
+            Key=output_key,
+            CopySource={'Bucket': self._bucket, 'Key': key},
+        )
+        return 1, size
+
+    def _concatenate_inputs(self, output_key, group):
+        upload_id = self._s3_client.create_multipart_upload(
+            ACL='bucket-owner-full-control',
+            Bucket=self._output_bucket,
+            Key=output_key,
+        )['UploadId']
+        try:
+            parts = []
+            written_bytes = 0
+            for part in self._stream_parts(group):
+                response = self._s3_client.upload_part(Bucket=self._output_bucket, Key=output_key, Body=part,
+                                                       PartNumber=len(parts) + 1, UploadId=upload_id)
+                parts.append({'ETag': response['ETag'], 'PartNumber': len(parts) + 1})
+                written_bytes += len(part)
+            self._s3_client.complete_multipart_upload(Bucket=self._output_bucket, Key=output_key, UploadId=upload_id,
+                                                      MultipartUpload={'Parts': parts})
+        except Exception:
+            self._s3_client.abort_multipart_upload(Bucket=self._output_bucket, Key=output_key, UploadId=upload_id)
+            raise
+        return len(group), written_bytes
+
+    def _stream_parts(self, group):
+        """ yields the concatenated objects in parts of at least _PART_BYTES (the last one excepted) """
+        chunks, chunks_bytes, parts = [], 0, 0
+        for key, size in group:
+            body = self._s3_client.get_object(Bucket=self._bucket, Key=key)['Body']
+            last_chunk = ''
+            for chunk in iter(lambda: body.read(_READ_BYTES), ''):
+                chunks.append(chunk)
+                chunks_bytes += len(chunk)
+                last_chunk = chunk
+                if chunks_bytes >= _PART_BYTES:
+                    yield ''.join(chunks)
+                    chunks, chunks_bytes, parts = [], 0, parts + 1
+            if self._compression == Compression.NONE and last_chunk and not last_chunk.endswith('\n'):
+                chunks.append('\n')
+                chunks_bytes += 1
+        # an upload needs at least one part, even if the objects were empty
+        if chunks or not parts:
+            yield ''.join(chunks)
@@ -1,5 +1,13 @@
+import Queue
+import hashlib
+import json
 import logging
+import sys
+import time
+from multiprocessing.pool import ThreadPool
+
 import boto3
+from botocore.exceptions import ClientError
 
 from datetime import datetime
 from dart.util.s3 import get_bucket_name, get_key_name
@@ -7,6 +15,18 @@ from dart.util.s3 import substitute_date_tokens
 
 _logger = logging.getLogger(__name__)
 
+# copy_object can not copy objects over 5 GB, and larger objects copy faster as parts copied in parallel
+_MULTIPART_THRESHOLD_BYTES = 256 * 1024 * 1024
+_MIN_PART_BYTES = 128 * 1024 * 1024
+_MAX_PARTS = 10000
+_CHECKPOINT_INTERVAL_SECONDS = 30
+_PROGRESS_INTERVAL_SECONDS = 30
+# tasks queued per worker, enough to keep the workers busy without listing (much) ahead of them
+_TASKS_PER_WORKER = 2
+# the attributes of a source object that copy_object keeps, which a multipart upload must be given
+_OBJECT_ATTRIBUTES = ['CacheControl', 'ContentDisposition', 'ContentEncoding', 'ContentLanguage', 'ContentType',
+                      'Expires', 'Metadata', 'ServerSideEncryption', 'SSEKMSKeyId', 'StorageClass']
+
 
 def copy(s3_engine, datastore, action):
     """
@@ -14,49 +34,265 @@ def copy(s3_engine, datastore, action):
     :type datastore: dart.model.datastore.Datastore
     :type action: dart.model.action.Action
     """
-    return s3_copy(**action.data.args)
+    args = action.data.args
+    now = datetime.utcnow()
+    from_path = substitute_date_tokens(args['from_path'], now)
+    to_path = substitute_date_tokens(args['to_path'], now)
+    # only a retry of this action resumes from the checkpoint, other actions copying the same paths copy everything
+    paths_hash = hashlib.sha1(from_path + '|' + to_path).hexdigest()
+    checkpoint_s3_path = '%s/copy-checkpoints/%s/%s.json' % (datastore.data.s3_artifacts_path, action.id, paths_hash)
+
+    def report_progress(stats, final=False):
+        extra_data = dict(action.data.extra_data or {})
+        extra_data['copy'] = stats
+        done_bytes = stats['copied_bytes'] + stats['skipped_bytes']
+        progress = 1 if final else round(done_bytes / float(max(1, stats['listed_bytes'])), 2)
+        action.data = s3_engine.dart.patch_action(action, progress=progress, extra_data=extra_data).data
+
+    S3Copy(boto3.client('s3'), from_path, to_path, args.get('recursive'), args.get('max_workers') or 16,
+           checkpoint_s3_path, report_progress).run()
 
 
 def extract_bucket_key(s3_path):
     return get_bucket_name(s3_path), get_key_name(s3_path)
 
 
-def perform_s3_copy_recursive(s3_client, from_path, to_path):
-    from_bucket, from_key_path = extract_bucket_key(from_path)
-    to_bucket, to_key_path = extract_bucket_key(to_path)
-    s3_paginator = s3_client.get_paginator('list_objects')
-    for page in s3_paginator.paginate(Bucket=from_bucket, Prefix=from_key_path):
-        if page.get('Contents'):
-            for key in page.get('Contents'):
-                # Extract filename relative to the from_path
-                base_filename = key.get('Key').replace(from_key_path, '')
-                if base_filename:
-                    _logger.info('Copying key %s to destination %s' % (
-                        from_key_path + base_filename, to_key_path + base_filename))
-                    copy_s3_object(s3_client, from_bucket, from_key_path + base_filename, to_bucket,
-                                   to_key_path + base_filename)
+class S3Copy(object):
+    """
+    Copies an s3 object, or every object under a prefix, on a pool of max_workers threads.  Objects over
+    _MULTIPART_THRESHOLD_BYTES are copied as parts (with upload_part_copy), which the pool copies in parallel too.
+
+    The source key, ETag and size of each object copied are recorded in a checkpoint manifest at checkpoint_s3_path,
+    written every _CHECKPOINT_INTERVAL_SECONDS and when the copy fails.  Running the same copy again skips the objects
+    the checkpoint says were copied, if their ETag and size have not changed since.  The checkpoint is deleted once
+    the copy succeeds, so a later run copies everything again.
+    """
+    def __init__(self, s3_client, from_path, to_path, recursive, max_workers, checkpoint_s3_path=None,
+                 report_progress=None):
+        """
+        :param report_progress: called with a dict of copy statistics every _PROGRESS_INTERVAL_SECONDS and, with
+                                final=True, once the copy is complete
+        """
+        self._s3_client = s3_client
+        self._from_bucket, self._from_key = extract_bucket_key(from_path)
+        self._to_bucket, self._to_key = extract_bucket_key(to_path)
+        self._recursive = recursive
+        self._max_workers = max_workers
+        self._checkpoint_s3_path = checkpoint_s3_path
+        self._report_progress = report_progress
+        self._checkpoint = self._read_checkpoint()
+        # upload id -> (destination key, source key, source ETag, size, part count, {part number: ETag})
+        self._multipart_uploads = {}
+        self.stats = {'listed_objects': 0, 'listed_bytes': 0, 'copied_objects': 0, 'copied_bytes': 0,
+                      'skipped_objects': 0, 'skipped_bytes': 0, 'bytes_per_second': 0}
 
+    def run(self):
+        start = time.time()
+        last_checkpoint = last_progress = start
+        pool = ThreadPool(self._max_workers)
+        succeeded = False
+        try:
+            for result in run_bounded(pool, self._tasks(), self._max_workers * _TASKS_PER_WORKER):
+                self._complete_task(*result)
+                now = time.time()
+                self.stats['bytes_per_second'] = int(self.stats['copied_bytes'] / max(now - start, 0.001))
+                if now - last_checkpoint >= _CHECKPOINT_INTERVAL_SECONDS:
+                    self._write_checkpoint()
+                    last_checkpoint = now
+                if self._report_progress and now - last_progress >= _PROGRESS_INTERVAL_SECONDS:
+                    self._report_progress(dict(self.stats))
+                    last_progress = now
+            succeeded = True
+        finally:
+            pool.terminate()
+            self._abort_multipart_uploads()
+            if succeeded:
+                self._delete_checkpoint()
+            else:
+                self._write_checkpoint()
 
-def perform_s3_copy(s3_client, from_path, to_path):
-    from_bucket, from_key_path = extract_bucket_key(from_path)
-    to_bucket, to_key_path = extract_bucket_key(to_path)
-    _logger.info('Copying key %s to destination %s' % (from_path, to_path))
-    copy_s3_object(s3_client, from_bucket, from_key_path, to_bucket, to_key_path)
+        _logger.info('copied %s objects (%s bytes) in %.1f seconds, skipped %s objects already copied'
+                     % (self.stats['copied_objects'], self.stats['copied_bytes'], time.time() - start,
+                        self.stats['skipped_objects']))
+        if self._report_progress:
+            self._report_progress(dict(self.stats), final=True)
 
+    def _tasks(self):
+        """
+        yields (function, args) tuples for the pool, listing the source objects as the pool works through them.  This
+        runs on the thread consuming the pool's results (see run_bounded), so it may update the state below.
+        """
+        for key, etag, size in self._list_source_objects():
+            self.stats['listed_objects'] += 1
+            self.stats['listed_bytes'] += size
+            if self._checkpoint.get(key) == [etag, size]:
+                self.stats['skipped_objects'] += 1
+                self.stats['skipped_bytes'] += size
+                continue
 
-def copy_s3_object(s3_client, from_bucket, from_key_path, to_bucket, to_key_path):
-    try:
-        s3_client.copy_object(
+            to_key = self._to_key + key[len(self._from_key):] if self._recursive else self._to_key
+            _logger.info('Copying key %s to destination %s' % (key, to_key))
+            if size <= _MULTIPART_THRESHOLD_BYTES:
+                yield self._copy_object, (key, to_key, etag, size)
+                continue
+
+            # copy_object keeps the content type, metadata and encryption of the source, so the upload is given them
+            source = self._s3_client.head_object(Bucket=self._from_bucket, Key=key, IfMatch=etag)
+            upload_id = self._s3_client.create_multipart_upload(
+                ACL='bucket-owner-full-control',
+                Bucket=self._to_bucket,
+                Key=to_key,
+                **{a: source[a] for a in _OBJECT_ATTRIBUTES if source.get(a)}
+            )['UploadId']
+            part_bytes = max(_MIN_PART_BYTES, -(-size // _MAX_PARTS))
+            part_count = -(-size // part_bytes)
+            self._multipart_uploads[upload_id] = (to_key, key, etag, size, part_count, {})
+            for part_number in range(1, part_count + 1):
+                first_byte = (part_number - 1) * part_bytes
+                last_byte = min(size, part_number * part_bytes) - 1
+                yield self._copy_part, (key, to_key, etag, upload_id, part_number, first_byte, last_byte)
+
+    def _list_source_objects(self):
+        """ yields the (key, ETag, size) of the objects to copy """
+        if not self._recursive:
+            response = self._s3_client.head_object(Bucket=self._from_bucket, Key=self._from_key)
+            yield self._from_key, response['ETag'], response['ContentLength']
+            return
+
+        s3_paginator = self._s3_client.get_paginator('list_objects')
+        for page in s3_paginator.paginate(Bucket=self._from_bucket, Prefix=self._from_key):
+            for element in (page.get('Contents') or []):
+                # skip the "folder" key of the prefix itself
+                if element['Key'] != self._from_key:
+                    yield element['Key'], element['ETag'], element['Size']
+
+    def _copy_object(self, key, to_key, etag, size):
+        self._s3_client.copy_object(
             ACL='bucket-owner-full-control',
-            Bucket=to_bucket,
-            Key=to_key_path,
-            CopySource={'Bucket': from_bucket, 'Key': from_key_path},
+            Bucket=self._to_bucket,
+            Key=to_key,
+            CopySource={'Bucket': self._from_bucket, 'Key': key},
+            CopySourceIfMatch=etag,
         )
-    except Exception as e:
-        raise e
+        return None, key, etag, size
+
+    def _copy_part(self, key, to_key, etag, upload_id, part_number, first_byte, last_byte):
+        response = self._s3_client.upload_part_copy(
+            Bucket=self._to_bucket,
+            Key=to_key,
+            CopySource={'Bucket': self._from_bucket, 'Key': key},
+            CopySourceIfMatch=etag,
+            CopySourceRange='bytes=%s-%s' % (first_byte, last_byte),
+            PartNumber=part_number,
+            UploadId=upload_id,
+        )
+        return upload_id, part_number, response['CopyPartResult']['ETag'], last_byte - first_byte + 1
+
+    def _complete_task(self, upload_id, key_or_part_number, etag, size):
+        """ runs on the thread consuming the pool's results, so the state below needs no locking """
+        if upload_id is None:
+            self._object_copied(key_or_part_number, etag, size, size)
+            return
+
+        to_key, key, source_etag, object_size, part_count, part_etags = self._multipart_uploads[upload_id]
+        part_etags[key_or_part_number] = etag
+        self.stats['copied_bytes'] += size
+        if len(part_etags) < part_count:
+            return
+
+        self._s3_client.complete_multipart_upload(
+            Bucket=self._to_bucket,
+            Key=to_key,
+            UploadId=upload_id,
+            MultipartUpload={'Parts': [{'ETag': part_etags[n], 'PartNumber': n} for n in sorted(part_etags)]},
+        )
+        del self._multipart_uploads[upload_id]
+        # the bytes of its parts were counted as they were copied
+        self._object_copied(key, source_etag, object_size, 0)
+
+    def _object_copied(self, key, etag, size, copied_bytes):
+        self._checkpoint[key] = [etag, size]
+        self.stats['copied_objects'] += 1
+        self.stats['copied_bytes'] += copied_bytes
+
+    def _abort_multipart_uploads(self):
+        for upload_id, upload in self._multipart_uploads.items():
+            try:
+                self._s3_client.abort_multipart_upload(Bucket=self._to_bucket, Key=upload[0], UploadId=upload_id)
+            except Exception:
+                _logger.exception('failed to abort the multipart upload of %s' % upload[0])
+        self._multipart_uploads = {}
+
+    def _read_checkpoint(self):
+        if not self._checkpoint_s3_path:
+            return {}
+        try:
+            response = self._s3_client.get_object(Bucket=get_bucket_name(self._checkpoint_s3_path),
+                                                  Key=get_key_name(self._checkpoint_s3_path))
+        except ClientError as e:
+            if e.response['Error']['Code'] in ['NoSuchKey', '404']:
+                return {}
+            raise
+        checkpoint = json.loads(response['Body'].read())
+        _logger.info('resuming from %s, %s objects were already copied'
+                     % (self._checkpoint_s3_path, len(checkpoint['copied'])))
+        return checkpoint['copied']
+
+    def _write_checkpoint(self):
+        if not self._checkpoint_s3_path:
+            return
+        self._s3_client.put_object(
+            Bucket=get_bucket_name(self._checkpoint_s3_path),
+            Key=get_key_name(self._checkpoint_s3_path),
+            Body=json.dumps({'copied': self._checkpoint}),
+        )
+
+    def _delete_checkpoint(self):
+        if not self._checkpoint_s3_path:
+            return
+        self._s3_client.delete_object(Bucket=get_bucket_name(self._checkpoint_s3_path),
+                                      Key=get_key_name(self._checkpoint_s3_path))
+
+
+def run_bounded(pool, tasks, max_queued_tasks):
+    """
+    Like pool.imap_unordered, but the (function, args) tuples of tasks are pulled by the calling thread, and only as
+    tasks complete, so that at most max_queued_tasks are queued or running at a time.  The results are yielded in
+    the order the tasks complete, and the error of a failed task is raised as is.
+
+    :type pool: multiprocessing.pool.ThreadPool
+    """
+    results = Queue.Queue()
+    queued = 0
+    tasks = iter(tasks)
+    exhausted = False
+    while True:
+        while not exhausted and queued < max_queued_tasks:
+            task = next(tasks, None)
+            if task is None:
+                exhausted = True
+                break
+            pool.apply_async(_run_task, (task,), callback=results.put)
+            queued += 1
+        if not queued:
+            return
+        succeeded, result = results.get()
+        queued -= 1
+        if not succeeded:
+            raise result[0], result[1], result[2]
+        yield result
+
+
+def _run_task(task):
+    """ the pool's apply_async has no error callback, so errors are returned to be raised by run_bounded """
+    function, args = task
+    try:
+        return True, function(*args)
+    except Exception:
+        return False, sys.exc_info()
 
 
-def s3_copy(from_path, to_path, recursive):
+def s3_copy(from_path, to_path, recursive, max_workers=16):
     """
     Performs s3 to s3 copy. Recursive flag performs recursive copy
     :param from_path:
@@ -65,13 +301,12 @@ def s3_copy(from_path, to_path, recursive):
      :type to_path: str
     :param recursive:
      :type recursive: boolean
+    :param max_workers: the number of objects (or parts of objects) to copy at a time
+     :type max_workers: int
     :return:
     """
     client = boto3.client('s3')
     now = datetime.utcnow()
     from_path = substitute_date_tokens(from_path, now)
     to_path = substitute_date_tokens(to_path, now)
-    if recursive:
-        perform_s3_copy_recursive(client, from_path, to_path)
-    else:
-        perform_s3_copy(client, from_path, to_path)
+    S3Copy(client, from_path, to_path, recursive, max_workers).run()
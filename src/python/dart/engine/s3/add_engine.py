@@ -60,6 +60,7 @@ def add_s3_engine(config):
         supported_action_types=[
             S3ActionTypes.copy,
             S3ActionTypes.data_check,
+            S3ActionTypes.compact_prefix,
         ],
         ecs_task_definition=ecs_task_definition
     )))
@@ -15,6 +15,7 @@ class S3ActionTypes(object):
                 'from_path': {'type': 'string', 'pattern': '^s3://.+$', 'description': 'The source s3 file path'},
                 'to_path': {'type': 'string', 'pattern': '^s3://.+$', 'description': 'The destination s3 file path'},
                 'recursive': {'type': ['boolean', 'null'], 'default': True, 'description': 'Performs recursive copy of source to destination'},
+                'max_workers': {'type': ['integer', 'null'], 'default': 16, 'minimum': 1, 'description': 'The number of objects (or parts of objects over 256 MB) to copy at a time'},
                 'additionalProperties': False,
                 'required': ['from_path', 'to_path']
             }
@@ -58,3 +59,74 @@ class S3ActionTypes(object):
             'required': ['s3_path_prefix'],
         },
     )
+
+    compact_prefix = ActionType(
+        name='compact_prefix',
+        description='Concatenates the small s3 objects under a prefix into fewer, larger objects for faster loads',
+        params_json_schema={
+            'type': 'object',
+            'properties': {
+                's3_path_prefix': {
+                    'type': 'string',
+                    'pattern': '^s3://.+$',
+                    'description': 'The s3 path prefix of the objects to compact, e.g. s3://bucket/prefix/{YEAR}/'
+                                   '{MONTH}/{DAY}. The following values (with braces) will be substituted with the '
+                                   'appropriate zero-padded values at runtime: {YEAR}, {MONTH}, {DAY}, {HOUR}, '
+                                   '{MINUTE}, {SECOND}. The outputs keep the folders below the part of the prefix '
+                                   'before the first substitution'
+                },
+                's3_path_regex': {
+                    'type': ['string', 'null'],
+                    'default': None,
+                    'description': 'A regex pattern the s3 paths to compact must match, with the same substitutions'
+                },
+                'date_offset_in_seconds': {
+                    'type': ['integer', 'null'],
+                    'default': 0,
+                    'description': 'If specified, the date used in s3 path substitutions will be adjusted by this amount',
+                },
+                'output_path': {
+                    'type': 'string',
+                    'pattern': '^s3://.+$',
+                    'description': 'The s3 path the compacted objects are written under'
+                },
+                'compression': {
+                    'type': ['string', 'null'],
+                    'default': 'NONE',
+                    'enum': ['NONE', 'GZIP', 'BZ2', None],
+                    'description': 'The compression of the objects, gzip members and bzip2 streams are concatenated '
+                                   'without decompressing them. Objects must not have header rows'
+                },
+                'target_file_size_in_bytes': {
+                    'type': ['integer', 'null'],
+                    'default': 268435456,
+                    'minimum': 1,
+                    'description': 'Objects in the same folder are concatenated into outputs of about this size',
+                },
+                'max_workers': {
+                    'type': ['integer', 'null'],
+                    'default': 8,
+                    'minimum': 1,
+                    'description': 'The number of outputs to write at a time, each buffering at most 8 MB',
+                },
+                'output_dataset_id': {
+                    'type': ['string', 'null'],
+                    'default': None,
+                    'description': 'If specified, the location of this dataset is moved under output_path (keeping '
+                                   'its folders like the outputs do), so its loads read the compacted objects. Unless '
+                                   'the prefix (without substitutions or a regex) is exactly the dataset\'s current '
+                                   'location, allow_partial_output_dataset must be set',
+                },
+                'allow_partial_output_dataset': {
+                    'type': ['boolean', 'null'],
+                    'default': False,
+                    'description': 'If true, the location of output_dataset_id is switched even though only part of '
+                                   'its current location was compacted (e.g. one day of a dated prefix), so its '
+                                   'loads no longer see the objects that were not compacted, or a parent folder was '
+                                   'compacted along with other datasets',
+                },
+            },
+            'additionalProperties': False,
+            'required': ['s3_path_prefix', 'output_path'],
+        },
+    )
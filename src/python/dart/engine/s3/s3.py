@@ -3,6 +3,7 @@ import os
 import traceback
 
 from dart.client.python.dart_client import Dart
+from dart.engine.s3.actions.compact_prefix import compact_prefix
 from dart.engine.s3.actions.copy import copy
 from dart.engine.s3.actions.data_check import data_check
 from dart.engine.s3.metadata import S3ActionTypes
@@ -21,6 +22,7 @@ class S3Engine(ActionRunner):
         self._action_handlers = {
             S3ActionTypes.copy.name: copy,
             S3ActionTypes.data_check.name: data_check,
+            S3ActionTypes.compact_prefix.name: compact_prefix,
         }
 
     def run(self):
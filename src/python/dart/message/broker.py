@@ -1,12 +1,20 @@
 from abc import abstractmethod
 import base64
+from collections import OrderedDict, deque
 import json
 import logging
+from multiprocessing.pool import ThreadPool
+import os
 from pydoc import locate
 import random
+import threading
+import time
+import traceback
+import uuid
 from boto.regioninfo import RegionInfo
 from boto.sqs.connection import SQSConnection
 from boto.sqs.jsonmessage import JSONMessage
+from dart.context.database import db
 from dart.model.message import MessageState
 from dart.service.message import MessageService
 
@@ -29,19 +37,130 @@ class MessageBroker(object):
         raise NotImplementedError
 
     @abstractmethod
-    def receive_message(self, handler):
+    def receive_message(self, handler, wait_time_seconds=20, ordering_key=None):
         """
         :param handler: callback function that handles the message
-        :type handler: function[str, dict]
+        :type handler: function[str, dict, bool]
+        :param ordering_key: optional function of (message_id, message) returning a key, messages received together
+                             that share a key are handled sequentially in receipt order (None means unordered)
+        :type ordering_key: function[str, dict]
         """
         raise NotImplementedError
 
 
-class SqsJsonMessageBroker(MessageBroker):
+class BatchingMessageBroker(MessageBroker):
+    """
+    Receives up to max_messages messages per call and runs their handlers on a pool of handler_threads threads.
+    Messages sharing an ordering key are handled sequentially, in the order they were received.  Message tracking rows
+    are read, inserted and completed with one statement per batch, and handled messages are deleted in one call.
+    With the defaults (max_messages=1, handler_threads=1), messages are handled one at a time on the calling thread.
+    """
+    def __init__(self, max_messages=1, handler_threads=1, persist_messages=True):
+        self._max_messages = max_messages
+        self._handler_threads = handler_threads
+        self._persist_messages = persist_messages
+        self._message_service = None
+        self._pool = None
+
+    def set_app_context(self, app_context):
+        self._message_service = app_context.get(MessageService)
+
+    @abstractmethod
+    def _read_messages(self, wait_time_seconds):
+        """ :return: a list of (message_id, message_body, raw_message) tuples """
+        raise NotImplementedError
+
+    @abstractmethod
+    def _delete_messages(self, raw_messages):
+        raise NotImplementedError
+
+    def _release_messages(self, raw_messages):
+        """ makes messages whose handlers failed available for redelivery (by default, after they become visible) """
+        pass
+
+    def receive_message(self, handler, wait_time_seconds=20, ordering_key=None):
+        received = self._read_messages(wait_time_seconds)
+        if not received:
+            _logger.debug("No message in queue {queue_name}, waited {message_wait_time} seconds.".
+                          format(queue_name=self._queue_name, message_wait_time=wait_time_seconds))
+            return
+
+        tracked = self._track_messages(received)
+        to_handle = [r for r in received if r[0] not in tracked['redelivered']]
+        redelivered = [r[2] for r in received if r[0] in tracked['redelivered']]
+        for message_id in tracked['redelivered']:
+            _logger.warn('bailing on message with id=%s because it was redelivered' % message_id)
+
+        groups = OrderedDict()
+        for message_id, body, raw in to_handle:
+            key = ordering_key(message_id, body) if ordering_key else None
+            groups.setdefault(key if key is not None else message_id, []).append((message_id, body, raw))
+
+        if self._handler_threads > 1 and len(groups) > 1:
+            results = self.pool.map(self._handle_group, [(handler, g) for g in groups.values()])
+        else:
+            results = [self._handle_group((handler, g)) for g in groups.values()]
+
+        handled = [r for group_results in results for r, succeeded in group_results if succeeded]
+        failed = [r for group_results in results for r, succeeded in group_results if not succeeded]
+        if handled and self._persist_messages:
+            self._message_service.update_messages_state([r[0] for r in handled], MessageState.COMPLETED)
+        if handled or redelivered:
+            self._delete_messages([r[2] for r in handled] + redelivered)
+        if failed:
+            self._release_messages([r[2] for r in failed])
+
+    def _track_messages(self, received):
+        if not self._persist_messages:
+            return {'redelivered': set()}
+        messages_by_id = self._message_service.get_messages([r[0] for r in received])
+        redelivered = {mid for mid, m in messages_by_id.iteritems()
+                       if m.state in [MessageState.COMPLETED, MessageState.FAILED]}
+        new_messages = [(r[0], json.dumps(r[1])) for r in received if r[0] not in messages_by_id]
+        if new_messages:
+            self._message_service.save_messages(new_messages, MessageState.RUNNING)
+        return {'redelivered': redelivered}
+
+    @staticmethod
+    def _handle_group(args):
+        handler, group = args
+        results = []
+        try:
+            for i, (message_id, body, raw) in enumerate(group):
+                _logger.info('Begin handling message {}\n{}'.format(
+                    message_id, json.dumps(body, indent=4, separators=(',', ': '))))
+                try:
+                    handler(message_id, body, False)
+                except Exception:
+                    _logger.error(json.dumps(traceback.format_exc()))
+                    # later messages with the same ordering key must not overtake this one
+                    results.extend(((m, b, r), False) for m, b, r in group[i:])
+                    break
+                _logger.info('Finish handling message {}'.format(message_id))
+                results.append(((message_id, body, raw), True))
+        finally:
+            db.session.rollback()
+        return results
+
+    @property
+    def pool(self):
+        if self._pool:
+            return self._pool
+        self._pool = ThreadPool(self._handler_threads)
+        return self._pool
+
+    @property
+    def _queue_name(self):
+        return type(self).__name__
+
+
+class SqsJsonMessageBroker(BatchingMessageBroker):
     def __init__(self, queue_name, aws_access_key_id=None, aws_secret_access_key=None, region='us-east-1',
-                 endpoint=None, is_secure=True, port=None, incoming_message_class='boto.sqs.jsonmessage.JSONMessage'):
+                 endpoint=None, is_secure=True, port=None, incoming_message_class='boto.sqs.jsonmessage.JSONMessage',
+                 max_messages=1, handler_threads=1):
+        super(SqsJsonMessageBroker, self).__init__(min(max_messages, 10), handler_threads)
         self._region = RegionInfo(name=region, endpoint=endpoint) if region and endpoint else None
-        self._queue_name = queue_name
+        self._sqs_queue_name = queue_name
         self._is_secure = is_secure
         self._port = port
         self._incoming_message_class = incoming_message_class
@@ -49,46 +168,23 @@ class SqsJsonMessageBroker(MessageBroker):
         self._aws_secret_access_key = aws_secret_access_key
         self._message_class = locate(self._incoming_message_class)
         self._queue = None
-        self._message_service = None
-
-    def set_app_context(self, app_context):
-        self._message_service = app_context.get(MessageService)
 
     def send_message(self, message):
         # dart always uses the JSONMessage format
         self.queue.write(JSONMessage(self.queue, message))
 
-    def receive_message(self, handler, wait_time_seconds=20):
+    def _read_messages(self, wait_time_seconds):
         # randomly purge old messages
         #if random.randint(0, 100) < 1:
         #    self._message_service.purge_old_messages()
 
-        sqs_message = self.queue.read(wait_time_seconds=wait_time_seconds)
-        if not sqs_message:
-            _logger.debug("No message in queue {queue_name}, waited {message_wait_time} seconds.".
-                         format(queue_name=self._queue_name,
-                                message_wait_time=wait_time_seconds))
-            return
-
-        sqs_message_body = self._get_body(sqs_message)
-        message = self._message_service.get_message(sqs_message.id, raise_when_missing=False)
-        previous_handler_failed = False
-        result_state = MessageState.COMPLETED
-        if not message:
-            message = self._message_service.save_message(sqs_message.id, json.dumps(sqs_message_body), MessageState.RUNNING)
-
-        elif message:
-            if message.state in [MessageState.COMPLETED, MessageState.FAILED]:
-                _logger.warn('bailing on sqs message with id=%s because it was redelivered' % sqs_message.id)
-                self.queue.delete_message(sqs_message)
-                return
+        sqs_messages = self.queue.get_messages(num_messages=self._max_messages, wait_time_seconds=wait_time_seconds)
+        return [(m.id, self._get_body(m), m) for m in sqs_messages]
 
-        _logger.info('Begin handling message {}\n{}'.format(sqs_message.id, json.dumps(sqs_message_body, indent=4, separators=(',', ': '))))
-        handler(sqs_message.id, sqs_message_body, previous_handler_failed)
-        _logger.info('Finish handling message {}'.format(sqs_message.id))
-
-        self._message_service.update_message_state(message, result_state)
-        self.queue.delete_message(sqs_message)
+    def _delete_messages(self, raw_messages):
+        # sqs accepts at most 10 entries per batch delete
+        for i in range(0, len(raw_messages), 10):
+            self.queue.delete_message_batch(raw_messages[i:i + 10])
 
     @staticmethod
     def _get_body(message):
@@ -103,11 +199,90 @@ class SqsJsonMessageBroker(MessageBroker):
             value = json.loads(message.get_body())
         return value
 
+    @property
+    def _queue_name(self):
+        return self._sqs_queue_name
+
     @property
     def queue(self):
         if self._queue:
             return self._queue
         conn = SQSConnection(self._aws_access_key_id, self._aws_secret_access_key, self._is_secure, self._port, region=self._region)
-        self._queue = conn.create_queue(self._queue_name)
+        self._queue = conn.create_queue(self._sqs_queue_name)
         self._queue.set_message_class(self._message_class)
         return self._queue
+
+
+class LocalMessageBroker(BatchingMessageBroker):
+    """
+    A broker that runs without AWS.  Messages are kept in memory (shared by every user of this instance), or, when a
+    directory is given, as one json file per message so that separate processes on the same host can share a queue.
+    Messages whose handlers fail are made available again immediately.
+    """
+    def __init__(self, directory=None, max_messages=10, handler_threads=1, persist_messages=True,
+                 poll_interval_seconds=0.1):
+        super(LocalMessageBroker, self).__init__(max_messages, handler_threads, persist_messages)
+        self._directory = directory
+        self._poll_interval_seconds = poll_interval_seconds
+        self._messages = deque()
+        self._lock = threading.Lock()
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+
+    def send_message(self, message):
+        message_id = str(uuid.uuid4())
+        if not self._directory:
+            with self._lock:
+                self._messages.append((message_id, message))
+            return
+
+        # the name sorts by send time, and the rename makes the message visible atomically
+        name = '%017.6f-%s.json' % (time.time(), message_id)
+        tmp_path = os.path.join(self._directory, '.' + name)
+        with open(tmp_path, 'w') as f:
+            json.dump({'id': message_id, 'body': message}, f)
+        os.rename(tmp_path, os.path.join(self._directory, name))
+
+    def _read_messages(self, wait_time_seconds):
+        deadline = time.time() + wait_time_seconds
+        while True:
+            received = self._read_file_messages() if self._directory else self._read_memory_messages()
+            if received or time.time() >= deadline:
+                return received
+            time.sleep(self._poll_interval_seconds)
+
+    def _read_memory_messages(self):
+        with self._lock:
+            count = min(self._max_messages, len(self._messages))
+            return [(m[0], m[1], m) for m in [self._messages.popleft() for _ in range(count)]]
+
+    def _read_file_messages(self):
+        received = []
+        for name in sorted(os.listdir(self._directory)):
+            if len(received) >= self._max_messages:
+                break
+            if not name.endswith('.json') or name.startswith('.'):
+                continue
+            claimed_path = os.path.join(self._directory, '.claimed-%s-%s' % (random.randint(0, 1 << 30), name))
+            try:
+                # renaming claims the message, so concurrent readers never receive the same one
+                os.rename(os.path.join(self._directory, name), claimed_path)
+            except OSError:
+                continue
+            with open(claimed_path) as f:
+                value = json.load(f)
+            received.append((value['id'], value['body'], (name, claimed_path)))
+        return received
+
+    def _delete_messages(self, raw_messages):
+        if self._directory:
+            for name, claimed_path in raw_messages:
+                os.remove(claimed_path)
+
+    def _release_messages(self, raw_messages):
+        if not self._directory:
+            with self._lock:
+                self._messages.extendleft(reversed(raw_messages))
+            return
+        for name, claimed_path in raw_messages:
+            os.rename(claimed_path, os.path.join(self._directory, name))
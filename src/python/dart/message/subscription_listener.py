@@ -14,9 +14,10 @@ _logger = logging.getLogger(__name__)
 @injectable
 class SubscriptionListener(object):
     def __init__(self, subscription_broker, subscription_service, subscription_element_service, trigger_service,
-                 subscription_batch_trigger_processor, emailer):
+                 subscription_batch_trigger_processor, subscription_routing_service, emailer):
         self._subscription_broker = subscription_broker
         self._subscription_service = subscription_service
+        self._subscription_routing_service = subscription_routing_service
         self._subscription_element_service = subscription_element_service
         self._trigger_service = trigger_service
         self._subscription_batch_trigger_processor = subscription_batch_trigger_processor
@@ -26,7 +27,14 @@ class SubscriptionListener(object):
         }
 
     def await_call(self, wait_time_seconds=20):
-        self._subscription_broker.receive_message(self._handle_call, wait_time_seconds)
+        self._subscription_broker.receive_message(self._handle_call, wait_time_seconds, self._ordering_key)
+
+    @staticmethod
+    def _ordering_key(message_id, message):
+        # s3 events are idempotent bulk inserts and can be handled in any order
+        if 'subscription_id' in message:
+            return 'subscription:%s' % message['subscription_id']
+        return None
 
     def _handle_call(self, message_id, message, previous_handler_failed):
         if 'Subject' in message and message['Subject'] == 'Amazon S3 Notification':
@@ -51,18 +59,26 @@ class SubscriptionListener(object):
         #     - http://docs.aws.amazon.com/AmazonS3/latest/dev/notification-content-structure.html
         #     - dart/tools/sample-s3event_sqs-message.json
         #
+        self._subscription_routing_service.refresh()
+        elements = []
+        subscriptions_by_id = {}
         for record in json.loads(message['Message'])['Records']:
             if not record['eventName'].startswith('ObjectCreated:'):
                 continue
             s3_path = 's3://' + record['s3']['bucket']['name'] + '/' + urllib.unquote(record['s3']['object']['key'])
             size = record['s3']['object']['size']
-            for subscription in self._subscription_service.find_matching_subscriptions(s3_path):
+            for subscription in self._subscription_routing_service.find_matching_subscriptions(s3_path):
                 if not subscription.data.nudge_id:
-                    success = self._subscription_element_service.conditional_insert_subscription_element(
-                        subscription, s3_path, size
-                    )
-                    if success:
-                        self._trigger_service.evaluate_subscription_triggers(subscription)
+                    elements.append((subscription, s3_path, size))
+                    subscriptions_by_id[subscription.id] = subscription
+
+        if not elements:
+            return
+
+        # one bulk insert for the whole notification, then one trigger evaluation per affected subscription
+        inserted_subscription_ids = self._subscription_element_service.bulk_insert_subscription_elements(elements)
+        for subscription_id in inserted_subscription_ids:
+            self._trigger_service.evaluate_subscription_triggers(subscriptions_by_id[subscription_id])
 
     def _handle_create_subscription_call(self, message_id, message, previous_handler_failed):
         subscription = self._subscription_service.get_subscription(message['subscription_id'])
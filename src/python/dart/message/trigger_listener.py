@@ -6,7 +6,6 @@ from dart.context.locator import injectable
 from dart.message.call import TriggerCall
 from dart.model.action import ActionState, OnFailure as ActionOnFailure, Action
 from dart.model.datastore import DatastoreState
-from dart.model.query import Filter, Operator
 from dart.model.workflow import WorkflowInstanceState, WorkflowState, OnFailure as WorkflowOnFailure
 from dart.trigger.subscription import subscription_batch_trigger
 from dart.trigger.super import super_trigger
@@ -36,12 +35,32 @@ class TriggerListener(object):
         }
 
     def await_call(self, wait_time_seconds=20):
-        self._trigger_broker.receive_message(self._handle_call, wait_time_seconds)
+        self._trigger_broker.receive_message(self._handle_call, wait_time_seconds, self._ordering_key)
+
+    @staticmethod
+    def _ordering_key(message_id, message):
+        # messages about the same datastore, workflow or trigger are handled in the order they were received.
+        # Completing an action queues its datastore's next action, so it is ordered with the datastore's
+        # TRY_NEXT_ACTION calls.
+        message = _deserialize(message)
+        call = message.get('call')
+        if call == TriggerCall.TRY_NEXT_ACTION:
+            return 'datastore:%s' % message.get('datastore_id')
+        if call == TriggerCall.COMPLETE_ACTION:
+            # messages sent before they carried the datastore_id can only be ordered by their action
+            if message.get('datastore_id'):
+                return 'datastore:%s' % message['datastore_id']
+            return 'action:%s' % message.get('action_id')
+        if call == TriggerCall.PROCESS_TRIGGER:
+            trigger_message = message.get('message') or {}
+            if trigger_message.get('trigger_id'):
+                return 'trigger:%s' % trigger_message['trigger_id']
+            if trigger_message.get('workflow_id'):
+                return 'workflow:%s' % trigger_message['workflow_id']
+        return call
 
     def _handle_call(self, message_id, message, previous_handler_failed):
-        # CloudWatch Events (scheduled trigger) look like this, and need to be deserialized:
-        if 'Message' in message and 'MessageId' in message:
-            message = json.loads(message['Message'])
+        message = _deserialize(message)
 
         call = message['call']
         if call not in self._handlers:
@@ -134,11 +153,10 @@ class TriggerListener(object):
                             self._workflow_service.update_workflow_state(wf, WorkflowState.INACTIVE)
                             if wf.data.on_failure == WorkflowOnFailure.DEACTIVATE:
                                 self._datastore_service.update_datastore_state(datastore, DatastoreState.INACTIVE)
-                        f1 = Filter('workflow_instance_id', Operator.EQ, wfiid)
-                        f2 = Filter('state', Operator.EQ, ActionState.HAS_NEVER_RUN)
-                        for a in self._action_service.query_actions_all(filters=[f1, f2]):
-                            error_msg = 'A prior action (id=%s) in this workflow instance failed' % action.id
-                            self._action_service.update_action_state(a, ActionState.SKIPPED, error_msg)
+                        skipped_actions = self._action_service.find_actions(
+                            workflow_instance_id=wfiid, states=[ActionState.HAS_NEVER_RUN])
+                        error_msg = 'A prior action (id=%s) in this workflow instance failed' % action.id
+                        self._action_service.update_action_states(skipped_actions, ActionState.SKIPPED, error_msg)
                         callbacks.append(lambda: self._emailer.send_workflow_failed_email(wf, wfi))
                     else:
                         self._datastore_service.update_datastore_state(datastore, DatastoreState.INACTIVE)
@@ -182,3 +200,10 @@ class TriggerListener(object):
         if trigger.data.trigger_type_name == super_trigger.name:
             for ctid in trigger.data.args['completed_trigger_ids']:
                 self._trigger_subscription_evaluations(ctid)
+
+
+def _deserialize(message):
+    # CloudWatch Events (scheduled trigger) look like this, and need to be deserialized:
+    if 'Message' in message and 'MessageId' in message:
+        return json.loads(message['Message'])
+    return message
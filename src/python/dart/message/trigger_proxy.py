@@ -24,9 +24,9 @@ class TriggerProxy(object):
 
         self._trigger_broker.send_message(args)
 
-    def complete_action(self, action_id, action_state, error_message):
+    def complete_action(self, action_id, action_state, error_message, datastore_id):
         args = {'call': TriggerCall.COMPLETE_ACTION, 'action_id': action_id, 'action_state': action_state,
-                'error_message': error_message}
+                'error_message': error_message, 'datastore_id': datastore_id}
         self._trigger_broker.send_message(args)
 
     def trigger_workflow_completion(self, workflow_id):
@@ -49,43 +49,113 @@ def to_dict(value):
 
 def from_dict(cls, dict_obj):
     args = {}
-    for field, default in cls.__dictable_public_fields_with_defaults:
-        field_typestr = cls.__dictable_public_field_typestr_by_name.get(field)
-        value = decode_from_dict(field_typestr, dict_obj.get(field, default))
-        args[field] = value
+    get = dict_obj.get
+    for field, default, decode in cls.__dictable_public_field_decoders:
+        value = get(field, default)
+        args[field] = decode(value) if value else value
     return cls(**args)
 
 
 def decode_from_dict(field_typestr, value):
     if not value or not field_typestr:
         return value
+    return field_decoder(field_typestr)(value)
 
+
+_decoder_by_typestr = {}
+
+
+def field_decoder(field_typestr):
+    """
+    Returns a function that decodes a (truthy) value of the given type, as found in a dict produced by to_dict or
+    parsed from json.  Decoders are compiled once per type string and cached.  Containers that are not decoded into
+    other types are copied, so that decoded models never share mutable state with their source.
+    """
+    decoder = _decoder_by_typestr.get(field_typestr)
+    if decoder is None:
+        decoder = _compile_decoder(field_typestr)
+        _decoder_by_typestr[field_typestr] = decoder
+    return decoder
+
+
+def _compile_decoder(field_typestr):
+    if not field_typestr:
+        return copy_json
     if field_typestr == 'datetime.datetime':
-        return dateutil.parser.parse(value)
+        return parse_datetime
     if field_typestr == 'datetime.timedelta':
-        match = timedelta_re.match(value).groupdict()
-        for k, v in match.items():
-            match[k] = int(v) if v is not None else 0
-        return datetime.timedelta(**match)
+        return _decode_timedelta
     if field_typestr == 'datetime.date':
-        return dateutil.parser.parse(value).date()
+        return _decode_date
     if field_typestr.startswith('dict'):
         if field_typestr == 'dict':
-            return value
+            return copy_json
         # ensure sensible keys
         assert field_typestr[:9] == 'dict[str,'
-        dict_value_typestr = field_typestr[9:-1]
-        return {k: decode_from_dict(dict_value_typestr, v) for k, v in value.iteritems()}
+        decode_value = field_decoder(field_typestr[9:-1])
+        return lambda value: {k: decode_value(v) if v else v for k, v in value.iteritems()}
 
     if field_typestr.startswith('list'):
-        list_typestr = field_typestr[5:-1]
-        return [decode_from_dict(list_typestr, v) for v in value]
+        decode_item = field_decoder(field_typestr[5:-1])
+        return lambda value: [decode_item(v) if v else v for v in value]
+
+    return _TypeDecoder(field_typestr)
+
+
+class _TypeDecoder(object):
+    """ resolves its type on first use, since models may refer to classes defined further down their module """
+    def __init__(self, field_typestr):
+        self._field_typestr = field_typestr
+        self._decode = None
+
+    def __call__(self, value):
+        if self._decode is None:
+            cls = locate(self._field_typestr)
+            if hasattr(cls, '__dictable_public_fields_with_defaults'):
+                self._decode = lambda v: from_dict(cls, v)
+            else:
+                self._decode = cls
+        return self._decode(value)
+
+
+def copy_json(value):
+    if isinstance(value, dict):
+        return {k: copy_json(v) for k, v in value.iteritems()}
+    if isinstance(value, list):
+        return [copy_json(v) for v in value]
+    return value
+
+
+_iso_datetime_re = re.compile(r'(\d{4})-(\d{2})-(\d{2})[T ](\d{2}):(\d{2}):(\d{2})(?:\.(\d{1,6}))?$')
+
+
+def parse_datetime(value):
+    if isinstance(value, datetime.datetime):
+        return value
+    # the naive isoformat() output of to_dict is by far the most common case, and is parsed without dateutil
+    m = _iso_datetime_re.match(value)
+    if not m:
+        return dateutil.parser.parse(value)
+    year, month, day, hour, minute, second, fraction = m.groups()
+    microsecond = int(fraction.ljust(6, '0')) if fraction else 0
+    return datetime.datetime(int(year), int(month), int(day), int(hour), int(minute), int(second), microsecond)
+
+
+def _decode_timedelta(value):
+    match = timedelta_re.match(value).groupdict()
+    for k, v in match.items():
+        match[k] = int(v) if v is not None else 0
+    return datetime.timedelta(**match)
 
-    cls = locate(field_typestr)
-    if hasattr(cls, '__dictable_public_fields_with_defaults'):
-        return from_dict(cls, value)
 
-    return cls(value)
+_iso_date_re = re.compile(r'(\d{4})-(\d{2})-(\d{2})$')
+
+
+def _decode_date(value):
+    m = _iso_date_re.match(value)
+    if not m:
+        return dateutil.parser.parse(value).date()
+    return datetime.date(int(m.group(1)), int(m.group(2)), int(m.group(3)))
 
 
 def dictable(cls):
@@ -105,6 +175,10 @@ def dictable(cls):
     assert kwargs is None
 
     cls.__dictable_public_fields_with_defaults = list(izip_longest(reversed(arg_names[1:]), reversed(defaults or [])))
+    cls.__dictable_public_field_decoders = [
+        (field, default, field_decoder(cls.__dictable_public_field_typestr_by_name.get(field)))
+        for field, default in cls.__dictable_public_fields_with_defaults
+    ]
     cls.to_dict = lambda self: to_dict(self)
     cls.from_dict = classmethod(lambda clz, dict_obj: from_dict(clz, dict_obj))
 
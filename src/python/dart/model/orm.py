@@ -1,7 +1,5 @@
-import json
-
 from flask.ext.jsontools import JsonSerializableBase
-from sqlalchemy import BigInteger, Column, Integer, TIMESTAMP, String, Text, Boolean
+from sqlalchemy import BigInteger, Column, Integer, TIMESTAMP, String, Text, Boolean, Index, Float, FetchedValue
 from sqlalchemy.dialects.postgresql import JSONB
 from dart.model.action import Action
 from dart.model.accounting import Accounting
@@ -21,7 +19,6 @@ from dart.model.trigger import Trigger
 from dart.model.user import User
 from dart.model.api_key import ApiKey
 from dart.model.workflow import Workflow, WorkflowInstance
-from dart.util.json_util import DartJsonEncoder
 
 
 class VersionedAuditableSerializable(JsonSerializableBase):
@@ -33,13 +30,22 @@ class VersionedAuditableSerializable(JsonSerializableBase):
     __modelclass__ = None
 
     def to_model(self):
-        return self.__modelclass__.from_dict(json.loads(json.dumps(self, cls=DartJsonEncoder)))
+        # from_dict copies and decodes the column values directly, no json round trip is needed
+        return self.__modelclass__.from_dict(self.__json__())
 
 
 class VersionedAuditableData(VersionedAuditableSerializable):
     data = Column(JSONB)
 
 
+def data_column(type_, index=True):
+    """
+    A read-only copy of a field of the "data" column, maintained by the "copy_*_data_columns" triggers in
+    src/database/triggers.sql so that hot predicates can use an ordinary btree index instead of "data->>'field'".
+    """
+    return Column(type_, index=index, server_default=FetchedValue(), server_onupdate=FetchedValue())
+
+
 class AuthorizationRolesDao(db.Model):
     __tablename__ = 'authorization_roles'
     __modelclass__ = AuthorizationRoles
@@ -70,11 +76,19 @@ class DatasetDao(db.Model, VersionedAuditableData):
     __tablename__ = 'dataset'
     __modelclass__ = Dataset
     name = Column(String(length=255), unique=True, nullable=False)
+    location = data_column(Text)
 
 
 class ActionDao(db.Model, VersionedAuditableData):
     __tablename__ = 'action'
     __modelclass__ = Action
+    state = data_column(String(length=50))
+    # leads the composite index below
+    datastore_id = data_column(String(length=36), index=False)
+    workflow_id = data_column(String(length=36))
+    workflow_instance_id = data_column(String(length=36))
+    order_idx = data_column(Float)
+    __table_args__ = (Index('ix_action_datastore_id_state_order_idx', datastore_id, state, order_idx),)
 
 
 class DatastoreDao(db.Model, VersionedAuditableData):
@@ -85,6 +99,8 @@ class DatastoreDao(db.Model, VersionedAuditableData):
 class TriggerDao(db.Model, VersionedAuditableData):
     __tablename__ = 'trigger'
     __modelclass__ = Trigger
+    state = data_column(String(length=50))
+    trigger_type_name = data_column(String(length=255))
 
 
 class WorkflowDao(db.Model, VersionedAuditableData):
@@ -95,6 +111,8 @@ class WorkflowDao(db.Model, VersionedAuditableData):
 class WorkflowInstanceDao(db.Model, VersionedAuditableData):
     __tablename__ = 'workflow_instance'
     __modelclass__ = WorkflowInstance
+    state = data_column(String(length=50))
+    workflow_id = data_column(String(length=36))
 
 
 class EventDao(db.Model, VersionedAuditableData):
@@ -117,6 +135,8 @@ class SubscriptionElementDao(db.Model, VersionedAuditableSerializable):
     action_id = Column(String(length=36))
     batch_id = Column(String(length=36))
     processed = Column(TIMESTAMP)
+    # backs the "ON CONFLICT DO NOTHING" bulk inserts performed when processing s3 events
+    __table_args__ = (Index('ix_subscription_element_subscription_id_s3_path', subscription_id, s3_path, unique=True),)
 
 
 class MessageDao(db.Model, VersionedAuditableSerializable):
@@ -166,3 +186,19 @@ class ApiKeyDao(db.Model, VersionedAuditableSerializable):
     user_id = Column(String(length=36), unique=False, nullable=False)
     api_key = Column(String(length=255), unique=True, nullable=False)
     api_secret = Column(String(length=255), unique=False, nullable=False)
+
+
+class EntityEdgeDao(db.Model):
+    """
+    A relationship of the entity graph (e.g. dataset -> action), derived from the "data" column of its owner and
+    maintained by the "refresh_*entity_edges" triggers in src/database/entity_edge.sql.
+    """
+    __tablename__ = 'entity_edge'
+    src_type = Column(String(length=50), primary_key=True)
+    src_id = Column(String, primary_key=True, index=True)
+    dst_type = Column(String(length=50), primary_key=True)
+    dst_id = Column(String, primary_key=True, index=True)
+    relation = Column(String(length=50), primary_key=True)
+    owner_type = Column(String(length=50), nullable=False)
+    owner_id = Column(String(length=36), nullable=False, index=True)
+    ordinal = Column(Float)
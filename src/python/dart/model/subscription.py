@@ -36,7 +36,7 @@ class SubscriptionData(BaseModel):
     def __init__(self, name, dataset_id, s3_path_start_prefix_inclusive=None, s3_path_end_prefix_exclusive=None,
                  s3_path_regex_filter=None, state=SubscriptionState.INACTIVE, queued_time=None, generating_time=None,
                  initial_active_time=None, failed_time=None, message_id=None, on_failure_email=None,
-                 on_success_email=None, tags=None, user_id='anonymous', nudge_id=None):
+                 on_success_email=None, tags=None, user_id='anonymous', nudge_id=None, generation_checkpoints=None):
         """
         :type name: str
         :type dataset_id: str
@@ -53,6 +53,7 @@ class SubscriptionData(BaseModel):
         :type on_success_email: list[str]
         :type tags: list[str]
         :type nudge_id: str
+        :type generation_checkpoints: dict
         """
         self.name = name
         self.dataset_id = dataset_id
@@ -70,6 +71,7 @@ class SubscriptionData(BaseModel):
         self.tags = tags or []
         self.user_id = user_id
         self.nudge_id = nudge_id
+        self.generation_checkpoints = generation_checkpoints
 
 
 class SubscriptionElementState(object):
@@ -108,6 +110,12 @@ class SubscriptionElement(BaseModel):
         self.batch_id = batch_id
         self.processed = processed
 
+
+# the fields that can be projected when streaming subscription elements
+SUBSCRIPTION_ELEMENT_FIELDS = ['id', 'version_id', 'created', 'updated', 'subscription_id', 's3_path', 'file_size',
+                               'state', 'action_id', 'batch_id', 'processed']
+
+
 @dictable
 class SubscriptionElementStats(BaseModel):
     def __init__(self, state, count, file_size_sum):
@@ -20,7 +20,8 @@ def subscription_schema():
             'message_id': {'type': ['string', 'null'], 'default': None, 'readonly': True},
             'on_failure_email': email_list_schema(),
             'on_success_email': email_list_schema(),
-            'nudge_id': {'type': ['string', 'null'], 'default': None, 'description': 'The corresponding nudge id for this subscription', 'readonly': True}
+            'nudge_id': {'type': ['string', 'null'], 'default': None, 'description': 'The corresponding nudge id for this subscription', 'readonly': True},
+            'generation_checkpoints': {'type': ['object', 'null'], 'default': None, 'description': 'Per s3 key shard progress of an in-flight element generation', 'readonly': True}
         },
         'additionalProperties': False,
         'required': ['name', 'dataset_id']
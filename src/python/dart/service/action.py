@@ -1,18 +1,19 @@
 from datetime import datetime, timedelta
 
-from sqlalchemy import Float, func, desc, not_, or_
+from sqlalchemy import func, desc, not_, or_, text
 from sqlalchemy.sql.expression import nullslast
 
 from dart.context.database import db
 from dart.context.locator import injectable
 from dart.model.action import ActionState, ActionType, Action
+from dart.model.datastore import DatastoreState
 from dart.model.engine import Engine
 from dart.model.exception import DartValidationException
 from dart.model.orm import ActionDao, DatastoreDao
 from dart.model.query import Direction, OrderBy
 from dart.schema.action import action_schema
 from dart.schema.base import default_and_validate
-from dart.service.patcher import patch_difference, retry_stale_data
+from dart.service.patcher import patch_difference, retry_stale_data, bulk_patch_data, data_patch
 from dart.util.rand import random_id
 
 
@@ -69,8 +70,8 @@ class ActionService(object):
     @staticmethod
     def _get_max_order_idx(datastore_id):
         return db.session\
-            .query(func.max(ActionDao.data['order_idx'].cast(Float)))\
-            .filter(ActionDao.data['datastore_id'].astext == datastore_id).all()[0][0] or 0
+            .query(func.max(ActionDao.order_idx))\
+            .filter(ActionDao.datastore_id == datastore_id).all()[0][0] or 0
 
     @staticmethod
     def get_action(action_id, raise_when_missing=True):
@@ -89,45 +90,106 @@ class ActionService(object):
     @staticmethod
     def find_stale_pending_actions():
         query = ActionDao.query\
-            .filter(ActionDao.data['state'].astext == ActionState.PENDING)\
+            .filter(ActionDao.state == ActionState.PENDING)\
             .filter(ActionDao.updated < (datetime.utcnow() - timedelta(minutes=2)))
         return [r.to_model() for r in query.all()]
 
+    @staticmethod
+    def claim_queued_actions():
+        """
+        Transitions the QUEUED actions of ACTIVE datastores to PENDING (up to each datastore's concurrency) and returns
+        the claimed (action, datastore) pairs.  One aggregated query finds the candidates together with their
+        datastore's active action count, and "FOR UPDATE SKIP LOCKED" makes concurrent engine workers skip the actions
+        and datastores that another worker is currently claiming.
+
+        :rtype: list[(dart.model.action.Action, dart.model.datastore.Datastore)]
+        """
+        sql = """
+            SELECT a.id, d.id, COALESCE(CAST(d.data->>'concurrency' AS INTEGER), 1), COALESCE(c.active_count, 0)
+            FROM action a
+            JOIN datastore d ON d.id = a.datastore_id
+            LEFT JOIN (
+                SELECT datastore_id, COUNT(*) AS active_count
+                FROM action
+                WHERE state = ANY(:active_states)
+                GROUP BY datastore_id
+            ) c ON c.datastore_id = d.id
+            WHERE a.state = :queued_state
+              AND d.data->>'state' = :datastore_state
+            ORDER BY a.order_idx, a.created
+            FOR UPDATE OF a, d SKIP LOCKED
+            """
+        try:
+            rows = db.session.execute(text(sql).bindparams(
+                active_states=[ActionState.PENDING, ActionState.RUNNING, ActionState.FINISHING],
+                queued_state=ActionState.QUEUED,
+                datastore_state=DatastoreState.ACTIVE,
+            )).fetchall()
+
+            claimed_ids_by_datastore_id = {}
+            for action_id, datastore_id, concurrency, active_count in rows:
+                claimed_ids = claimed_ids_by_datastore_id.setdefault(datastore_id, [])
+                if active_count + len(claimed_ids) < concurrency:
+                    claimed_ids.append(action_id)
+            action_ids = [aid for ids in claimed_ids_by_datastore_id.values() for aid in ids]
+            if not action_ids:
+                db.session.rollback()
+                return []
+
+            db.session.execute(text("""
+                UPDATE action
+                SET data = jsonb_set(data, '{state}', to_jsonb(CAST(:state AS TEXT))), version_id = version_id + 1
+                WHERE id = ANY(:action_ids)
+                """).bindparams(state=ActionState.PENDING, action_ids=action_ids))
+            action_daos = ActionDao.query.filter(ActionDao.id.in_(action_ids)).populate_existing().all()
+            datastore_daos = DatastoreDao.query.filter(DatastoreDao.id.in_(claimed_ids_by_datastore_id.keys())).all()
+            actions = [dao.to_model() for dao in action_daos]
+            datastores = [dao.to_model() for dao in datastore_daos]
+            db.session.commit()
+
+        except Exception:
+            db.session.rollback()
+            raise
+
+        datastores_by_id = {d.id: d for d in datastores}
+        actions.sort(key=lambda a: (a.data.order_idx, a.created))
+        return [(a, datastores_by_id[a.data.datastore_id]) for a in actions]
+
     @staticmethod
     def find_running_or_queued_action_workflow_ids(datastore_id):
         resultset = db.session\
-            .query(func.distinct(ActionDao.data['workflow_id'].astext))\
-            .filter(ActionDao.data['datastore_id'].astext == datastore_id)\
-            .filter(ActionDao.data['state'].astext.in_([ActionState.RUNNING, ActionState.PENDING, ActionState.QUEUED]))\
-            .filter(ActionDao.data['workflow_id'] != 'null')\
+            .query(func.distinct(ActionDao.workflow_id))\
+            .filter(ActionDao.datastore_id == datastore_id)\
+            .filter(ActionDao.state.in_([ActionState.RUNNING, ActionState.PENDING, ActionState.QUEUED]))\
+            .filter(ActionDao.workflow_id.isnot(None))\
             .all()
         return [r[0] for r in resultset]
 
     @staticmethod
     def exists_running_or_queued_non_workflow_action(datastore_id):
         query = ActionDao.query\
-            .filter(ActionDao.data['datastore_id'].astext == datastore_id)\
-            .filter(ActionDao.data['state'].astext.in_([ActionState.RUNNING, ActionState.PENDING, ActionState.QUEUED]))\
-            .filter(ActionDao.data['workflow_id'] == 'null')\
+            .filter(ActionDao.datastore_id == datastore_id)\
+            .filter(ActionDao.state.in_([ActionState.RUNNING, ActionState.PENDING, ActionState.QUEUED]))\
+            .filter(ActionDao.workflow_id.is_(None))\
             .limit(1)
         return len(list(query.all())) > 0
 
     @staticmethod
     def find_next_runnable_action(datastore_id, not_in_workflow_ids, ensure_workflow_action):
         query = ActionDao.query\
-            .filter(ActionDao.data['datastore_id'].astext == datastore_id)\
-            .filter(ActionDao.data['state'].astext == ActionState.HAS_NEVER_RUN)
+            .filter(ActionDao.datastore_id == datastore_id)\
+            .filter(ActionDao.state == ActionState.HAS_NEVER_RUN)
         if not_in_workflow_ids:
             query = query.filter(
                 or_(
-                    ActionDao.data['workflow_id'] == 'null',
-                    not_(ActionDao.data['workflow_id'].astext.in_(not_in_workflow_ids)),
+                    ActionDao.workflow_id.is_(None),
+                    not_(ActionDao.workflow_id.in_(not_in_workflow_ids)),
                 ).self_group()
             )
         if ensure_workflow_action:
-            query = query.filter(ActionDao.data['workflow_id'] != 'null')
+            query = query.filter(ActionDao.workflow_id.isnot(None))
         query = query\
-            .order_by(ActionDao.data['order_idx'].cast(Float))\
+            .order_by(ActionDao.order_idx)\
             .limit(1)
         result = [a for a in query.all()]
         return result[0].to_model() if result else None
@@ -136,14 +198,14 @@ class ActionService(object):
     def _find_action_query(datastore_id=None, datastore_state=None, gt_order_idx=None, limit=None, action_type_names=None, states=None, workflow_id=None, workflow_instance_id=None, order_by=None, offset=None):
         query = ActionDao.query
         if datastore_id:
-            query = query.join(DatastoreDao, DatastoreDao.id == ActionDao.data['datastore_id'].astext)
+            query = query.join(DatastoreDao, DatastoreDao.id == ActionDao.datastore_id)
             query = query.filter(DatastoreDao.id == datastore_id)
             query = query.filter(DatastoreDao.data['state'].astext == datastore_state) if datastore_state else query
-        query = query.filter(ActionDao.data['state'].astext.in_(states)) if states else query
+        query = query.filter(ActionDao.state.in_(states)) if states else query
         query = query.filter(ActionDao.data['action_type_name'].astext.in_(action_type_names)) if action_type_names else query
-        query = query.filter(ActionDao.data['order_idx'].cast(Float) > gt_order_idx) if gt_order_idx else query
-        query = query.filter(ActionDao.data['workflow_id'].astext == workflow_id) if workflow_id else query
-        query = query.filter(ActionDao.data['workflow_instance_id'].astext == workflow_instance_id) if workflow_instance_id else query
+        query = query.filter(ActionDao.order_idx > gt_order_idx) if gt_order_idx else query
+        query = query.filter(ActionDao.workflow_id == workflow_id) if workflow_id else query
+        query = query.filter(ActionDao.workflow_instance_id == workflow_instance_id) if workflow_instance_id else query
 
         if order_by:
             for field, direction in order_by:
@@ -152,7 +214,7 @@ class ActionService(object):
                 else:
                     query = query.order_by(nullslast(ActionDao.data[field].astext))
         else:
-            query = query.order_by(ActionDao.data['order_idx'].cast(Float))
+            query = query.order_by(ActionDao.order_idx)
             query = query.order_by(ActionDao.created)
         query = query.limit(limit) if limit else query
         query = query.offset(offset) if offset else query
@@ -220,20 +282,41 @@ class ActionService(object):
     def update_action_state(self, action, state, error_message, conditional=None):
         """ :type action: dart.model.action.Action """
         source_action = action.copy()
-        action.data.error_message = error_message
-        action.data.state = state
+        for k, v in self._state_transition_data(state, error_message).iteritems():
+            setattr(action.data, k, v)
+        if state == ActionState.COMPLETED:
+            self.update_action_avg_runtime(action)
+
+        return patch_difference(ActionDao, source_action, action, True, conditional)
+
+    @staticmethod
+    def update_action_states(actions, state, error_message):
+        """
+        Like update_action_state, but transitions all of the given actions with one statement and one commit.
+        COMPLETED is not supported, since it also updates each action's average runtime.
+
+        :type actions: list[dart.model.action.Action]
+        :return: the ids of the updated actions
+        """
+        assert state != ActionState.COMPLETED
+        if not actions:
+            return []
+        patch = data_patch(ActionService._state_transition_data(state, error_message))
+        return bulk_patch_data(ActionDao, {a.id: a.version_id for a in actions}, patch)
+
+    @staticmethod
+    def _state_transition_data(state, error_message):
+        data = {'state': state, 'error_message': error_message}
         if state == ActionState.QUEUED:
-            action.data.queued_time = datetime.now()
+            data['queued_time'] = datetime.now()
         elif state == ActionState.RUNNING:
-            action.data.start_time = datetime.now()
+            data['start_time'] = datetime.now()
         elif state == ActionState.FAILED:
-            action.data.end_time = datetime.now()
+            data['end_time'] = datetime.now()
         elif state == ActionState.COMPLETED:
-            action.data.end_time = datetime.now()
-            action.data.progress = 1
-            self.update_action_avg_runtime(action)
-
-        return patch_difference(ActionDao, source_action, action, True, conditional)
+            data['end_time'] = datetime.now()
+            data['progress'] = 1
+        return data
 
     @staticmethod
     def update_action_batch_job_id(action, batch_job_id):
@@ -265,12 +348,12 @@ class ActionService(object):
 
     @staticmethod
     def delete_actions_in_workflow(workflow_id):
-        ActionDao.query.filter(ActionDao.data['workflow_id'].astext == workflow_id).delete(False)
+        ActionDao.query.filter(ActionDao.workflow_id == workflow_id).delete(False)
         db.session.commit()
 
     @staticmethod
     def delete_actions_in_workflow_instance(workflow_instance_id):
-        ActionDao.query.filter(ActionDao.data['workflow_instance_id'].astext == workflow_instance_id).delete(False)
+        ActionDao.query.filter(ActionDao.workflow_instance_id == workflow_instance_id).delete(False)
         db.session.commit()
 
     def clone_workflow_actions(self, log_info, source_actions, target_datastore_id, **data_property_overrides):
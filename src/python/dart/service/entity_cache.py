@@ -0,0 +1,138 @@
+import json
+import logging
+import sys
+from collections import Counter
+
+import redis
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from dart.context.locator import injectable
+from dart.model.orm import DatasetDao, DatastoreDao, EngineDao, TriggerDao, WorkflowDao
+
+_logger = logging.getLogger(__name__)
+
+
+# entity type -> (dao, default ttl in seconds), ttls can be overridden with redis.entity_cache_ttl_seconds
+_CACHED_ENTITY_TYPES = {
+    'dataset': (DatasetDao, 300),
+    'datastore': (DatastoreDao, 60),
+    'engine': (EngineDao, 600),
+    'trigger': (TriggerDao, 120),
+    'workflow': (WorkflowDao, 120),
+}
+
+_DELETED_VERSION = sys.maxint
+
+
+@injectable
+class EntityCacheService(object):
+    """
+    A read-through redis cache of the entities most often looked up by the web api.  Besides the cached entity,
+    every id may have a minimum version key, written after each commit that modifies or deletes the entity (by any
+    dart process, see _after_commit).  Cached entities older than that version are ignored, so a reader that loaded
+    an entity just before a concurrent commit can not keep serving the stale version from the cache.
+
+    Every dart process that may modify the cached entity types installs the session hooks that perform the
+    invalidation once, when it sets up its app context (see install_session_hooks).
+    """
+    def __init__(self, dart_config):
+        self._redis_client = None
+        self._ttl_by_type = {}
+        self._lookups = 0
+        self._hits = Counter()
+        self._misses = Counter()
+        self._session_hooks_installed = False
+        redis_config = dart_config.get('redis')
+        if not redis_config or not redis_config.get('entity_cache_enabled', True):
+            return
+
+        ttl_overrides = redis_config.get('entity_cache_ttl_seconds') or {}
+        self._ttl_by_type = {t: int(ttl_overrides.get(t, ttl)) for t, (dao, ttl) in _CACHED_ENTITY_TYPES.iteritems()}
+        self._type_by_dao = {dao: t for t, (dao, ttl) in _CACHED_ENTITY_TYPES.iteritems()}
+        self._stats_interval = int(redis_config.get('entity_cache_stats_interval', 1000))
+        try:
+            self._redis_client = redis.StrictRedis(host=redis_config['host'], port=int(redis_config['port']), db=0)
+        except Exception as err:
+            _logger.error("Redis: failed to create a redis client. err={0}".format(err))
+
+    def install_session_hooks(self):
+        """ listens to every sqlalchemy session, so that commits by this process invalidate the cached entities """
+        if not self._redis_client or self._session_hooks_installed:
+            return
+        event.listen(Session, 'after_flush', self._after_flush)
+        event.listen(Session, 'after_commit', self._after_commit)
+        event.listen(Session, 'after_rollback', self._after_rollback)
+        self._session_hooks_installed = True
+
+    def get_entity(self, entity_type, entity_id, load):
+        """
+        :param load: loads the entity from the database when it is not cached, returning None when it is missing
+        :type load: function[str]
+        """
+        if not self._redis_client or entity_type not in self._ttl_by_type:
+            return load(entity_id)
+
+        entity_key, version_key = self._keys(entity_type, entity_id)
+        try:
+            cached, min_version = self._redis_client.mget([entity_key, version_key])
+        except redis.RedisError as err:
+            _logger.warn('Redis: entity cache lookup failed. err={0}'.format(err))
+            return load(entity_id)
+
+        if cached:
+            value = json.loads(cached)
+            if min_version is None or value['version_id'] >= int(min_version):
+                self._record(entity_type, self._hits)
+                return _CACHED_ENTITY_TYPES[entity_type][0].__modelclass__.from_dict(value)
+
+        self._record(entity_type, self._misses)
+        model = load(entity_id)
+        if model:
+            try:
+                self._redis_client.setex(entity_key, self._ttl_by_type[entity_type], json.dumps(model.to_dict()))
+            except redis.RedisError as err:
+                _logger.warn('Redis: entity cache update failed. err={0}'.format(err))
+        return model
+
+    def stats(self):
+        return {t: {'hits': self._hits[t], 'misses': self._misses[t]} for t in self._ttl_by_type}
+
+    def _record(self, entity_type, counter):
+        counter[entity_type] += 1
+        self._lookups += 1
+        if self._lookups % self._stats_interval == 0:
+            _logger.info('entity cache stats: %s' % json.dumps(self.stats(), sort_keys=True))
+
+    @staticmethod
+    def _keys(entity_type, entity_id):
+        return 'dart:entity:%s:%s' % (entity_type, entity_id), 'dart:entity_version:%s:%s' % (entity_type, entity_id)
+
+    def _after_flush(self, session, flush_context):
+        # flushed changes only become visible to other readers at commit time, so invalidation waits until then
+        invalidations = session.info.setdefault('entity_cache_invalidations', {})
+        for instances, deleted in [(session.dirty, False), (session.deleted, True)]:
+            for instance in instances:
+                entity_type = self._type_by_dao.get(type(instance))
+                if entity_type:
+                    version = _DELETED_VERSION if deleted else instance.version_id
+                    invalidations[(entity_type, instance.id)] = version
+
+    def _after_commit(self, session):
+        invalidations = session.info.pop('entity_cache_invalidations', None)
+        if not invalidations:
+            return
+        try:
+            pipeline = self._redis_client.pipeline(transaction=False)
+            for (entity_type, entity_id), version in invalidations.iteritems():
+                entity_key, version_key = self._keys(entity_type, entity_id)
+                pipeline.delete(entity_key)
+                # outlives any entity cached before, or concurrently with, this commit
+                pipeline.setex(version_key, 2 * self._ttl_by_type[entity_type], version)
+            pipeline.execute()
+        except redis.RedisError as err:
+            _logger.error('Redis: entity cache invalidation failed. err={0}'.format(err))
+
+    @staticmethod
+    def _after_rollback(session):
+        session.info.pop('entity_cache_invalidations', None)
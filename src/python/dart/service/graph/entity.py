@@ -1,14 +1,16 @@
 # coding=utf-8
-from collections import defaultdict
+from collections import defaultdict, OrderedDict
 import json
 import redis
 import logging
+import threading
+import time
 
 from sqlalchemy import text
 
 from dart.context.database import db_replica as db
 from dart.context.locator import injectable
-from dart.model.action import Action, ActionState
+from dart.model.action import Action
 from dart.model.dataset import Dataset
 from dart.model.datastore import Datastore
 from dart.model.event import Event
@@ -18,22 +20,49 @@ from dart.model.orm import SubGraphDefinitionDao
 from dart.model.subscription import Subscription
 from dart.model.trigger import Trigger
 from dart.model.workflow import Workflow
-from dart.service.graph.sql_recursive import RECURSIVE_SQL
-from dart.service.graph.sql_misc import ENTITY_IDENTIFIER_SQL, DATASTORE_ONE_OFFS_SQL, WORKFLOW_INSTANCE_SQL
+from dart.service.graph.sql_edges import ENTITY_EDGES_SQL, ENTITY_NODES_SQL_BY_TYPE
+from dart.service.graph.sql_misc import ENTITY_IDENTIFIER_SQL, DATASTORE_ONE_OFFS_SQL, WORKFLOW_INSTANCE_SQL, \
+    GRAPH_ENTITY_TYPES, ENTITY_STATES_SQL, GRAPH_FINGERPRINT_SQL, WORKFLOW_INSTANCE_PROGRESS_SQL
 from dart.service.graph.sub_graph import get_static_subgraphs_by_engine_name, \
     get_static_subgraphs_by_engine_name_all_engines_related_none
 from dart.util.rand import random_id
 
 _logger = logging.getLogger(__name__)
 
+_MAX_GRAPH_RECORDS = 1000
+
+
+class _GraphCache(object):
+    """ a small, thread safe, least recently used cache of built graphs, local to this process """
+    def __init__(self, max_size=256):
+        self._max_size = max_size
+        self._values = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._values.pop(key, None)
+            if not item or item[0] < time.time():
+                return None
+            self._values[key] = item
+            return item[1]
+
+    def put(self, key, value, ttl_seconds):
+        with self._lock:
+            self._values.pop(key, None)
+            self._values[key] = (time.time() + ttl_seconds, value)
+            while len(self._values) > self._max_size:
+                self._values.popitem(last=False)
+
+
 @injectable
 class GraphEntityService(object):
-    def __init__(self, engine_service, datastore_service, action_service, dart_config):
+    def __init__(self, engine_service, datastore_service, dart_config):
         self._engine_service = engine_service
         self._datastore_service = datastore_service
-        self._action_service = action_service
 
         self._dart_config = dart_config
+        self._graph_cache = _GraphCache()
 
         self.redis_expiration_ttl = 0
         self.redis_client = None
@@ -178,36 +207,47 @@ class GraphEntityService(object):
             :rtype: dart.model.graph.Graph """
 
         key = "graph:{0}".format(entity.entity_id)
-        cached_graph = self.redis_client.get(key) if self.redis_client else None  # String representation of each Graph record
-
-        if cached_graph:
-            json_records = json.loads(cached_graph)
-            ### read state from database:
-            # we need to update the current state of object in the graph
-            get_state_sql = ["select '{0}' as type, '{1}' as id,'{2}' as name, data->>'state' as state, '{4}' as sub_type, '{5}' as related_type, '{6}' as related_id, '{7}' as related_is_a FROM {0} where id = '{1}'".format(*rec) for rec in json_records]
+        cached = self._graph_cache.get(key)
+        if cached:
+            records, fingerprint, graph = cached
+            # served as is until one of its entities, visible workflow instances or one-off actions changes
+            current_fingerprint = self._get_graph_fingerprint(records)
+            if current_fingerprint == fingerprint:
+                return graph
+            fingerprint = current_fingerprint
+        else:
+            cached_records = self.redis_client.get(key) if self.redis_client else None  # String representation of each Graph record
+            if cached_records:
+                records = [tuple(r) for r in json.loads(cached_records)]
+            else:
+                records = self._get_entity_graph_records(entity)
+                if self.redis_client:
+                    self.redis_client.setex(key, self.redis_expiration_ttl, json.dumps(records))  # Keep this graph cached for 10 minutes
+            fingerprint = self._get_graph_fingerprint(records)
 
-            # add union all between sql statements
-            state_sql = " union all ".join(get_state_sql)
+        # the fingerprint is read first, so changes made while the graph is built only cause another rebuild
+        graph = self._build_entity_graph(self._refresh_record_states(records))
+        if self.redis_expiration_ttl:
+            self._graph_cache.put(key, (records, fingerprint, graph), self.redis_expiration_ttl)
+        return graph
 
-            # execute sql: (dart_depth was already removed, so we use r instead of r[0:-1])
-            records = [(r) for r in db.session.execute(text(state_sql))]
-        else:
-            records = [
-                (r[:-1])  # remove depth parameter
-                for r in db.session.execute(text(RECURSIVE_SQL).bindparams(
-                    entity_type=entity.entity_type,
-                    entity_id=entity.entity_id,
-                    name=entity.name,
-                    state=entity.state,
-                    sub_type=entity.sub_type
-                ))
-            ]
-            string_records = json.dumps(records)
-            if self.redis_client:
-                self.redis_client.setex(key, self.redis_expiration_ttl, string_records)  # Keep this graph cached for 10 minutes
-
-
-        # rebuilding graph from string
+    @staticmethod
+    def _ids_by_type(records):
+        ids_by_type = {'%s_ids' % t: set() for t in GRAPH_ENTITY_TYPES}
+        for r in records:
+            ids_by_type['%s_ids' % r[0]].add(r[1])
+        return {k: list(ids) for k, ids in ids_by_type.iteritems()}
+
+    def _get_graph_fingerprint(self, records):
+        rows = db.session.execute(text(GRAPH_FINGERPRINT_SQL), self._ids_by_type(records))
+        return tuple(sorted(tuple(r) for r in rows))
+
+    def _refresh_record_states(self, records):
+        """ returns the records with the current state of their entities, dropping those of deleted entities """
+        states = {(r[0], r[1]): r[2] for r in db.session.execute(text(ENTITY_STATES_SQL), self._ids_by_type(records))}
+        return [r[:3] + (states[r[:2]],) + r[4:] for r in records if r[:2] in states]
+
+    def _build_entity_graph(self, records):
         entities = [GraphEntity(*r) for r in records]
 
         nodes, visited_nodes = [], set()
@@ -250,26 +290,17 @@ class GraphEntityService(object):
             d_ids=', '.join(["'" + d_id + "'" for d_id in d_ids])
         ))
 
-        for r in db.session.execute(statement):
+        rows = db.session.execute(statement).fetchall()
+        running_wfi_ids = {r[2] for r in rows if r[0] == 'workflow' and r[3] == 'RUNNING'}
+        progress_by_wfi_id = self._get_workflow_instance_progress(running_wfi_ids)
+
+        for r in rows:
             if r[0] == 'workflow':
                 entity_type, wf_id, wfi_id, wfi_state, a_id, a_name, a_state, a_sub_type = r
 
                 name = 'workflow_instance'
-                if wfi_state == 'RUNNING' and ('workflow_instance' + wfi_id) not in visited_nodes:
-                    actions = self._action_service.find_actions(workflow_instance_id=wfi_id)
-                    if None not in [a.data.avg_runtime for a in actions]:
-                        wfi_progress = 0
-                        wf_runtime = 0
-                        for a in actions:
-                            a_runtime = a.data.avg_runtime.total_seconds()
-                            wf_runtime += a_runtime
-                            if a.data.state == ActionState.COMPLETED or a.data.state == ActionState.FAILED:
-                                wfi_progress += a_runtime
-                            elif (a.data.state == ActionState.RUNNING or a.data.state == ActionState.FINISHING) and a.data.progress:
-                                wfi_progress += a_runtime * a.data.progress
-                        if wf_runtime:
-                            wfi_progress /= wf_runtime
-                            name += ' - {:.0%}'.format(wfi_progress)
+                if wfi_id in progress_by_wfi_id:
+                    name += ' - {:.0%}'.format(progress_by_wfi_id[wfi_id])
 
                 self._add_node(nodes, visited_nodes, 'workflow_instance', wfi_id, name, wfi_state, None)
                 self._add_edge(edges, visited_edges, 'workflow', wf_id, 'workflow_instance', wfi_id)
@@ -283,6 +314,66 @@ class GraphEntityService(object):
 
         return Graph(nodes, edges)
 
+    @staticmethod
+    def _get_entity_graph_records(entity):
+        """
+        Walks the entity_edge table breadth first from the given entity, one query per level, and returns
+        (type, id, name, state, sub_type, related_type, related_id, related_is_a) records for GraphEntity.
+
+        :type entity: dart.model.graph.GraphEntity
+        """
+        root = (entity.entity_type, entity.entity_id)
+        node_values = {root: (entity.name, entity.state, entity.sub_type)}
+        records = [root + node_values[root] + (None, None, None)]
+        visited = {root}
+        frontier = [root]
+        while frontier and len(records) < _MAX_GRAPH_RECORDS:
+            frontier_keys = set(frontier)
+            related = []
+            for src_type, src_id, dst_type, dst_id in db.session.execute(
+                    text(ENTITY_EDGES_SQL), {'ids': [k[1] for k in frontier]}):
+                src, dst = (src_type, src_id), (dst_type, dst_id)
+                # a datastore only leads to its workflows when it is the entity being graphed
+                if src in frontier_keys and (src_type != EntityType.datastore or src == root):
+                    related.append((dst, src, Relationship.PARENT))
+                if dst in frontier_keys:
+                    related.append((src, dst, Relationship.CHILD))
+
+            node_values.update(GraphEntityService._get_node_values({r[0] for r in related} - set(node_values)))
+            frontier = []
+            for key, related_key, related_is_a in related:
+                if key not in node_values:
+                    # edges may still refer to deleted entities
+                    continue
+                if key not in visited:
+                    visited.add(key)
+                    frontier.append(key)
+                records.append(key + node_values[key] + related_key + (related_is_a,))
+                if len(records) >= _MAX_GRAPH_RECORDS:
+                    break
+        return records
+
+    @staticmethod
+    def _get_node_values(keys):
+        """ :return: a dict of (type, id) -> (name, state, sub_type) for the given (type, id) keys that exist """
+        ids_by_type = defaultdict(list)
+        for entity_type, entity_id in keys:
+            if entity_type in ENTITY_NODES_SQL_BY_TYPE:
+                ids_by_type[entity_type].append(entity_id)
+        if not ids_by_type:
+            return {}
+        sql = ' UNION ALL '.join(ENTITY_NODES_SQL_BY_TYPE[t] for t in sorted(ids_by_type))
+        params = {'%s_ids' % t: ids for t, ids in ids_by_type.iteritems()}
+        return {(r[0], r[1]): tuple(r[2:]) for r in db.session.execute(text(sql), params)}
+
+    @staticmethod
+    def _get_workflow_instance_progress(workflow_instance_ids):
+        """ :return: a dict of workflow instance id -> progress, for those whose actions all have an avg_runtime """
+        if not workflow_instance_ids:
+            return {}
+        statement = text(WORKFLOW_INSTANCE_PROGRESS_SQL)
+        return dict(db.session.execute(statement, {'workflow_instance_ids': list(workflow_instance_ids)}).fetchall())
+
     @staticmethod
     def _get_datastore_one_offs(nodes):
         d_sql = ''
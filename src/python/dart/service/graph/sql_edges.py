@@ -0,0 +1,21 @@
+ENTITY_EDGES_SQL_ = """
+    SELECT e.src_type, e.src_id, e.dst_type, e.dst_id
+      FROM entity_edge e
+     WHERE e.src_id = ANY(:ids)
+        OR e.dst_id = ANY(:ids)
+  GROUP BY e.src_type, e.src_id, e.dst_type, e.dst_id
+  ORDER BY MIN(e.ordinal), e.src_type, e.src_id, e.dst_type, e.dst_id
+"""
+ENTITY_EDGES_SQL = ' '.join(ENTITY_EDGES_SQL_.split())
+
+
+# entity type -> query for the (type, id, name, state, sub_type) of the nodes of that type with the given ids
+ENTITY_NODES_SQL_BY_TYPE = {
+    'action': "SELECT 'action', id, data ->> 'name', data ->> 'state', data ->> 'action_type_name' FROM action WHERE id = ANY(:action_ids)",
+    'dataset': "SELECT 'dataset', id, data ->> 'name', NULL, NULL FROM dataset WHERE id = ANY(:dataset_ids)",
+    'datastore': "SELECT 'datastore', id, data ->> 'name', data ->> 'state', data ->> 'engine_name' FROM datastore WHERE id = ANY(:datastore_ids)",
+    'event': "SELECT 'event', id, data ->> 'name', data ->> 'state', NULL FROM event WHERE id = ANY(:event_ids)",
+    'subscription': "SELECT 'subscription', id, data ->> 'name', data ->> 'state', NULL FROM subscription WHERE id = ANY(:subscription_ids)",
+    'trigger': "SELECT 'trigger', id, data ->> 'name', data ->> 'state', data ->> 'trigger_type_name' FROM trigger WHERE id = ANY(:trigger_ids)",
+    'workflow': "SELECT 'workflow', id, data ->> 'name', data ->> 'state', NULL FROM workflow WHERE id = ANY(:workflow_ids)",
+}
@@ -82,3 +82,63 @@ WORKFLOW_INSTANCE_SQL_ = """
    ORDER BY wfis.created, CAST(a.data ->> 'order_idx' AS FLOAT), a.created
 """
 WORKFLOW_INSTANCE_SQL = ''.join(WORKFLOW_INSTANCE_SQL_.split('\n'))
+
+
+# completed and failed actions count fully, running and finishing ones by their progress, all weighted by their
+# avg_runtime (stored like "1 day, 2:03:04", which postgres parses once the comma is removed).  instances with an
+# action that has never completed are left out.
+WORKFLOW_INSTANCE_PROGRESS_SQL_ = """
+    SELECT a.workflow_instance_id,
+           SUM(a.runtime * CASE WHEN a.state IN ('COMPLETED', 'FAILED') THEN 1.0
+                                WHEN a.state IN ('RUNNING', 'FINISHING') THEN COALESCE(a.progress, 0.0)
+                                ELSE 0.0
+                           END) / SUM(a.runtime)
+      FROM (
+            SELECT workflow_instance_id,
+                   state,
+                   CAST(data ->> 'progress' AS FLOAT) AS progress,
+                   EXTRACT(EPOCH FROM CAST(REPLACE(data ->> 'avg_runtime', ',', '') AS INTERVAL)) AS runtime
+              FROM action
+             WHERE workflow_instance_id = ANY(:workflow_instance_ids)
+           ) a
+  GROUP BY a.workflow_instance_id
+    HAVING COUNT(a.runtime) = COUNT(*)
+       AND SUM(a.runtime) > 0
+"""
+WORKFLOW_INSTANCE_PROGRESS_SQL = ' '.join(WORKFLOW_INSTANCE_PROGRESS_SQL_.split())
+
+
+GRAPH_ENTITY_TYPES = ['action', 'dataset', 'datastore', 'event', 'subscription', 'trigger', 'workflow']
+
+
+# one statement for every graph, with a (possibly empty) id array per entity type
+ENTITY_STATES_SQL = ' UNION ALL '.join(
+    "SELECT '{0}', id, data ->> 'state' FROM {0} WHERE id = ANY(:{0}_ids)".format(t) for t in GRAPH_ENTITY_TYPES
+)
+
+
+GRAPH_FINGERPRINT_SQL_ = ' UNION ALL '.join(
+    "SELECT '{0}', COUNT(*), MAX(updated) FROM {0} WHERE id = ANY(:{0}_ids)".format(t) for t in GRAPH_ENTITY_TYPES
+) + """
+    UNION ALL
+     SELECT 'workflow_instance', COUNT(*), MAX(GREATEST(wfis.updated, a.updated))
+       FROM workflow w
+       JOIN LATERAL (
+             SELECT wfi.id, wfi.updated
+               FROM workflow_instance wfi
+              WHERE wfi.workflow_id = w.id
+           ORDER BY wfi.created DESC
+              LIMIT CAST(w.data ->> 'concurrency' AS INT)
+          ) wfis
+         ON TRUE
+  LEFT JOIN action a
+         ON a.workflow_instance_id = wfis.id
+      WHERE w.id = ANY(:workflow_ids)
+    UNION ALL
+     SELECT 'datastore_one_off', COUNT(*), MAX(updated)
+       FROM action
+      WHERE datastore_id = ANY(:datastore_ids)
+        AND workflow_id IS NULL
+        AND created > NOW() - INTERVAL '1 day'
+"""
+GRAPH_FINGERPRINT_SQL = ' '.join(GRAPH_FINGERPRINT_SQL_.split())
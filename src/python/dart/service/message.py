@@ -1,7 +1,7 @@
 import os
 import boto3
 from boto.regioninfo import RegionInfo
-from sqlalchemy import text
+from sqlalchemy import text, update
 from dart.model.orm import MessageDao
 from dart.context.database import db
 from dart.service.patcher import patch_difference
@@ -15,19 +15,25 @@ class MessageService(object):
 
     @staticmethod
     def save_message(message_id, message_body, state):
-        message_dao = MessageDao()
-        message_dao.id = message_id
-        message_dao.message_body = message_body
-        message_dao.instance_id = os.environ['DART_INSTANCE_ID']
-        message_dao.container_id = os.environ['DART_CONTAINER_ID']
-        message_dao.ecs_cluster = os.environ['DART_ECS_CLUSTER']
-        message_dao.ecs_container_instance_arn = os.environ['DART_ECS_CONTAINER_INSTANCE_ARN']
-        message_dao.ecs_family = os.environ['DART_ECS_FAMILY']
-        message_dao.ecs_task_arn = os.environ['DART_ECS_TASK_ARN']
-        message_dao.state = state
-        db.session.add(message_dao)
+        MessageService.save_messages([(message_id, message_body)], state)
+        return MessageDao.query.get(message_id).to_model()
+
+    @staticmethod
+    def save_messages(message_ids_and_bodies, state):
+        """ saves (message_id, message_body) tuples with a single commit """
+        for message_id, message_body in message_ids_and_bodies:
+            message_dao = MessageDao()
+            message_dao.id = message_id
+            message_dao.message_body = message_body
+            message_dao.instance_id = os.environ['DART_INSTANCE_ID']
+            message_dao.container_id = os.environ['DART_CONTAINER_ID']
+            message_dao.ecs_cluster = os.environ['DART_ECS_CLUSTER']
+            message_dao.ecs_container_instance_arn = os.environ['DART_ECS_CONTAINER_INSTANCE_ARN']
+            message_dao.ecs_family = os.environ['DART_ECS_FAMILY']
+            message_dao.ecs_task_arn = os.environ['DART_ECS_TASK_ARN']
+            message_dao.state = state
+            db.session.add(message_dao)
         db.session.commit()
-        return message_dao.to_model()
 
     def get_batch_job_status(self, message):
         """ :type message: dart.model.message.Message """
@@ -72,6 +78,24 @@ class MessageService(object):
             raise Exception('message with id=%s not found' % message_id)
         return message_dao.to_model() if message_dao else None
 
+    @staticmethod
+    def get_messages(message_ids):
+        """ :rtype: dict[str, dart.model.message.Message] """
+        if not message_ids:
+            return {}
+        message_daos = MessageDao.query.filter(MessageDao.id.in_(message_ids)).all()
+        return {dao.id: dao.to_model() for dao in message_daos}
+
+    @staticmethod
+    def update_messages_state(message_ids, state):
+        # each message is handled by a single consumer, so a plain bulk update (bumping the versions) is safe
+        db.session.execute(
+            update(MessageDao)
+            .where(MessageDao.id.in_(message_ids))
+            .values(state=state, version_id=MessageDao.version_id + 1)
+        )
+        db.session.commit()
+
     @staticmethod
     def update_message_state(message, state):
         """ :type message: dart.model.message.Message """
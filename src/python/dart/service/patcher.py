@@ -1,7 +1,11 @@
+import json
+
 import jsonpatch
 from retrying import retry
+from sqlalchemy import text
 from sqlalchemy.orm.exc import StaleDataError
 from dart.context.database import db
+from dart.model.base import to_dict
 from dart.model.exception import DartConditionalUpdateFailedException
 
 
@@ -32,3 +36,79 @@ def patch_data(dao, model_id, patch, commit=True, conditional=None):
     if commit:
         db.session.commit()
     return dao_instance.to_model()
+
+
+def bulk_patch_data(dao, versions_by_id, patch, commit=True, max_attempts=5):
+    """
+    Applies one json patch to the "data" column of many entities with a single UPDATE statement, instead of
+    loading and patching each entity with patch_data.  Each row is only updated if its version_id still matches
+    the given one, and is bumped like an orm update would.  Rows that were modified concurrently are re-read and
+    patched again, the same way patch_data retries on StaleDataError.
+
+    Only "add", "replace" and "remove" operations on object properties below "/data/" are supported.
+
+    :param versions_by_id: the version_id of each entity to patch, keyed by id
+    :type versions_by_id: dict[str, int]
+    :type patch: jsonpatch.JsonPatch
+    :return: the ids of the patched entities (entities that no longer exist are left out)
+    :rtype: list[str]
+    """
+    data_expression, params = _data_patch_expression(patch)
+    sql = text("""
+        UPDATE "{table}" AS t
+        SET data = {data_expression}, version_id = t.version_id + 1
+        FROM unnest(CAST(:ids AS VARCHAR[]), CAST(:version_ids AS INTEGER[])) AS v(id, version_id)
+        WHERE t.id = v.id AND t.version_id = v.version_id
+        RETURNING t.id
+        """.format(table=dao.__tablename__, data_expression=data_expression))
+
+    patched_ids = []
+    remaining = dict(versions_by_id)
+    for attempt in range(max_attempts):
+        if attempt > 0 and remaining:
+            remaining = dict(db.session.query(dao.id, dao.version_id).filter(dao.id.in_(remaining.keys())).all())
+        if not remaining:
+            break
+        ids = remaining.keys()
+        params.update(ids=ids, version_ids=[remaining[i] for i in ids])
+        updated_ids = [r[0] for r in db.session.execute(sql, params)]
+        patched_ids.extend(updated_ids)
+        for i in updated_ids:
+            del remaining[i]
+    if remaining:
+        db.session.rollback()
+        raise StaleDataError('%s %s entities were concurrently modified too often' % (len(remaining), dao.__name__))
+
+    # orm instances in this session no longer reflect these rows
+    for instance in db.session.identity_map.values():
+        if isinstance(instance, dao) and instance.id in versions_by_id:
+            db.session.expire(instance)
+    if commit:
+        db.session.commit()
+    return patched_ids
+
+
+def data_patch(values):
+    """ :return: a patch that sets the given "data" properties, e.g. data_patch({'state': 'SKIPPED'}) """
+    return jsonpatch.JsonPatch([{'op': 'add', 'path': '/data/' + k, 'value': to_dict(v)} for k, v in values.items()])
+
+
+def _data_patch_expression(patch):
+    expression = 't.data'
+    params = {}
+    for i, operation in enumerate(patch.patch):
+        path = operation['path'].split('/')
+        if path[:2] != ['', 'data'] or len(path) < 3:
+            raise ValueError('only paths below /data/ can be bulk patched, got: %s' % operation['path'])
+        # undo json pointer escaping
+        keys = [p.replace('~1', '/').replace('~0', '~') for p in path[2:]]
+        params['path_%s' % i] = keys
+        if operation['op'] in ('add', 'replace'):
+            params['value_%s' % i] = json.dumps(operation['value'])
+            expression = 'jsonb_set({0}, CAST(:path_{1} AS TEXT[]), CAST(:value_{1} AS JSONB), true)'\
+                .format(expression, i)
+        elif operation['op'] == 'remove':
+            expression = '({0} #- CAST(:path_{1} AS TEXT[]))'.format(expression, i)
+        else:
+            raise ValueError('unsupported bulk patch operation: %s' % operation['op'])
+    return expression, params
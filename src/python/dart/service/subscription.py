@@ -1,21 +1,31 @@
 import logging
 
 from datetime import datetime
+from multiprocessing.pool import ThreadPool
+from Queue import Queue, Full
+import re
+import threading
+import time
+import traceback
+
 import boto
-from sqlalchemy import insert, literal, not_, func, text, update, cast, String, or_, desc
+from sqlalchemy import literal, not_, func, text, update, cast, String, or_, desc
 from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.orm.exc import NoResultFound
 from dart.context.locator import injectable
 from dart.model.exception import DartValidationException
 from dart.model.orm import SubscriptionDao, DatasetDao, SubscriptionElementDao, TriggerDao
 from dart.context.database import db
-from dart.model.subscription import SubscriptionElementState, SubscriptionState, SubscriptionElementStats
+from dart.model.subscription import SubscriptionElementState, SubscriptionState, SubscriptionElementStats, \
+    SUBSCRIPTION_ELEMENT_FIELDS
 from dart.schema.base import default_and_validate
 from dart.schema.subscription import subscription_schema
 from dart.service.patcher import patch_difference, retry_stale_data
 from dart.trigger.subscription import subscription_batch_trigger
 from dart.util.rand import random_id
-from dart.util.s3 import yield_s3_keys, get_bucket, get_s3_path
+from dart.util.s3 import yield_s3_keys, get_bucket, get_s3_path, get_key_name, discover_s3_key_shards,\
+    yield_s3_shard_keys
+from dart.util.strings import substitute_date_tokens
 
 
 _batch_size = 1000
@@ -148,49 +158,42 @@ class SubscriptionService(object):
 
 @injectable
 class SubscriptionElementService(object):
-    def __init__(self, dataset_service):
+    def __init__(self, dataset_service, dart_config):
         self._dataset_service = dataset_service
+        generation_config = dart_config['dart'].get('subscription_element_generation') or {}
+        self._listing_threads = generation_config.get('listing_threads', 8)
+        self._queue_size = generation_config.get('queue_size', 10 * _batch_size)
+        self._checkpoint_interval_seconds = generation_config.get('checkpoint_interval_seconds', 10)
 
     def generate_subscription_elements(self, subscription):
         """ :type subscription: dart.model.subscription.Subscription """
+        # a subscription that is still GENERATING was interrupted (e.g. a lost container), so pick up where it left off
+        checkpoints = {}
+        if subscription.data.state == SubscriptionState.GENERATING:
+            checkpoints = subscription.data.generation_checkpoints or {}
         _update_subscription_state(subscription, SubscriptionState.GENERATING)
 
         dataset = self._dataset_service.get_dataset(subscription.data.dataset_id)
         conn = boto.connect_s3()
         bucket = get_bucket(conn, dataset.data.location)
-        s3_keys = yield_s3_keys(
+        now = datetime.utcnow()
+        start = substitute_date_tokens(subscription.data.s3_path_start_prefix_inclusive, now)
+        end = substitute_date_tokens(subscription.data.s3_path_end_prefix_exclusive, now)
+        shards = discover_s3_key_shards(
             bucket,
-            dataset.data.location,
-            subscription.data.s3_path_start_prefix_inclusive,
-            subscription.data.s3_path_end_prefix_exclusive,
-            subscription.data.s3_path_regex_filter,
+            get_key_name(dataset.data.location),
+            get_key_name(start) if start else None,
+            get_key_name(end) if end else None,
+            target_count=self._listing_threads * 4,
         )
-        elements = []
-        subscription_element_dict = {}
-        for i, key_obj in enumerate(s3_keys):
-            sid = subscription.id
-            s3_path = get_s3_path(key_obj)
-            state = SubscriptionElementState.UNCONSUMED
-            now = datetime.now()
-            subscription_element_dict = {
-                'id': random_id(),
-                'version_id': 0,
-                'created': now,
-                'updated': now,
-                'subscription_id': sid,
-                's3_path': s3_path,
-                'file_size': key_obj.size,
-                'state': state
-            }
-            elements.append(subscription_element_dict)
-
-            batch_size_reached = (i + 1) % _batch_size == 0
-            if batch_size_reached:
-                self._insert_elements(elements)
-                elements = []
+        _logger.info('generating subscription (id=%s) elements from %s s3 key shards' % (subscription.id, len(shards)))
 
-        if len(elements) > 0:
-            self._insert_elements(elements)
+        generator = _ShardedSubscriptionElementGenerator(
+            self, subscription, dataset.data.location, bucket.name, shards, checkpoints, start, end,
+            substitute_date_tokens(subscription.data.s3_path_regex_filter, now), self._listing_threads,
+            self._queue_size, self._checkpoint_interval_seconds
+        )
+        last_s3_path = generator.run()
 
         _update_subscription_state(subscription, SubscriptionState.ACTIVE)
 
@@ -201,18 +204,13 @@ class SubscriptionElementService(object):
         s3_keys = yield_s3_keys(
             bucket,
             dataset.data.location,
-            subscription_element_dict.get('s3_path'),
+            last_s3_path,
             subscription.data.s3_path_end_prefix_exclusive,
             subscription.data.s3_path_regex_filter,
         )
-        for key_obj in s3_keys:
-            self.conditional_insert_subscription_element(subscription, get_s3_path(key_obj), key_obj.size)
-
-    @staticmethod
-    def _insert_elements(elements):
-        # this will produce one multi-valued insert statement (rather than multiple single inserts)
-        db.session.execute(insert(SubscriptionElementDao).values(elements))
-        db.session.commit()
+        self.bulk_insert_subscription_elements(
+            (subscription, get_s3_path(key_obj), key_obj.size) for key_obj in s3_keys
+        )
 
     @staticmethod
     def conditional_insert_subscription_element(subscription, s3_path, size):
@@ -247,6 +245,63 @@ class SubscriptionElementService(object):
             db.session.commit()
             return True
 
+    @staticmethod
+    def bulk_insert_subscription_elements(elements):
+        """
+        Inserts UNCONSUMED subscription elements for (subscription, s3_path, size) tuples, silently skipping the ones
+        that already exist.  Rows are written with multi-valued "INSERT ... ON CONFLICT DO NOTHING" statements of at
+        most _batch_size rows each (backed by the unique (subscription_id, s3_path) index) and committed once.
+
+        :type elements: collections.Iterable[(dart.model.subscription.Subscription, str, long)]
+        :return: the ids of the subscriptions that received at least one new element
+        :rtype: set[str]
+        """
+        sql = """
+            INSERT INTO subscription_element (
+                id,
+                version_id,
+                created,
+                updated,
+                subscription_id,
+                s3_path,
+                file_size,
+                state
+            )
+            VALUES {values}
+            ON CONFLICT (subscription_id, s3_path) DO NOTHING
+            RETURNING subscription_id
+            """
+        inserted_subscription_ids = set()
+        seen = set()
+        rows = []
+
+        def flush():
+            values = ', '.join('(:id%s, 0, NOW(), NOW(), :sid%s, :s3_path%s, :size%s, :state)' % ((i,) * 4)
+                               for i in range(len(rows)))
+            params = {'state': SubscriptionElementState.UNCONSUMED}
+            for i, (sid, s3_path, size) in enumerate(rows):
+                params.update({'id%s' % i: random_id(), 'sid%s' % i: sid, 's3_path%s' % i: s3_path, 'size%s' % i: size})
+            results = db.session.execute(text(sql.format(values=values)).bindparams(**params))
+            inserted_subscription_ids.update(r[0] for r in results)
+
+        try:
+            for subscription, s3_path, size in elements:
+                if (subscription.id, s3_path) in seen:
+                    continue
+                seen.add((subscription.id, s3_path))
+                rows.append((subscription.id, s3_path, size))
+                if len(rows) >= _batch_size:
+                    flush()
+                    rows = []
+            if rows:
+                flush()
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+
+        return inserted_subscription_ids
+
     @staticmethod
     def get_subscription_element(subscription_id, s3_path):
         """ :rtype: dart.model.subscription.SubscriptionElement """
@@ -268,6 +323,36 @@ class SubscriptionElementService(object):
         query = query.offset(offset) if offset else query
         return [se.to_model() for se in query.all()]
 
+    def stream_subscription_elements(self, subscription_id, state=SubscriptionElementState.UNCONSUMED, fields=None,
+                                     gt_s3_path=None, action_id=None, gte_processed=None, batch_size=10000):
+        """
+        Yields the matching subscription elements ordered by s3_path, as dicts of only the given fields (all of them
+        by default).  Rows are read in batches that resume after the previous batch's last s3_path, so (unlike
+        limit/offset paging) every batch is a short range scan of the (subscription_id, s3_path) index.
+
+        :type fields: list[str]
+        :rtype: collections.Iterable[dict]
+        """
+        fields = fields or SUBSCRIPTION_ELEMENT_FIELDS
+        unknown_fields = set(fields) - set(SUBSCRIPTION_ELEMENT_FIELDS)
+        if unknown_fields:
+            raise DartValidationException('unknown subscription element fields: %s' % ', '.join(sorted(unknown_fields)))
+        return self._stream_subscription_elements(subscription_id, state, fields, gt_s3_path, action_id,
+                                                  gte_processed, batch_size)
+
+    def _stream_subscription_elements(self, subscription_id, state, fields, gt_s3_path, action_id, gte_processed,
+                                      batch_size):
+        columns = [getattr(SubscriptionElementDao, f) for f in fields] + [SubscriptionElementDao.s3_path]
+        last_s3_path = gt_s3_path
+        while True:
+            query = self._find_subscription_elements_query(action_id, last_s3_path, state, subscription_id, gte_processed)
+            rows = query.with_entities(*columns).order_by(SubscriptionElementDao.s3_path).limit(batch_size).all()
+            for row in rows:
+                yield dict(zip(fields, row))
+            if len(rows) < batch_size:
+                return
+            last_s3_path = rows[-1][-1]
+
     def find_subscription_elements_count(self, subscription_id, state=SubscriptionElementState.UNCONSUMED,
                                          gt_s3_path=None, action_id=None, gte_processed=None):
         query = self._find_subscription_elements_query(action_id, gt_s3_path, state, subscription_id, gte_processed)
@@ -368,8 +453,8 @@ class SubscriptionElementService(object):
     def _subscription_batch_trigger_exists(subscription_id):
         contains_arg = {'subscription_id': subscription_id}
         results = TriggerDao.query \
-            .filter(TriggerDao.data['trigger_type_name'].astext == subscription_batch_trigger.name) \
-            .filter(TriggerDao.data['state'].astext == SubscriptionState.ACTIVE) \
+            .filter(TriggerDao.trigger_type_name == subscription_batch_trigger.name) \
+            .filter(TriggerDao.state == SubscriptionState.ACTIVE) \
             .filter(TriggerDao.data['args'].op('@>')(cast(contains_arg, JSONB))) \
             .limit(1) \
             .all()
@@ -402,5 +487,130 @@ def _update_subscription_state(subscription, state):
         subscription.data.generating_time = datetime.now()
     if state == SubscriptionState.ACTIVE and subscription.data.state == SubscriptionState.GENERATING:
         subscription.data.initial_active_time = datetime.now()
+        subscription.data.generation_checkpoints = None
     subscription.data.state = state
     return patch_difference(SubscriptionDao, source_subscription, subscription)
+
+
+class _ShardedSubscriptionElementGenerator(object):
+    """
+    Lists the s3 key shards of a subscription concurrently on a thread pool, feeding a bounded queue that is drained
+    by the calling thread, which bulk inserts the elements.  Per-shard progress is periodically saved to the
+    subscription's generation_checkpoints so that an interrupted generation resumes instead of starting over (the
+    bulk inserts skip elements that already exist, so replaying the tail of a shard is harmless).
+    """
+    _SHARD_DONE = 'SHARD_DONE'
+    _SHARD_FAILED = 'SHARD_FAILED'
+
+    def __init__(self, subscription_element_service, subscription, location, bucket_name, shards, checkpoints, start,
+                 end, regex_filter, listing_threads, queue_size, checkpoint_interval_seconds):
+        """ :type subscription: dart.model.subscription.Subscription """
+        self._subscription_element_service = subscription_element_service
+        self._subscription = subscription
+        self._location = location.rstrip('/')
+        self._bucket_name = bucket_name
+        self._shards = shards
+        self._checkpoints = dict(checkpoints)
+        self._start = start
+        self._end = end
+        self._regex = re.compile(regex_filter) if regex_filter else None
+        self._listing_threads = listing_threads
+        self._queue = Queue(maxsize=queue_size)
+        self._checkpoint_interval_seconds = checkpoint_interval_seconds
+        self._stopped = threading.Event()
+
+    @staticmethod
+    def _shard_id(shard):
+        key_prefix, delimiter = shard
+        return '%s|%s' % (key_prefix, delimiter or '')
+
+    def run(self):
+        """ :return: the greatest s3_path that was listed, if any """
+        pending = [s for s in self._shards if not self._checkpoints.get(self._shard_id(s), {}).get('complete')]
+        _logger.info('subscription (id=%s): %s of %s shards left to list' % (
+            self._subscription.id, len(pending), len(self._shards)))
+
+        pool = ThreadPool(max(1, min(self._listing_threads, len(pending))))
+        try:
+            pool.map_async(self._list_shard, pending)
+            self._write(len(pending))
+        finally:
+            self._stopped.set()
+            pool.close()
+            pool.join()
+
+        last_paths = [c.get('last_s3_path') for c in self._checkpoints.values() if c.get('last_s3_path')]
+        return max(last_paths) if last_paths else None
+
+    def _list_shard(self, shard):
+        shard_id = self._shard_id(shard)
+        try:
+            bucket = boto.connect_s3().get_bucket(self._bucket_name)
+            last_s3_path = self._checkpoints.get(shard_id, {}).get('last_s3_path')
+            marker = get_key_name(last_s3_path) if last_s3_path else None
+            for key_obj in yield_s3_shard_keys(bucket, shard[0], shard[1], marker):
+                s3_path = get_s3_path(key_obj)
+                if s3_path.rstrip('/') == self._location:
+                    continue
+                if self._start and s3_path < self._start:
+                    continue
+                if self._end and s3_path >= self._end:
+                    break
+                if self._regex and not self._regex.search(s3_path):
+                    continue
+                if not self._put((shard_id, s3_path, key_obj.size)):
+                    return
+            self._put((shard_id, self._SHARD_DONE, None))
+        except Exception:
+            self._put((shard_id, self._SHARD_FAILED, traceback.format_exc()))
+
+    def _put(self, item):
+        # the writer stops consuming when it fails, so never block forever on a full queue
+        while not self._stopped.is_set():
+            try:
+                self._queue.put(item, timeout=1)
+                return True
+            except Full:
+                continue
+        return False
+
+    def _write(self, shard_count):
+        remaining = shard_count
+        elements = []
+        listed_paths = {}
+        last_checkpoint_time = time.time()
+        while remaining > 0:
+            shard_id, s3_path, size = self._queue.get()
+            if s3_path == self._SHARD_FAILED:
+                raise Exception('failed to list s3 key shard %s for subscription (id=%s): %s' % (
+                    shard_id, self._subscription.id, size))
+
+            if s3_path == self._SHARD_DONE:
+                remaining -= 1
+                self._flush(elements, listed_paths)
+                elements = []
+                listed_paths = {}
+                self._checkpoints.setdefault(shard_id, {})['complete'] = True
+            else:
+                elements.append((self._subscription, s3_path, size))
+                listed_paths[shard_id] = s3_path
+                if len(elements) >= _batch_size:
+                    self._flush(elements, listed_paths)
+                    elements = []
+                    listed_paths = {}
+
+            if remaining == 0 or time.time() - last_checkpoint_time >= self._checkpoint_interval_seconds:
+                self._save_checkpoints()
+                last_checkpoint_time = time.time()
+
+    def _flush(self, elements, listed_paths):
+        if elements:
+            self._subscription_element_service.bulk_insert_subscription_elements(elements)
+        # shards are listed in key order and the queue is FIFO, so everything up to these paths is now committed
+        for shard_id, s3_path in listed_paths.iteritems():
+            self._checkpoints.setdefault(shard_id, {})['last_s3_path'] = s3_path
+
+    def _save_checkpoints(self):
+        source_subscription = self._subscription.copy()
+        self._subscription.data.generation_checkpoints = {k: dict(v) for k, v in self._checkpoints.iteritems()}
+        patch_difference(SubscriptionDao, source_subscription, self._subscription)
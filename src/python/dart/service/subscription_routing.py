@@ -0,0 +1,118 @@
+import logging
+import re
+import threading
+
+from sqlalchemy import func
+
+from dart.context.database import db
+from dart.context.locator import injectable
+from dart.model.orm import SubscriptionDao, DatasetDao
+from dart.model.subscription import SubscriptionState
+from dart.util.prefix_index import PrefixIndex
+
+_logger = logging.getLogger(__name__)
+
+
+@injectable
+class SubscriptionRoutingService(object):
+    """
+    In-memory replacement for SubscriptionService.find_matching_subscriptions.  ACTIVE subscriptions are indexed by
+    their dataset location, with their start/end prefixes and regex filters precompiled, so matching an s3 path never
+    touches the database.  refresh() should be called before routing a batch of s3 events: it issues one cheap
+    fingerprint query and only reloads the subscriptions whose (subscription, dataset) versions have changed.
+    """
+    def __init__(self):
+        self._index = PrefixIndex()
+        self._fingerprint = None
+        # s3 events may be handled concurrently by the subscription broker's handler threads
+        self._lock = threading.RLock()
+
+    def refresh(self, force=False):
+        with self._lock:
+            return self._refresh(force)
+
+    def _refresh(self, force):
+        fingerprint = self._current_fingerprint()
+        if not force and fingerprint == self._fingerprint:
+            return False
+
+        versions_by_id = {
+            r[0]: (r[1], r[2]) for r in db.session
+            .query(SubscriptionDao.id, SubscriptionDao.version_id, DatasetDao.version_id)
+            .join(DatasetDao, DatasetDao.id == SubscriptionDao.data['dataset_id'].astext)
+            .filter(SubscriptionDao.data['state'].astext == SubscriptionState.ACTIVE)
+            .all()
+        }
+
+        for subscription_id in [sid for sid in self._index.keys() if sid not in versions_by_id]:
+            self._index.remove(subscription_id)
+
+        stale_ids = [sid for sid, versions in versions_by_id.iteritems() if self._route_versions(sid) != versions]
+        if stale_ids:
+            self._load_routes(stale_ids, versions_by_id)
+
+        self._fingerprint = fingerprint
+        values = (len(self._index), len(stale_ids))
+        _logger.info('subscription routing index refreshed (routes=%s, reloaded=%s)' % values)
+        return True
+
+    def find_matching_subscriptions(self, s3_path):
+        """ :rtype: list[dart.model.subscription.Subscription] """
+        with self._lock:
+            return [route.subscription for route in self._index.match(s3_path) if route.matches(s3_path)]
+
+    def _route_versions(self, subscription_id):
+        route = self._index.get(subscription_id)
+        return route.versions if route else None
+
+    def _load_routes(self, subscription_ids, versions_by_id):
+        subscription_daos = SubscriptionDao.query.filter(SubscriptionDao.id.in_(subscription_ids)).all()
+        subscriptions = [dao.to_model() for dao in subscription_daos]
+        dataset_ids = list({s.data.dataset_id for s in subscriptions})
+        location_by_dataset_id = dict(
+            db.session
+            .query(DatasetDao.id, DatasetDao.data['location'].astext)
+            .filter(DatasetDao.id.in_(dataset_ids))
+            .all()
+        )
+        for subscription in subscriptions:
+            location = location_by_dataset_id.get(subscription.data.dataset_id)
+            if location is None or subscription.data.state != SubscriptionState.ACTIVE:
+                self._index.remove(subscription.id)
+                continue
+            route = _SubscriptionRoute(subscription, versions_by_id[subscription.id])
+            self._index.put(subscription.id, location, route)
+
+    @staticmethod
+    def _current_fingerprint():
+        # any insert, update or delete on either table changes at least one of these aggregates
+        aggregates = lambda dao: db.session.query(func.count(dao.id), func.max(dao.updated), func.sum(dao.version_id))
+        return tuple(aggregates(SubscriptionDao).one()) + tuple(aggregates(DatasetDao).one())
+
+
+class _SubscriptionRoute(object):
+    def __init__(self, subscription, versions):
+        """ :type subscription: dart.model.subscription.Subscription """
+        self.subscription = subscription
+        self.versions = versions
+        self._start = subscription.data.s3_path_start_prefix_inclusive
+        self._end = subscription.data.s3_path_end_prefix_exclusive
+        self._regex = None
+        self._unmatchable = False
+        if subscription.data.s3_path_regex_filter:
+            try:
+                self._regex = re.compile(subscription.data.s3_path_regex_filter)
+            except re.error:
+                _logger.error('subscription (id=%s) has an invalid s3_path_regex_filter' % subscription.id)
+                self._unmatchable = True
+
+    def matches(self, s3_path):
+        if self._unmatchable:
+            return False
+        if self._start and s3_path < self._start:
+            return False
+        if self._end and s3_path >= self._end:
+            return False
+        if self._regex and not self._regex.search(s3_path):
+            return False
+        return True
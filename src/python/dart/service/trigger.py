@@ -144,9 +144,9 @@ class TriggerService(object):
     def find_triggers_query(contains_arg, trigger_type_name, state=TriggerState.ACTIVE):
         query = TriggerDao.query
         if trigger_type_name:
-            query = query.filter(TriggerDao.data['trigger_type_name'].astext == trigger_type_name)
+            query = query.filter(TriggerDao.trigger_type_name == trigger_type_name)
         if state:
-            query = query.filter(TriggerDao.data['state'].astext == state)
+            query = query.filter(TriggerDao.state == state)
         if contains_arg:
             # we use "op" here because sqlalchemy has a bug in JSONB "contains"
             query = query.filter(TriggerDao.data['args'].op('@>')(cast(contains_arg, JSONB)))
@@ -116,8 +116,8 @@ class WorkflowService(object):
     @staticmethod
     def find_workflow_instances_query(workflow_id, states=None, limit=None, offset=None):
         query = WorkflowInstanceDao.query
-        query = query.filter(WorkflowInstanceDao.data['workflow_id'].astext == workflow_id) if workflow_id else query
-        query = query.filter(WorkflowInstanceDao.data['state'].astext.in_(states)) if states else query
+        query = query.filter(WorkflowInstanceDao.workflow_id == workflow_id) if workflow_id else query
+        query = query.filter(WorkflowInstanceDao.state.in_(states)) if states else query
         query = query.order_by(desc(WorkflowInstanceDao.data['start_time'].cast(DateTime)))
         query = query.limit(limit) if limit else query
         query = query.offset(offset) if offset else query
@@ -220,7 +220,7 @@ class WorkflowService(object):
             for workflow_instance in workflow_instances:
                 self._action_service.delete_actions_in_workflow_instance(workflow_instance.id)
             offset += 20
-        WorkflowInstanceDao.query.filter(WorkflowInstanceDao.data['workflow_id'].astext == workflow_id).delete(False)
+        WorkflowInstanceDao.query.filter(WorkflowInstanceDao.workflow_id == workflow_id).delete(False)
         db.session.commit()
 
     def update_workflow_avg_runtime(self, workflow_instance):
@@ -136,7 +136,7 @@ def export_swagger_definitions(out):
             'PagedSubscriptionsResponse': paged_response_schema('Subscription'),
 
             'SubscriptionElement': subscription_element_schema(),
-            'PagedSubscriptionElementsResponse': paged_response_schema('SubscriptionElement'),
+            'PagedSubscriptionElementsResponse': keyset_paged_response_schema('SubscriptionElement', 'next_after_s3_path'),
 
             'Trigger': trigger_schema({'type': 'object'}),
             'TriggerResponse': object_response_schema('Trigger'),
@@ -334,6 +334,12 @@ def array_response_schema(type_name):
     }
 
 
+def keyset_paged_response_schema(type_name, next_key_name):
+    schema = paged_response_schema(type_name)
+    schema['properties'][next_key_name] = {'type': 'string', 'x-nullable': True}
+    return schema
+
+
 def paged_response_schema(type_name):
     if type_name == 'object':
         type_info = {
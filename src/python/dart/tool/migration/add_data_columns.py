@@ -0,0 +1,125 @@
+import logging
+import traceback
+
+from sqlalchemy import text
+
+from dart.context.database import db
+from dart.tool.tool_runner import Tool
+
+_logger = logging.getLogger(__name__)
+
+
+# table -> [(column, column type, expression copied from the "data" column)], matching model/orm.py
+_DATA_COLUMNS = {
+    'action': [
+        ('state', 'VARCHAR(50)', "data->>'state'"),
+        ('datastore_id', 'VARCHAR(36)', "data->>'datastore_id'"),
+        ('workflow_id', 'VARCHAR(36)', "data->>'workflow_id'"),
+        ('workflow_instance_id', 'VARCHAR(36)', "data->>'workflow_instance_id'"),
+        ('order_idx', 'FLOAT', "CAST(data->>'order_idx' AS FLOAT)"),
+    ],
+    'dataset': [
+        ('location', 'TEXT', "data->>'location'"),
+    ],
+    'trigger': [
+        ('state', 'VARCHAR(50)', "data->>'state'"),
+        ('trigger_type_name', 'VARCHAR(255)', "data->>'trigger_type_name'"),
+    ],
+    'workflow_instance': [
+        ('state', 'VARCHAR(50)', "data->>'state'"),
+        ('workflow_id', 'VARCHAR(36)', "data->>'workflow_id'"),
+    ],
+}
+
+# index name -> (table, columns), matching model/orm.py
+_INDEXES = {
+    'ix_action_state': ('action', ['state']),
+    'ix_action_workflow_id': ('action', ['workflow_id']),
+    'ix_action_workflow_instance_id': ('action', ['workflow_instance_id']),
+    'ix_action_order_idx': ('action', ['order_idx']),
+    'ix_action_datastore_id_state_order_idx': ('action', ['datastore_id', 'state', 'order_idx']),
+    'ix_dataset_location': ('dataset', ['location']),
+    'ix_trigger_state': ('trigger', ['state']),
+    'ix_trigger_trigger_type_name': ('trigger', ['trigger_type_name']),
+    'ix_workflow_instance_state': ('workflow_instance', ['state']),
+    'ix_workflow_instance_workflow_id': ('workflow_instance', ['workflow_id']),
+}
+
+
+class AddDataColumns(Tool):
+    """
+    Adds the indexed copies of hot "data" fields to the action, dataset, trigger and workflow_instance tables,
+    installs the triggers that maintain them (also found in src/database/triggers.sql), backfills existing rows in
+    batches and finally creates the indexes.  It is safe to run more than once.
+    """
+    def __init__(self, batch_size=10000):
+        super(AddDataColumns, self).__init__(_logger)
+        self._batch_size = batch_size
+
+    def run(self):
+        try:
+            for table, columns in sorted(_DATA_COLUMNS.items()):
+                self._add_columns(table, columns)
+            for table, columns in sorted(_DATA_COLUMNS.items()):
+                self._backfill(table, columns)
+            for name, (table, columns) in sorted(_INDEXES.items()):
+                _logger.info('creating index %s' % name)
+                db.session.execute('CREATE INDEX IF NOT EXISTS %s ON "%s" (%s)' % (name, table, ', '.join(columns)))
+                db.session.commit()
+            _logger.info('done')
+
+        except Exception as e:
+            db.session.rollback()
+            _logger.error(traceback.format_exc())
+            raise e
+
+    @staticmethod
+    def _add_columns(table, columns):
+        _logger.info('adding data columns to %s' % table)
+        for column, column_type, _ in columns:
+            db.session.execute('ALTER TABLE "%s" ADD COLUMN IF NOT EXISTS %s %s' % (table, column, column_type))
+
+        # once the trigger exists, every write keeps the columns current, so the backfill can run while dart is up
+        assignments = ''.join('    NEW.%s = %s;\n' % (c, e.replace('data->>', 'NEW.data->>')) for c, _, e in columns)
+        db.session.execute("""
+            CREATE OR REPLACE FUNCTION copy_%(table)s_data_columns()
+            RETURNS TRIGGER AS $$
+            BEGIN
+            %(assignments)s    RETURN NEW;
+            END;
+            $$ language 'plpgsql'
+            """ % {'table': table, 'assignments': assignments})
+        db.session.execute('DROP TRIGGER IF EXISTS %(table)s_copy_data_columns ON "%(table)s"' % {'table': table})
+        db.session.execute("""
+            CREATE TRIGGER %(table)s_copy_data_columns BEFORE INSERT OR UPDATE ON "%(table)s"
+            FOR EACH ROW EXECUTE PROCEDURE copy_%(table)s_data_columns()
+            """ % {'table': table})
+        db.session.commit()
+
+    def _backfill(self, table, columns):
+        # the backfill should not make every row look recently updated, but writes made while dart keeps running must
+        # still bump "updated".  ALTER TABLE is transactional in postgres, so the timestamp trigger is disabled only
+        # inside each batch's transaction, and concurrent writes to the table wait for that batch to commit.
+        disable = 'ALTER TABLE "%(table)s" DISABLE TRIGGER %(table)s_update_timestamp' % {'table': table}
+        enable = 'ALTER TABLE "%(table)s" ENABLE TRIGGER %(table)s_update_timestamp' % {'table': table}
+        assignments = ', '.join('%s = %s' % (c, e) for c, _, e in columns)
+        select_ids = text('SELECT id FROM "%s" WHERE id > :last_id ORDER BY id LIMIT :limit' % table)
+        update = text('UPDATE "%s" SET %s WHERE id = ANY(:ids)' % (table, assignments))
+        last_id = ''
+        count = 0
+        while True:
+            ids = [r[0] for r in db.session.execute(select_ids, {'last_id': last_id, 'limit': self._batch_size})]
+            if not ids:
+                break
+            db.session.execute(disable)
+            db.session.execute(update, {'ids': ids})
+            db.session.execute(enable)
+            db.session.commit()
+            # resume after the last id in postgres' own sort order
+            last_id = ids[-1]
+            count += len(ids)
+            _logger.info('backfilled %s %s rows' % (count, table))
+
+
+if __name__ == '__main__':
+    AddDataColumns().run()
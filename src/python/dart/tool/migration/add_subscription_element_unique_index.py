@@ -0,0 +1,53 @@
+import logging
+import traceback
+
+from dart.context.database import db
+from dart.tool.tool_runner import Tool
+
+_logger = logging.getLogger(__name__)
+
+
+class AddSubscriptionElementUniqueIndex(Tool):
+    def __init__(self):
+        super(AddSubscriptionElementUniqueIndex, self).__init__(_logger)
+
+    def run(self):
+        try:
+            # the older conditional inserts were not protected against concurrent duplicates.  The duplicate that got
+            # furthest (consumed, then assigned to an action, then reserved) is kept, so that files already loaded or
+            # being loaded are not handed out again, and the oldest one among those
+            _logger.info('removing duplicate subscription elements')
+            result = db.session.execute("""
+                DELETE FROM subscription_element
+                WHERE id IN (
+                    SELECT id
+                    FROM (SELECT id,
+                                 ROW_NUMBER() OVER (
+                                     PARTITION BY subscription_id, s3_path
+                                     ORDER BY CASE state WHEN 'CONSUMED' THEN 0
+                                                         WHEN 'ASSIGNED' THEN 1
+                                                         WHEN 'RESERVED' THEN 2
+                                                         ELSE 3 END,
+                                              created, id) AS duplicate_rank
+                          FROM subscription_element) ranked
+                    WHERE duplicate_rank > 1
+                )
+                """)
+            _logger.info('removed %s duplicate subscription elements' % result.rowcount)
+
+            _logger.info('creating unique index on subscription_element (subscription_id, s3_path)')
+            db.session.execute("""
+                CREATE UNIQUE INDEX IF NOT EXISTS ix_subscription_element_subscription_id_s3_path
+                ON subscription_element (subscription_id, s3_path)
+                """)
+            db.session.commit()
+            _logger.info('done')
+
+        except Exception as e:
+            db.session.rollback()
+            _logger.error(traceback.format_exc())
+            raise e
+
+
+if __name__ == '__main__':
+    AddSubscriptionElementUniqueIndex().run()
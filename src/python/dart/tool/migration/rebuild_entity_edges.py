@@ -0,0 +1,83 @@
+import logging
+import traceback
+
+from sqlalchemy import text
+
+from dart.config.config import dart_root_relative_path
+from dart.context.database import db
+from dart.model.orm import EntityEdgeDao
+from dart.tool.tool_runner import Tool
+
+_logger = logging.getLogger(__name__)
+
+
+# owner table -> predicate selecting the rows that own edges (see src/database/entity_edge.sql)
+_EDGE_OWNERS = {
+    'action': "state = 'TEMPLATE'",
+    'subscription': 'TRUE',
+    'trigger': 'TRUE',
+    'workflow': 'TRUE',
+}
+
+
+class RebuildEntityEdges(Tool):
+    """
+    Creates the entity_edge table if needed, installs the functions and triggers from src/database/entity_edge.sql
+    that maintain it, and then recomputes the edges of every owner in batches, removing the edges of owners that no
+    longer exist.  Since the triggers are installed first, dart can keep running meanwhile.  The dataset.location
+    column must exist (see add_data_columns.py).  It is safe to run more than once.
+    """
+    def __init__(self, batch_size=5000):
+        super(RebuildEntityEdges, self).__init__(_logger)
+        self._batch_size = batch_size
+
+    def run(self):
+        try:
+            _logger.info('installing entity_edge table, functions and triggers')
+            EntityEdgeDao.__table__.create(db.engine, checkfirst=True)
+            with open(dart_root_relative_path('src', 'database', 'entity_edge.sql')) as f:
+                db.engine.execute(f.read())
+
+            for table, predicate in sorted(_EDGE_OWNERS.items()):
+                self._rebuild(table, predicate)
+            _logger.info('done')
+
+        except Exception as e:
+            db.session.rollback()
+            _logger.error(traceback.format_exc())
+            raise e
+
+    def _rebuild(self, table, predicate):
+        values = {'table': table, 'predicate': predicate}
+        select_ids = text('SELECT id FROM "%(table)s" WHERE %(predicate)s AND id > :last_id ORDER BY id LIMIT :limit'
+                          % values)
+        delete = text('DELETE FROM entity_edge WHERE owner_type = :owner_type AND owner_id = ANY(:ids)')
+        insert = text("""
+            INSERT INTO entity_edge (src_type, src_id, dst_type, dst_id, relation, owner_type, owner_id, ordinal)
+            SELECT e.* FROM "%(table)s" o, LATERAL %(table)s_entity_edges(o) e WHERE o.id = ANY(:ids)
+            ON CONFLICT DO NOTHING
+            """ % values)
+        last_id = ''
+        count = 0
+        while True:
+            ids = [r[0] for r in db.session.execute(select_ids, {'last_id': last_id, 'limit': self._batch_size})]
+            if not ids:
+                break
+            db.session.execute(delete, {'owner_type': table, 'ids': ids})
+            db.session.execute(insert, {'ids': ids})
+            db.session.commit()
+            last_id = ids[-1]
+            count += len(ids)
+            _logger.info('rebuilt the entity edges of %s %s rows' % (count, table))
+
+        result = db.session.execute(text("""
+            DELETE FROM entity_edge e
+             WHERE e.owner_type = :owner_type
+               AND NOT EXISTS (SELECT 1 FROM "%(table)s" o WHERE o.id = e.owner_id AND %(predicate)s)
+            """ % values), {'owner_type': table})
+        db.session.commit()
+        _logger.info('removed %s stale entity edges owned by %s rows' % (result.rowcount, table))
+
+
+if __name__ == '__main__':
+    RebuildEntityEdges().run()
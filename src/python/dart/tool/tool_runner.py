@@ -4,6 +4,7 @@ import logging.config
 import os
 from dart.config.config import configuration, set_dart_environment_variables
 from dart.context.context import AppContext
+from dart.service.entity_cache import EntityCacheService
 
 
 class Tool(object):
@@ -16,6 +17,8 @@ class Tool(object):
             logger.info('loaded config from path: %s' % config_path)
             if configure_app_context:
                 self.app_context = AppContext(self.dart_config, ['dart.web'])
+                # workers and tools write the entities the web api caches, so their commits must invalidate them
+                self.app_context.get(EntityCacheService).install_session_hooks()
         else:
             logger.error("missing DART_CONFIG env variable")
             raise ValueError("missing DART_CONFIG env variable")
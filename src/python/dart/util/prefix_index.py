@@ -0,0 +1,61 @@
+class PrefixIndex(object):
+    """
+    Maps string prefixes to keyed values so that all values whose prefix is a prefix of a given string can be found
+    without scanning every entry.  Lookups only probe the distinct prefix lengths present in the index, which for
+    s3 locations is typically a handful of dictionary lookups regardless of how many entries are indexed.
+    """
+    def __init__(self):
+        self._values_by_prefix = {}
+        self._prefix_by_key = {}
+        self._count_by_length = {}
+        self._lengths = []
+
+    def put(self, key, prefix, value):
+        self.remove(key)
+        self._values_by_prefix.setdefault(prefix, {})[key] = value
+        self._prefix_by_key[key] = prefix
+        length = len(prefix)
+        if length not in self._count_by_length:
+            self._count_by_length[length] = 0
+            self._lengths = sorted(self._count_by_length.keys())
+        self._count_by_length[length] += 1
+
+    def remove(self, key):
+        prefix = self._prefix_by_key.pop(key, None)
+        if prefix is None:
+            return
+        values = self._values_by_prefix[prefix]
+        del values[key]
+        if not values:
+            del self._values_by_prefix[prefix]
+        length = len(prefix)
+        self._count_by_length[length] -= 1
+        if self._count_by_length[length] == 0:
+            del self._count_by_length[length]
+            self._lengths = sorted(self._count_by_length.keys())
+
+    def get(self, key):
+        prefix = self._prefix_by_key.get(key)
+        if prefix is None:
+            return None
+        return self._values_by_prefix[prefix][key]
+
+    def keys(self):
+        return self._prefix_by_key.keys()
+
+    def match(self, s):
+        """ yields the values of every entry whose prefix is a prefix of s """
+        s_length = len(s)
+        for length in self._lengths:
+            if length > s_length:
+                return
+            values = self._values_by_prefix.get(s[:length])
+            if values:
+                for value in values.itervalues():
+                    yield value
+
+    def __len__(self):
+        return len(self._prefix_by_key)
+
+    def __contains__(self, key):
+        return key in self._prefix_by_key
@@ -1,5 +1,7 @@
 from datetime import datetime
+from itertools import islice
 import re
+from boto.s3.prefix import Prefix
 from retrying import retry
 from dart.util.shell import call
 from dart.util.strings import substitute_date_tokens
@@ -43,6 +45,52 @@ def yield_s3_keys(bucket, s3_path_root_prefix, s3_path_start_prefix_inclusive=No
         yield key_obj
 
 
+def discover_s3_key_shards(bucket, key_prefix, start_key=None, end_key=None, target_count=32, max_depth=4,
+                           max_keys_per_level=1000):
+    """
+    Splits the key space under key_prefix into (key_prefix, delimiter) shards using delimiter-based discovery of the
+    folder hierarchy (e.g. partition folders), so that the shards can be listed independently.  A shard with a
+    delimiter of "/" only covers the keys sitting directly under its prefix, a shard with no delimiter covers every key
+    beginning with its prefix.  Folders that cannot contain keys in [start_key, end_key) are pruned.
+
+    :rtype: list[(str, str)]
+    """
+    def in_range(prefix):
+        if end_key and prefix >= end_key:
+            return False
+        if start_key and prefix < start_key and not start_key.startswith(prefix):
+            return False
+        return True
+
+    shards = []
+    pending = [key_prefix]
+    for depth in range(max_depth):
+        if len(shards) + len(pending) >= target_count:
+            break
+        next_pending = []
+        for prefix in pending:
+            entries = list(islice(bucket.list(prefix=prefix, delimiter='/'), max_keys_per_level + 1))
+            if len(entries) > max_keys_per_level:
+                # too many entries to enumerate cheaply (e.g. a flat folder), so list it as a whole
+                shards.append((prefix, None))
+                continue
+            if any(not isinstance(e, Prefix) for e in entries):
+                shards.append((prefix, '/'))
+            next_pending.extend(e.name for e in entries if isinstance(e, Prefix) and in_range(e.name))
+        pending = next_pending
+
+    shards.extend((prefix, None) for prefix in pending)
+    return sorted(shards)
+
+
+def yield_s3_shard_keys(bucket, key_prefix, delimiter=None, marker=''):
+    """ yields the key objects of a shard returned by discover_s3_key_shards, starting after marker """
+    for key_obj in bucket.list(prefix=key_prefix, delimiter=delimiter or '', marker=marker or ''):
+        if isinstance(key_obj, Prefix):
+            continue
+        yield key_obj
+
+
 def get_bucket_name(s3_path):
     return s3_path.split('s3://', 1)[1].split('/', 1)[0]
 
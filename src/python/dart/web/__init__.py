@@ -13,6 +13,7 @@ from dart.config.config import configuration
 from dart.context.context import AppContext
 from dart.context.database import db
 from dart.model.exception import DartValidationException, DartAuthenticationException
+from dart.service.entity_cache import EntityCacheService
 from dart.web.api.graph import api_graph_bp
 from dart.web.ui.admin.admin import admin_bp
 from dart.web.api.auth import login_manager, auth_bp
@@ -75,6 +76,7 @@ app.dart_context = AppContext(
         'dart.message.subscription_listener'
     ]
 )
+app.dart_context.get(EntityCacheService).install_session_hooks()
 
 app.config.update(config['flask'])
 app.config['SECRET_KEY'] = str(uuid.uuid4()) # not related to onelogin's secret key, its a flask secret key.
@@ -1,7 +1,7 @@
 import json
 import logging
 
-from flask import Blueprint, request, current_app
+from flask import Blueprint, request, current_app, abort
 from flask.ext.jsontools import jsonapi
 from flask.ext.login import login_required
 from dart.auth.required_roles import required_roles
@@ -19,7 +19,7 @@ from dart.model.workflow import WorkflowInstanceState
 from dart.service.datastore import DatastoreService
 from dart.service.filter import FilterService
 from dart.service.order_by import OrderByService
-from dart.web.api.entity_lookup import fetch_model, accounting_track
+from dart.web.api.entity_lookup import fetch_model, accounting_track, get_known_entity
 
 api_action_bp = Blueprint('api_action', __name__)
 _logger = logging.getLogger()
@@ -184,6 +184,40 @@ def patch_action(action):
     p = JsonPatch(request.get_json())
     return update_action(action, Action.from_dict(p.apply(action.to_dict())))
 
+@api_action_bp.route('/action', methods=['PATCH'])
+@login_required
+@accounting_track
+@jsonapi
+def patch_actions():
+    """ applies a list of {"id": action_id, "patch": json_patch} in one request, each as PATCH /action/<action> would.
+        Every action is looked up, authorized, patched and validated before any of them is saved, but each one is
+        then saved in its own transaction: the request is not atomic, and a failure while saving leaves the actions
+        before it saved. """
+    request_json = request.get_json()
+    if not isinstance(request_json, list):
+        request_json = [request_json]
+
+    sanitized_actions = []
+    for action_patch in request_json:
+        action = get_known_entity('action', action_patch['id'])
+        if not action:
+            abort(404)
+        denied = _authorize_action_edit(action=action)
+        if denied is not None:
+            abort(denied.status_code)
+        patched_action = Action.from_dict(JsonPatch(action_patch['patch']).apply(action.to_dict()))
+        sanitized_actions.append((action, _sanitize_and_validate(action, patched_action)))
+
+    return {'results': [action_service().patch_action(a, sanitized_action).to_dict()
+                        for a, sanitized_action in sanitized_actions]}
+
+
+@required_roles(['Edit'])
+def _authorize_action_edit(action):
+    """ :return: None if the current user may edit the action, otherwise the error response of required_roles """
+    return None
+
+
 def should_update(new_state, current_state):
     ''' A new state of action should only be updated if it is a more 'advanced' state.
         The order is PENDING < RUNNABLE < STARTING < RUNNING < COMPLETED < {FAILED|SUCCEEDED}.
@@ -205,6 +239,11 @@ def should_update(new_state, current_state):
 
 
 def update_action(action, updated_action):
+    sanitized_action = _sanitize_and_validate(action, updated_action)
+    return {'results': action_service().patch_action(action, sanitized_action).to_dict()}
+
+
+def _sanitize_and_validate(action, updated_action):
     # only allow updating fields that are editable
     sanitized_action = action.copy()
     sanitized_action.data.name = updated_action.data.name
@@ -219,9 +258,7 @@ def update_action(action, updated_action):
     sanitized_action.data.extra_data = updated_action.data.extra_data
 
     # revalidate
-    sanitized_action = action_service().default_and_validate_action(sanitized_action)
-
-    return {'results': action_service().patch_action(action, sanitized_action).to_dict()}
+    return action_service().default_and_validate_action(sanitized_action)
 
 
 @api_action_bp.route('/action/<action>', methods=['DELETE'])
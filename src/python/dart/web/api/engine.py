@@ -111,7 +111,7 @@ def action_checkin(action):
     error_message = action.data.error_message
     if action_result.state == ActionResultState.FAILURE:
         error_message = action_result.error_message
-    trigger_proxy().complete_action(action.id, action_state, error_message)
+    trigger_proxy().complete_action(action.id, action_state, error_message, action.data.datastore_id)
     return {'results': 'OK'}
 
 
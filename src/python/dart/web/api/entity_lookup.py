@@ -14,7 +14,8 @@ _logger = logging.getLogger(__name__)
 @injectable
 class EntityLookupService(object):
     def __init__(self, engine_service, dataset_service, datastore_service, action_service, trigger_service,
-                 workflow_service, subscription_service, event_service):
+                 workflow_service, subscription_service, event_service, entity_cache_service):
+        self._entity_cache_service = entity_cache_service
         self._services = {
             'engine': engine_service.get_engine,
             'subgraph_definition': engine_service.get_subgraph_definition,
@@ -33,7 +34,7 @@ class EntityLookupService(object):
 
     def get_entity(self, entity_type, id):
         get_func = self._services[entity_type]
-        return get_func(id, raise_when_missing=False)
+        return self._entity_cache_service.get_entity(entity_type, id, lambda i: get_func(i, raise_when_missing=False))
 
 
 def get_known_entity(entity_name, entity_id):
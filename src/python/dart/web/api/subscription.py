@@ -1,8 +1,8 @@
 import json
 import requests
 
-from flask import Blueprint, request, current_app
-from flask.ext.jsontools import jsonapi
+from flask import Blueprint, request, current_app, Response, stream_with_context
+from flask.ext.jsontools import jsonapi, make_json_response
 from flask.ext.login import login_required
 
 from jsonpatch import JsonPatch
@@ -11,6 +11,7 @@ from dart.model.subscription import Subscription, SubscriptionState, Subscriptio
 from dart.service.filter import FilterService
 from dart.service.subscription import SubscriptionService, SubscriptionElementService
 from dart.web.api.entity_lookup import fetch_model, accounting_track
+from dart.util.json_util import DartJsonEncoder
 from dart.util.s3 import get_bucket_name, get_key_name
 
 
@@ -75,7 +76,6 @@ def get_subscription_element_stats(subscription):
 @api_subscription_bp.route('/subscription/<subscription>/elements', methods=['GET'])
 @login_required
 @fetch_model
-@jsonapi
 def find_subscription_elements(subscription):
     """ :type subscription: dart.model.subscription.Subscription """
     state = request.args.get('state')
@@ -90,12 +90,11 @@ def find_subscription_elements(subscription):
 @api_subscription_bp.route('/action/<action>/subscription/elements', methods=['GET'])
 @login_required
 @fetch_model
-@jsonapi
 def find_action_subscription_elements(action):
     """ :type action: dart.model.action.Action """
     if 'subscription_id' not in action.data.args:
         error_message = 'action (id=%s) does not appear to consume a subscription: %s' % action.id
-        return {'results': 'ERROR', 'error_message': error_message}, 400, None
+        return make_json_response(({'results': 'ERROR', 'error_message': error_message}, 400, None))
     action_id = action.id
     subscription_id = action.data.args['subscription_id']
     state = SubscriptionElementState.ASSIGNED
@@ -103,8 +102,30 @@ def find_action_subscription_elements(action):
 
 
 def subscription_elements(action_id, state, subscription_id, gte_processed=None, gt_s3_path=None):
+    """
+    Pages with limit/offset by default.  With after_s3_path, pages continue after the given s3_path instead (as
+    given by the previous page's next_after_s3_path), which stays cheap however deep into the subscription it is.
+    With format=ndjson, all remaining elements are streamed as one json object per line (only the comma separated
+    "fields", when given), followed by a final {"end": {"count": <element count>}} line.
+    """
+    after_s3_path = request.args.get('after_s3_path')
+    if after_s3_path:
+        gt_s3_path = max(after_s3_path, gt_s3_path)
+
+    if request.args.get('format') == 'ndjson':
+        fields = request.args.get('fields')
+        elements = subscription_element_service().stream_subscription_elements(
+            subscription_id=subscription_id,
+            state=state,
+            fields=fields.split(',') if fields else None,
+            action_id=action_id,
+            gt_s3_path=gt_s3_path,
+            gte_processed=gte_processed
+        )
+        return Response(stream_with_context(_ndjson_lines(elements)), mimetype='application/x-ndjson')
+
     limit = int(request.args.get('limit', 10000))
-    offset = int(request.args.get('offset', 0))
+    offset = 0 if after_s3_path else int(request.args.get('offset', 0))
     elements = subscription_element_service().find_subscription_elements(
         subscription_id=subscription_id,
         state=state,
@@ -114,10 +135,11 @@ def subscription_elements(action_id, state, subscription_id, gte_processed=None,
         gt_s3_path=gt_s3_path,
         gte_processed=gte_processed
     )
-    return {
+    return make_json_response({
         'results': [e.to_dict() for e in elements],
         'limit': limit,
         'offset': offset,
+        'next_after_s3_path': elements[-1].s3_path if len(elements) == limit else None,
         'total': subscription_element_service().find_subscription_elements_count(
             subscription_id=subscription_id,
             state=state,
@@ -125,7 +147,16 @@ def subscription_elements(action_id, state, subscription_id, gte_processed=None,
             gt_s3_path=gt_s3_path,
             gte_processed=gte_processed
         )
-    }
+    })
+
+
+def _ndjson_lines(elements):
+    count = 0
+    for element in elements:
+        count += 1
+        yield json.dumps(element, cls=DartJsonEncoder, separators=(',', ':')) + '\n'
+    # lets clients tell a complete stream from one that was cut short
+    yield json.dumps({'end': {'count': count}}) + '\n'
 
 
 @api_subscription_bp.route('/subscription/<subscription>', methods=['PUT'])
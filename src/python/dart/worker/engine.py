@@ -10,14 +10,14 @@ from itertools import islice
 from multiprocessing import Process
 
 import re
+import select
 import boto3
 from dateutil.tz import tzutc
+from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
 
 from dart.context.database import db
 from dart.message.trigger_proxy import TriggerProxy
 from dart.model.action import ActionState
-from dart.model.datastore import DatastoreState
-from dart.model.exception import DartConditionalUpdateFailedException
 from dart.model.mutex import Mutexes
 from dart.service.action import ActionService
 from dart.service.datastore import DatastoreService
@@ -36,53 +36,79 @@ class EngineWorker(Tool):
         self._action_service = self.app_context.get(ActionService)
         self._datastore_service = self.app_context.get(DatastoreService)
         self._trigger_proxy = self.app_context.get(TriggerProxy)
-        self._sleep_seconds = 0.7
-        self._counter = Counter(transition_queued=1, transition_stale=85, transition_orphaned=60, scale_down=120)
+        self._action_state_channel = 'action_state_changed'
+        self._max_wait_seconds = 2
+        self._listen_conn = None
+        self._engine_cache_seconds = 60
+        self._engines_by_name = {}
+        self._stale_check_interval_seconds = 60
+        self._next_stale_check_time = time.time() + self._stale_check_interval_seconds
 
         self.batch_queue = self.dart_config['aws_batch'].get('job_queue') # The AWS batch queue we place the jobs in
         self.batch_job_suffix = self.dart_config['aws_batch'].get('job_definition_suffix')  # e.g. stg/prd
         self.sns_arn = self.dart_config['aws_batch'].get('sns_arn')  # different arn for stg/prd
 
     def run(self):
-        time.sleep(self._sleep_seconds)
-        self._counter.increment()
+        self._wait_for_action_state_changes()
 
-        if self._counter.is_ready('transition_queued'):
-            self._transition_queued_actions_to_pending()
+        self._transition_queued_actions_to_pending()
 
-        if self._counter.is_ready('transition_stale'):
+        if time.time() >= self._next_stale_check_time:
+            self._next_stale_check_time = time.time() + self._stale_check_interval_seconds
             self._transition_stale_pending_actions_to_queued()
 
+    def _wait_for_action_state_changes(self):
+        """
+        Blocks until postgres notifies that an action's state changed (see src/database/triggers.sql), or for at most
+        self._max_wait_seconds, so that queued actions are dispatched as soon as they are queued or capacity frees up.
+        """
+        try:
+            conn = self._listen_connection.connection
+            if select.select([conn], [], [], self._max_wait_seconds) != ([], [], []):
+                conn.poll()
+                del conn.notifies[:]
+        except Exception:
+            _logger.error('error waiting for action notifications: %s' % traceback.format_exc())
+            self._close_listen_connection()
+            time.sleep(self._max_wait_seconds)
+
+    @property
+    def _listen_connection(self):
+        if self._listen_conn:
+            return self._listen_conn
+        self._listen_conn = db.session.get_bind().raw_connection()
+        self._listen_conn.connection.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
+        cursor = self._listen_conn.cursor()
+        cursor.execute('LISTEN %s' % self._action_state_channel)
+        cursor.close()
+        return self._listen_conn
+
+    def _close_listen_connection(self):
+        if self._listen_conn:
+            try:
+                self._listen_conn.invalidate()
+            except Exception:
+                pass
+        self._listen_conn = None
+
+    def _get_engine(self, engine_name):
+        cached = self._engines_by_name.get(engine_name)
+        if cached and cached[1] > time.time():
+            return cached[0]
+        engine = self._engine_service.get_engine_by_name(engine_name)
+        self._engines_by_name[engine_name] = (engine, time.time() + self._engine_cache_seconds)
+        return engine
+
     def _transition_queued_actions_to_pending(self):
-        _logger.info('transitioning queued actions to pending')
         action_service = self._action_service
-        engine_service = self._engine_service
-        datastore_service = self._datastore_service
         assert isinstance(action_service, ActionService)
-        assert isinstance(engine_service, EngineService)
-        assert isinstance(datastore_service, DatastoreService)
-        queued_actions = action_service.find_actions(states=[ActionState.QUEUED])
-        for action in queued_actions:
-            try:
-                datastore = datastore_service.get_datastore(action.data.datastore_id, raise_when_missing=False)
-                if not datastore or datastore.data.state != DatastoreState.ACTIVE:
-                    continue
-
-                states = [ActionState.PENDING, ActionState.RUNNING, ActionState.FINISHING]
-                action_count = self._action_service.find_action_count(datastore.id, states)
-                if action_count >= datastore.data.concurrency:
-                    _logger.info('datastore (id=%s) has reached max concurrency' % datastore.id)
-                    continue
-
-                # conditionally updating queued actions as pending allows multiple concurrent engine workers if needed
-                action_service.update_action_state(
-                    action=action,
-                    state=ActionState.PENDING,
-                    error_message=action.data.error_message,
-                    conditional=lambda a: a.data.state == ActionState.QUEUED
-                )
+        claimed = action_service.claim_queued_actions()
+        if claimed:
+            _logger.info('transitioned %s queued actions to pending' % len(claimed))
 
-                engine = engine_service.get_engine_by_name(action.data.engine_name)
+        for action, datastore in claimed:
+            try:
+                engine = self._get_engine(action.data.engine_name)
 
                 # our best granualrity of a user_id to identifu who is running this workflow's action.
                 datastore_user_id = datastore.data.user_id if hasattr(datastore.data, 'user_id') else 'anonymous'
@@ -105,10 +131,6 @@ class EngineWorker(Tool):
                     msg = 'engine %s has no ecs_task_definition and local engines are not allowed'
                     raise Exception(msg % engine.data.name)
 
-            except DartConditionalUpdateFailedException:
-                # another engine worker picked it up
-                continue
-
             except Exception as e:
                 error_message = e.message + '\n\n\n' + traceback.format_exc()
                 _logger.error('error transitioning action (id=%s) to PENDING: %s' % (action.id, error_message))
@@ -201,7 +223,8 @@ class EngineWorker(Tool):
                     error_message=action.data.error_message,
                     conditional=lambda a: a.data.state == ActionState.PENDING
                 )
-                self._trigger_proxy.complete_action(action.id, ActionState.FAILED, action.data.error_message)
+                self._trigger_proxy.complete_action(action.id, ActionState.FAILED, action.data.error_message,
+                                                    action.data.datastore_id)
 
 
     @staticmethod
@@ -216,20 +239,5 @@ class EngineWorker(Tool):
         _logger.info('started in memory engine (name=%s) in process (pid=%s) to run action (id=%s)' % values)
 
 
-class Counter(object):
-    def __init__(self, **thresholds):
-        self._thresholds = thresholds
-        self._current = {k: 0 for k, v in self._thresholds.iteritems()}
-
-    def increment(self):
-        for k in self._current: self._current[k] += 1
-
-    def is_ready(self, key):
-        if self._current[key] > self._thresholds[key]:
-            self._current[key] = 0
-            return True
-        return False
-
-
 if __name__ == '__main__':
     Worker(EngineWorker(), _logger).run()
@@ -0,0 +1,93 @@
+# must run pip install -e . in src/python folder before running this unit test
+import errno
+import json
+import socket
+import unittest
+
+import requests
+from mock import Mock, patch
+from requests.packages.urllib3.exceptions import ProtocolError
+
+from tests.python.dart import orm_config  # noqa, must be imported before dart.client.python.dart_client
+from dart.client.python import dart_client
+from dart.client.python.dart_client import Dart
+from dart.model.action import Action, ActionData
+
+
+def _response(status_code):
+    return Mock(status_code=status_code)
+
+
+def _connection_error(socket_errno):
+    return requests.exceptions.ConnectionError(
+        ProtocolError('Connection aborted.', socket.error(socket_errno, 'socket error')))
+
+
+class SendTests(unittest.TestCase):
+
+    def setUp(self):
+        self.session = Mock()
+        for patcher in [patch.object(dart_client, '_get_session', return_value=self.session),
+                        patch.object(dart_client.time, 'sleep')]:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_idempotent_requests_are_retried_on_transient_statuses(self):
+        self.session.request.side_effect = [_response(503), _response(429), _response(200)]
+        self.assertEqual(dart_client._send('get', 'http://dart/api/1/action').status_code, 200)
+        self.assertEqual(self.session.request.call_count, 3)
+
+    def test_idempotent_requests_give_up_after_the_last_retry(self):
+        self.session.request.side_effect = _connection_error(errno.ECONNRESET)
+        self.assertRaises(requests.exceptions.ConnectionError, dart_client._send, 'put', 'http://dart/api/1/action/a')
+        self.assertEqual(self.session.request.call_count, dart_client._MAX_RETRIES + 1)
+
+    def test_non_idempotent_requests_are_not_retried_on_transient_statuses(self):
+        self.session.request.side_effect = [_response(503), _response(200)]
+        self.assertEqual(dart_client._send('post', 'http://dart/api/1/action').status_code, 503)
+
+    def test_non_idempotent_requests_are_retried_when_the_connection_was_refused(self):
+        self.session.request.side_effect = [_connection_error(errno.ECONNREFUSED),
+                                            requests.exceptions.ConnectTimeout(), _response(200)]
+        self.assertEqual(dart_client._send('patch', 'http://dart/api/1/action/a').status_code, 200)
+
+    def test_non_idempotent_requests_are_not_retried_once_they_may_have_been_sent(self):
+        for error in [_connection_error(errno.ECONNRESET), requests.exceptions.ReadTimeout()]:
+            self.session.request.reset_mock()
+            self.session.request.side_effect = [error, _response(200)]
+            self.assertRaises(type(error), dart_client._send, 'post', 'http://dart/api/1/action')
+            self.assertEqual(self.session.request.call_count, 1)
+
+
+class BulkMethodTests(unittest.TestCase):
+
+    def setUp(self):
+        self.dart = Dart('localhost', 5000)
+        patcher = patch.object(self.dart, '_request_list')
+        self.request_list = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_get_by_ids_pages_through_the_ids_and_keeps_their_order(self):
+        ids = ['a%03d' % i for i in range(150)]
+        self.request_list.side_effect = lambda method, url_prefix, params, model_class: [
+            Action(id=i, data=ActionData('a', 'a')) for i in reversed(json.loads(params['filters'])[0][6:].split(','))
+            if i != 'a001'
+        ]
+        actions = self.dart.get_actions_by_ids(ids)
+        self.assertEqual([a.id for a in actions], [i for i in ids if i != 'a001'])
+        self.assertEqual([c[1]['params']['limit'] for c in self.request_list.call_args_list], [100, 50])
+        self.assertEqual(self.request_list.call_args[0], ('get', '/action'))
+
+    def test_patch_actions_sends_one_patch_per_action(self):
+        actions = [Action(id='a1', data=ActionData('a', 'a')), Action(id='a2', data=ActionData('a', 'a'))]
+        self.dart.patch_actions([(actions[0], {'progress': '0.50'}), (actions[1], {'progress': 1})])
+        args, kwargs = self.request_list.call_args
+        self.assertEqual(args, ('patch', '/action'))
+        self.assertEqual(kwargs['data'], [
+            {'id': 'a1', 'patch': [{'op': 'replace', 'path': '/data/progress', 'value': '0.50'}]},
+            {'id': 'a2', 'patch': [{'op': 'replace', 'path': '/data/progress', 'value': 1}]},
+        ])
+
+    def test_patch_actions_without_actions_sends_nothing(self):
+        self.assertEqual(self.dart.patch_actions([]), [])
+        self.request_list.assert_not_called()
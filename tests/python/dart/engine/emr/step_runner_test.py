@@ -0,0 +1,88 @@
+# must run pip install -e . in src/python folder before running this unit test
+import unittest
+import xml.sax
+
+import boto.handler
+from mock import Mock, patch
+
+from dart.engine.emr import step_runner
+from dart.engine.emr.steps import JarStep, StepWrapper
+from dart.model.action import Action, ActionData
+from dart.model.datastore import Datastore, DatastoreData
+from dart.model.exception import DartActionException
+
+
+def _step_wrappers(count):
+    return [StepWrapper(JarStep('step %s' % i, 'command-runner.jar', action_on_failure='CONTINUE'), i, count)
+            for i in range(1, count + 1)]
+
+
+def _summary(step_id, state):
+    # every step runs for 90 seconds, and ended steps are reported with when they started and ended
+    timeline = Mock(startdatetime='2016-05-01T12:00:00Z', enddatetime='2016-05-01T12:01:30Z')
+    return Mock(id=step_id, status=Mock(state=state, timeline=timeline))
+
+
+def _engine(states_by_poll):
+    engine = Mock()
+    engine.conn.add_jobflow_steps.return_value = Mock(stepids=[Mock(value='s-%s' % i) for i in range(1, 4)])
+    summaries = [Mock(steps=[_summary(i, s) for i, s in states.items()]) for states in states_by_poll]
+    engine.conn.get_object.side_effect = summaries
+    engine.dart.patch_action.side_effect = lambda action, **data_properties: action
+    return engine
+
+
+class StepRunnerTests(unittest.TestCase):
+
+    def setUp(self):
+        self.action = Action(id='a1', data=ActionData('a', 'a'))
+        self.datastore = Datastore(id='d1', data=DatastoreData('d', 'emr', extra_data={'cluster_id': 'j-1'}))
+
+    @patch('dart.engine.emr.step_runner.time.sleep')
+    def test_steps_are_submitted_together_and_tracked_by_id(self, sleep):
+        engine = _engine([
+            {'s-1': 'RUNNING', 's-2': 'PENDING', 's-3': 'PENDING'},
+            {'s-1': 'COMPLETED', 's-2': 'COMPLETED', 's-3': 'RUNNING'},
+            {'s-3': 'COMPLETED'},
+        ])
+        step_wrappers = _step_wrappers(3)
+        step_runner.run_steps(engine, self.datastore, self.action, step_wrappers)
+
+        engine.conn.add_jobflow_steps.assert_called_once_with('j-1', [sw.step for sw in step_wrappers])
+        self.assertEqual([sw.step.action_on_failure for sw in step_wrappers], ['CONTINUE'] * 3)
+        self.assertEqual(engine.conn.get_object.call_count, 3)
+        self.assertEqual(engine.dart.patch_action.call_count, 2)
+        extra_data = engine.dart.patch_action.call_args[1]['extra_data']
+        self.assertEqual([(s['step_num'], s['seconds']) for s in extra_data['emr_steps']], [(1, 90), (2, 90), (3, 90)])
+        engine.conn.get_status.assert_not_called()
+
+    @patch('dart.engine.emr.step_runner.time.sleep')
+    def test_failed_step_raises_with_its_wrapper(self, sleep):
+        engine = _engine([
+            {'s-1': 'COMPLETED', 's-2': 'FAILED', 's-3': 'CANCELLED'},
+        ])
+        step_wrappers = _step_wrappers(3)
+        with self.assertRaises(DartActionException) as context:
+            step_runner.run_steps(engine, self.datastore, self.action, step_wrappers)
+        self.assertIs(context.exception.data, step_wrappers[1])
+        engine.conn.build_list_params.assert_called_with({'ClusterId': 'j-1'}, ['s-3'], 'StepIds.member')
+        self.assertEqual(engine.conn.get_status.call_args[0][0], 'CancelSteps')
+
+    def test_step_timelines_are_parsed(self):
+        body = '''<ListStepsResponse><ListStepsResult><Steps><member>
+            <Id>s-1</Id><Name>step 1</Name>
+            <Status><State>COMPLETED</State><Timeline>
+                <CreationDateTime>2016-05-01T11:00:00Z</CreationDateTime>
+                <StartDateTime>2016-05-01T12:00:00Z</StartDateTime>
+                <EndDateTime>2016-05-01T12:00:42.5Z</EndDateTime>
+            </Timeline></Status>
+        </member></Steps></ListStepsResult></ListStepsResponse>'''
+        summary_list = step_runner._StepSummaryList()
+        xml.sax.parseString(body, boto.handler.XmlHandler(summary_list, None))
+        self.assertEqual(summary_list.steps[0].status.state, 'COMPLETED')
+        self.assertEqual(step_runner._run_seconds(summary_list.steps[0]), 42.5)
+
+    def test_polling_slows_down_for_long_steps(self):
+        self.assertEqual(step_runner._poll_seconds(0), step_runner._MIN_POLL_SECONDS)
+        self.assertEqual(step_runner._poll_seconds(300), 30)
+        self.assertEqual(step_runner._poll_seconds(3600), step_runner._MAX_POLL_SECONDS)
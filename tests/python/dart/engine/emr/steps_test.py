@@ -0,0 +1,80 @@
+# must run pip install -e . in src/python folder before running this unit test
+import os
+import shutil
+import tempfile
+import unittest
+
+from dart.engine.emr.steps import LoadedPartitions, hive_add_partitions_step, impala_refresh_partitions_step
+from dart.model.dataset import Dataset, DatasetData, DataFormat, Column, FileFormat, RowFormat
+
+
+def _dataset(hive_compatible_partition_folders, partitions=None):
+    return Dataset(data=DatasetData(
+        name='test_dataset',
+        table_name='test_table',
+        location='s3://bucket/prefix',
+        load_type='INSERT',
+        data_format=DataFormat(FileFormat.TEXTFILE, RowFormat.JSON),
+        columns=[Column('a', 'STRING')],
+        partitions=partitions or [Column('year', 'STRING'), Column('month', 'STRING')],
+        hive_compatible_partition_folders=hive_compatible_partition_folders,
+    ))
+
+
+class LoadedPartitionsTests(unittest.TestCase):
+
+    def test_partitions_are_read_from_the_loaded_paths(self):
+        paths = [('s3://bucket/prefix/year=2016/month=01/a.gz', 1), ('s3://bucket/prefix/year=2016/month=01/b.gz', 1),
+                 ("s3://bucket/prefix/year=2016/month=it's%3A02/c.gz", 1)]
+        loaded_partitions = LoadedPartitions(_dataset(True), iter(paths))
+        self.assertEqual(list(loaded_partitions), paths)
+        self.assertEqual(loaded_partitions.partitions, [('2016', '01'), ('2016', "it's:02")])
+
+    def test_folders_are_named_after_partitions_when_not_hive_compatible(self):
+        loaded_partitions = LoadedPartitions(_dataset(False), iter([('s3://bucket/prefix/2016/01/a.gz', 1)]))
+        list(loaded_partitions)
+        self.assertEqual(loaded_partitions.partitions, [('2016', '01')])
+
+    def test_partitions_are_unknown_if_a_path_has_too_few_folders(self):
+        paths = [('s3://bucket/prefix/year=2016/month=01/a.gz', 1), ('s3://bucket/prefix/year=2016/b.gz', 1)]
+        loaded_partitions = LoadedPartitions(_dataset(True), iter(paths))
+        list(loaded_partitions)
+        self.assertIsNone(loaded_partitions.partitions)
+
+    def test_hive_step_adds_only_the_loaded_partitions(self):
+        tempdir = tempfile.mkdtemp()
+        try:
+            os.mkdir(os.path.join(tempdir, 'hive'))
+            paths = [("s3://bucket/prefix/year=2016/month=it's/a", 1)]
+            loaded_partitions = LoadedPartitions(_dataset(True), iter(paths))
+            list(loaded_partitions)
+            step_wrapper = hive_add_partitions_step('test_table', _dataset(True), loaded_partitions, 's3://steps',
+                                                    tempdir, 'a1', 3, 5)
+            with open(os.path.join(tempdir, 'hive', 'add_partitions_test_table.hql')) as f:
+                script = f.read()
+        finally:
+            shutil.rmtree(tempdir)
+        expected = "ALTER TABLE test_table ADD IF NOT EXISTS\n  PARTITION (year='2016', month='it\\'s');\n"
+        self.assertEqual(script, expected)
+        self.assertEqual(step_wrapper.step.step_args[-1], 's3://steps/hive/add_partitions_test_table.hql')
+
+    def test_numeric_partitions_are_not_quoted(self):
+        tempdir = tempfile.mkdtemp()
+        try:
+            os.mkdir(os.path.join(tempdir, 'impala'))
+            dataset = _dataset(True, [Column('year', 'INT'), Column('rate', 'DOUBLE'), Column('name', 'STRING')])
+            loaded_partitions = LoadedPartitions(dataset, iter([('s3://bucket/prefix/year=2016/rate=1.5/name=x/a', 1)]))
+            list(loaded_partitions)
+            impala_refresh_partitions_step('test_table', dataset, loaded_partitions, 's3://steps', tempdir, 'a1', 4, 5)
+            with open(os.path.join(tempdir, 'impala', 'refresh_partitions_test_table.sql')) as f:
+                script = f.read()
+        finally:
+            shutil.rmtree(tempdir)
+        self.assertEqual(script, "REFRESH test_table PARTITION (year=2016, rate=1.5, name='x');\n")
+
+    def test_partitions_are_unknown_if_a_value_does_not_fit_its_column_type(self):
+        dataset = _dataset(True, [Column('year', 'BIGINT')])
+        paths = [('s3://bucket/prefix/year=__HIVE_DEFAULT_PARTITION__/a', 1)]
+        loaded_partitions = LoadedPartitions(dataset, iter(paths))
+        list(loaded_partitions)
+        self.assertIsNone(loaded_partitions.partitions)
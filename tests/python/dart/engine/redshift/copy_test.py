@@ -0,0 +1,300 @@
+# must run pip install -e . in src/python folder before running this unit test
+import csv
+from datetime import datetime
+import gzip
+from io import BytesIO
+import itertools
+import time
+import unittest
+
+from mock import MagicMock, Mock, patch
+
+from dart.engine.redshift.command import copy
+from dart.engine.redshift.command.manifest import plan_manifests_by_count, ManifestPlan, S3CopyFile
+from dart.model.action import Action, ActionData
+from dart.model.dataset import Column, Dataset, DatasetData, DataFormat, FileFormat, LoadType, RowFormat
+from dart.model.datastore import Datastore, DatastoreData
+
+
+class _FakeRedshift(object):
+    """
+    Stands in for the cluster and s3 of a load.  The rows of a file are its merge keys: a COPY appends the rows of
+    its manifest's files to the stage table, and rows moved to the ordered stage table keep their dart_file_idx.
+    """
+    def __init__(self, keys_by_file):
+        self.keys_by_file = keys_by_file
+        self.files_by_manifest = {}
+        self.stage = []
+        self.copies = []
+        self.ordered_rows = []
+        self.statements = []
+
+    def upload_manifest(self, action, datastore, name, s3_copy_files):
+        s3_manifest_path = 's3://artifacts/%s.json' % name
+        self.files_by_manifest[s3_manifest_path] = [f.s3_path for f in s3_copy_files]
+        return s3_manifest_path
+
+    def copy_manifest(self, action, conn, dataset, datastore, stage_schema_name, stage_table_name, s3_manifest_path):
+        files = self.files_by_manifest[s3_manifest_path]
+        self.copies.append(files)
+        self.stage.extend(k for f in files for k in self.keys_by_file[f])
+
+    def execute(self, sql):
+        self.statements.append(' '.join(sql.split()))
+        if sql.startswith('SELECT 1 FROM'):
+            keys = [k for k in self.stage if k is not None]
+            return Mock(fetchone=Mock(return_value=(1,) if len(keys) > len(set(keys)) else None))
+        if sql.startswith('INSERT INTO') and '_ordered SELECT *, ' in sql:
+            file_idx = int(sql.split('SELECT *, ')[1].split()[0])
+            self.ordered_rows.extend((k, file_idx) for k in self.stage)
+        elif sql.startswith('TRUNCATE TABLE dart_stage.') and '_ordered' not in sql:
+            self.stage = []
+        return Mock(scalar=Mock(return_value=4))
+
+    def begin(self):
+        return Mock()
+
+    def merged(self):
+        """ the rows the MERGE INSERT keeps: those of the last file with their key, and all rows with a null key """
+        last_file_idx = {}
+        for key, file_idx in self.ordered_rows:
+            last_file_idx[key] = max(file_idx, last_file_idx.get(key, file_idx))
+        return sorted((k, i) for k, i in self.ordered_rows if k is None or i == last_file_idx[k])
+
+
+class _Manifests(object):
+    """ stands in for _ManifestPipeline, with every manifest already planned """
+    def __init__(self, manifests):
+        self._manifests = manifests
+        self.count = len(manifests)
+        self.planning = False
+        self.tracking_s3_paths = []
+
+    def __iter__(self):
+        return iter(self._manifests)
+
+
+def _files(count):
+    return [S3CopyFile('s3://data/f%s' % i, None, 10) for i in range(count)]
+
+
+def _action():
+    return Action(id='a1', data=ActionData('a', 'load_dataset', args={}))
+
+
+def _datastore():
+    return Datastore(id='d1', data=DatastoreData('d', 'redshift', s3_artifacts_path='s3://artifacts'))
+
+
+def _dataset():
+    return Dataset(id='ds1', data=DatasetData(
+        name='ds', table_name='t', location='s3://data', load_type=LoadType.MERGE,
+        data_format=DataFormat(FileFormat.TEXTFILE, RowFormat.DELIMITED), compression='NONE',
+        columns=[Column('k', 'STRING'), Column('v', 'STRING')], merge_keys=['k'],
+    ))
+
+
+class CopyInFileOrderTests(unittest.TestCase):
+
+    def setUp(self):
+        self.action = _action()
+        self.datastore = _datastore()
+        self.dataset = _dataset()
+        self.copied = Mock()
+
+    def _copy(self, keys_by_file, file_count=None):
+        redshift = _FakeRedshift(keys_by_file)
+        files = _files(file_count or len(keys_by_file))
+        s3_manifest_path = redshift.upload_manifest(self.action, self.datastore, 'part-1', files)
+        with patch.object(copy, '_copy_manifest', redshift.copy_manifest), \
+                patch.object(copy, '_upload_s3_copy_manifest', redshift.upload_manifest):
+            copies = copy._copy_in_file_order(self.action, redshift, self.dataset, self.datastore, 'dart_stage', 'st',
+                                              'st_ordered', s3_manifest_path, files, 10, self.copied)
+        self.assertEqual(copies, len(redshift.copies))
+        return redshift
+
+    def test_files_without_repeated_keys_are_copied_once(self):
+        redshift = self._copy({'s3://data/f0': ['a', 'b'], 's3://data/f1': ['c']})
+        self.assertEqual(redshift.copies, [['s3://data/f0', 's3://data/f1']])
+        self.assertEqual(redshift.ordered_rows, [('a', 10), ('b', 10), ('c', 10)])
+        self.assertEqual(self.copied.call_args_list, [((0,),)])
+
+    def test_files_are_split_until_no_key_repeats_and_the_last_file_wins(self):
+        redshift = self._copy({'s3://data/f0': ['a', 'b'], 's3://data/f1': ['c'], 's3://data/f2': ['a'],
+                               's3://data/f3': ['d']})
+        self.assertEqual(redshift.copies, [['s3://data/f0', 's3://data/f1', 's3://data/f2', 's3://data/f3'],
+                                           ['s3://data/f0', 's3://data/f1'], ['s3://data/f2', 's3://data/f3']])
+        self.assertEqual(redshift.merged(), [('a', 12), ('b', 10), ('c', 10), ('d', 12)])
+        self.assertEqual(self.copied.call_args_list, [((2,),), ((0,),), ((0,),)])
+
+    def test_repeated_keys_within_a_file_are_all_kept(self):
+        redshift = self._copy({'s3://data/f0': ['a', 'a'], 's3://data/f1': ['b']})
+        self.assertEqual(redshift.copies, [['s3://data/f0', 's3://data/f1'], ['s3://data/f0'], ['s3://data/f1']])
+        self.assertEqual(redshift.merged(), [('a', 10), ('a', 10), ('b', 11)])
+
+    def test_null_merge_keys_do_not_split_and_are_all_kept(self):
+        redshift = self._copy({'s3://data/f0': [None, 'a'], 's3://data/f1': [None]})
+        self.assertEqual(len(redshift.copies), 1)
+        self.assertEqual(redshift.merged(), [(None, 10), (None, 10), ('a', 10)])
+
+    def test_split_copies_are_counted_in_progress(self):
+        redshift = _FakeRedshift({'s3://data/f0': ['a'], 's3://data/f1': ['a'], 's3://data/f2': ['b']})
+        plans = [ManifestPlan(_files(2), 20), ManifestPlan(_files(3)[2:], 10)]
+        manifests = _Manifests([(redshift.upload_manifest(self.action, self.datastore, 'part-%s' % i, p.files), p, i)
+                                for i, p in [(0, plans[0]), (2, plans[1])]])
+        dart = Mock()
+        dart.patch_action.side_effect = lambda action, **data_properties: action
+        with patch.object(copy, '_copy_manifest', redshift.copy_manifest), \
+                patch.object(copy, '_upload_s3_copy_manifest', redshift.upload_manifest):
+            action, step_num, split_copies = copy._load_stage_table(
+                self.action, redshift, dart, self.dataset, self.datastore, manifests, 'dart_stage', 'st', 5,
+                'st_ordered')
+
+        # 2 manifests, 2 COPYs added by splitting the first, the truncate step and 5 steps after the stage
+        progress = [c[1]['progress'] for c in dart.patch_action.call_args_list]
+        self.assertEqual(progress, ['0.20', '0.30', '0.40', '0.40', '0.50', '0.50'])
+        self.assertEqual((step_num, split_copies), (6, 2))
+        extra_data = dart.patch_action.call_args[1]['extra_data']
+        self.assertEqual((extra_data['copy_totals']['manifests'], extra_data['copy_totals']['copies']), (2, 4))
+
+    def test_explicit_batch_sizes_are_copied_in_file_order(self):
+        self.action.data.args['batch_size'] = 2
+        redshift = _FakeRedshift({'s3://data/f0': ['a'], 's3://data/f1': ['b'], 's3://data/f2': ['a'],
+                                  's3://data/f3': ['a']})
+        dart = Mock()
+        dart.patch_action.side_effect = lambda action, **data_properties: action
+        with patch.object(copy, '_copy_manifest', redshift.copy_manifest), \
+                patch.object(copy, '_upload_s3_copy_manifest', redshift.upload_manifest), \
+                patch.object(copy, '_put_s3_object'), \
+                patch.object(copy, 'lookup_credentials', return_value=('key', 'secret', None)):
+            copy.copy_from_s3(dart, self.datastore, self.action, self.dataset, redshift, 4, iter(_files(4)))
+
+        self.assertEqual(redshift.copies, [['s3://data/f0', 's3://data/f1'], ['s3://data/f2', 's3://data/f3'],
+                                           ['s3://data/f2'], ['s3://data/f3']])
+        self.assertEqual(redshift.merged(), [('a', 3), ('b', 0)])
+        insert = [s for s in redshift.statements if s.startswith('INSERT INTO public.t ')][0]
+        self.assertIn('MAX(dart_file_idx) OVER (PARTITION BY k) AS dart_last_file_idx', insert)
+        self.assertIn('WHERE dart_file_idx = dart_last_file_idx OR k IS NULL', insert)
+        self.assertEqual(dart.patch_action.call_args[1]['progress'], 1)
+
+
+class ManifestPipelineTests(unittest.TestCase):
+
+    def setUp(self):
+        # the background thread uploads after setUp returns, so these stay patched until the test is cleaned up
+        for patcher in [patch.object(copy, '_upload_s3_copy_manifest', side_effect=lambda a, d, name, files: name),
+                        patch.object(copy, '_put_s3_object')]:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def _pipeline(self, plan_manifests, s3_copy_file_generator):
+        return copy._ManifestPipeline(_action(), _dataset(), _datastore(), plan_manifests, s3_copy_file_generator,
+                                      None)
+
+    def test_manifests_are_yielded_with_the_index_of_their_first_file(self):
+        manifests = self._pipeline(lambda files: plan_manifests_by_count(files, 2), iter(_files(5)))
+        self.assertEqual([(path, len(plan.files), file_idx) for path, plan, file_idx in manifests],
+                         [('part-1', 2, 0), ('part-2', 2, 2), ('part-3', 1, 4)])
+        self.assertEqual((manifests.count, manifests.planning, len(manifests.tracking_s3_paths)), (3, False, 3))
+
+    def test_planning_errors_are_raised_in_the_loading_thread(self):
+        def s3_copy_files():
+            yield _files(1)[0]
+            raise ValueError('listing failed')
+
+        manifests = self._pipeline(lambda files: plan_manifests_by_count(files, 1), s3_copy_files())
+        loaded = []
+        with self.assertRaises(ValueError):
+            for manifest in manifests:
+                loaded.append(manifest)
+        self.assertEqual(len(loaded), 1)
+        self.assertFalse(manifests.planning)
+
+    def test_close_stops_planning_between_s3_files(self):
+        def s3_copy_files():
+            for i in itertools.count():
+                time.sleep(0.001)
+                yield S3CopyFile('s3://data/f%s' % i, None, 10)
+
+        # a manifest of every file is never planned while the files keep coming
+        manifests = self._pipeline(lambda files: [ManifestPlan(list(files), 0)], s3_copy_files())
+        manifests.close()
+        manifests._thread.join(5)
+        self.assertFalse(manifests._thread.is_alive())
+        self.assertEqual(manifests.tracking_s3_paths, [])
+
+    def test_planning_stops_after_a_copy_failed(self):
+        manifests = MagicMock(count=1, planning=False, tracking_s3_paths=[])
+        manifests.__iter__.return_value = iter([('s3://artifacts/part-1.json', ManifestPlan(_files(1), 10), 0)])
+        with patch.object(copy, '_ManifestPipeline', return_value=manifests), \
+                patch.object(copy, '_copy_manifest', side_effect=ValueError('copy failed')):
+            with self.assertRaises(ValueError):
+                copy.copy_from_s3(Mock(), _datastore(), _action(), _dataset(), _FakeRedshift({}), 1, iter(_files(1)))
+        manifests.close.assert_called_once_with()
+
+
+class RateLimitedActionPatcherTests(unittest.TestCase):
+
+    def setUp(self):
+        self.dart = Mock()
+        self.patcher = copy._RateLimitedActionPatcher(self.dart, min_interval_seconds=15)
+
+    @patch.object(copy.time, 'time', side_effect=[0, 5, 20])
+    def test_skipped_values_are_sent_with_the_next_patch(self, _):
+        self.patcher.patch_action('a', progress='0.10', extra_data={'copies': 1})
+        self.assertEqual(self.patcher.patch_action('a', progress='0.20', extra_data={'copies': 2}), 'a')
+        self.patcher.patch_action('a', progress='0.30', copy_seconds=3)
+        self.assertEqual(self.dart.patch_action.call_args_list[1][1],
+                         {'progress': '0.30', 'extra_data': {'copies': 2}, 'copy_seconds': 3})
+        self.assertEqual(self.dart.patch_action.call_count, 2)
+
+    @patch.object(copy.time, 'time', side_effect=[0, 1])
+    def test_the_final_patch_is_always_sent(self, _):
+        self.patcher.patch_action('a', progress='0.10')
+        self.patcher.patch_action('a', progress=1)
+        self.assertEqual(self.dart.patch_action.call_args_list[1][1], {'progress': 1})
+
+
+class TrackingRowsTests(unittest.TestCase):
+
+    def setUp(self):
+        self.files = [S3CopyFile('s3://data/f0', datetime(2016, 1, 2, 3, 4, 5, 6), 10, 'b1'),
+                      S3CopyFile(u's3://data/caf\xe9,"x"', None, 10, None)]
+
+    @staticmethod
+    def _rows(csv_gz):
+        return list(csv.reader(gzip.GzipFile(fileobj=BytesIO(csv_gz))))
+
+    def test_tracking_rows_are_a_gzipped_csv_with_copy_nulls(self):
+        self.assertEqual(self._rows(copy._get_tracking_csv_gz(self.files, False)), [
+            ['s3://data/f0', '2016-01-02 03:04:05.000006'],
+            ['s3://data/caf\xc3\xa9,"x"', '\\N'],
+        ])
+
+    def test_nudge_tracking_rows_have_the_batch_id(self):
+        self.assertEqual(self._rows(copy._get_tracking_csv_gz(self.files, True)), [
+            ['s3://data/f0', '2016-01-02 03:04:05.000006', 'b1'],
+            ['s3://data/caf\xc3\xa9,"x"', '\\N', '\\N'],
+        ])
+
+    def _copy_tracking_rows(self, nudge, credentials):
+        redshift = _FakeRedshift({})
+        tracking_s3_paths = ['s3://artifacts/tracking-1.csv.gz', 's3://artifacts/tracking-2.csv.gz']
+        with patch.object(copy, '_upload_s3_copy_manifest', redshift.upload_manifest), \
+                patch.object(copy, 'lookup_credentials', return_value=credentials):
+            copy._copy_tracking_rows(_action(), redshift, _datastore(), tracking_s3_paths, nudge)
+        self.assertEqual(redshift.files_by_manifest, {'s3://artifacts/tracking.json': tracking_s3_paths})
+        return redshift.statements
+
+    def test_tracking_rows_are_copied_from_a_manifest_of_their_files(self):
+        self.assertEqual(self._copy_tracking_rows(False, ('key', 'secret', None)), [
+            "COPY dart_tracking.s3_files_for_action_a1 (s3_path, updated) FROM 's3://artifacts/tracking.json'"
+            " CSV GZIP MANIFEST TIMEFORMAT 'auto' CREDENTIALS 'aws_access_key_id=key;aws_secret_access_key=secret'"
+        ])
+
+    def test_nudge_tracking_rows_are_copied_with_their_batch_id(self):
+        self.assertEqual(self._copy_tracking_rows(True, ('key', 'secret', 'token')), [
+            "COPY dart_tracking.s3_files_for_action_a1 (s3_path, updated, batch_id)"
+            " FROM 's3://artifacts/tracking.json' CSV GZIP MANIFEST TIMEFORMAT 'auto'"
+            " CREDENTIALS 'aws_access_key_id=key;aws_secret_access_key=secret;token=token'"
+        ])
@@ -0,0 +1,105 @@
+# must run pip install -e . in src/python folder before running this unit test
+from datetime import datetime
+import time
+import unittest
+
+from mock import Mock
+
+from dart.engine.redshift.command.maintenance import MaintenanceRunner, MaintenanceTask, TableStats, TableState, \
+    plan_maintenance_tasks, VACUUM, ANALYZE
+
+
+def _table(name, size_mb=1000, unsorted_pct=0, deleted_pct=0, stats_off_pct=0, scans=0, vacuum_alerts=0,
+           analyze_alerts=0):
+    return TableStats('public', name, size_mb, unsorted_pct, deleted_pct, stats_off_pct, scans, vacuum_alerts,
+                      analyze_alerts)
+
+
+def _task(operation, name, estimated_seconds=1):
+    return MaintenanceTask(operation, 'public', name, 1, estimated_seconds, None)
+
+
+class _FakeConnection(object):
+    """ logs the maintenance statements it runs, and the state written after each one, to a log shared by all """
+    def __init__(self, log, statement_seconds=0, fail_state_writes=False):
+        self.log = log
+        self.statement_seconds = statement_seconds
+        self.fail_state_writes = fail_state_writes
+
+    def execution_options(self, **kwargs):
+        return self
+
+    def execute(self, statement, params=None):
+        if params is None:
+            time.sleep(self.statement_seconds)
+            self.log.append(statement)
+            return None
+        if self.fail_state_writes:
+            raise Exception('the state table is locked')
+        self.log.append(('state', params['table_name'], params['last_seconds'] is not None,
+                         params['deferred_since'] is not None))
+        return Mock(rowcount=1)
+
+    def close(self):
+        pass
+
+
+class MaintenanceRunnerTests(unittest.TestCase):
+
+    def setUp(self):
+        self.log = []
+
+    def _runner(self, deadline=None, **kwargs):
+        return MaintenanceRunner(_FakeConnection(self.log, **kwargs), lambda: _FakeConnection(self.log, **kwargs),
+                                 deadline, analyze_concurrency=2)
+
+    def test_tasks_expected_to_end_after_the_deadline_are_deferred(self):
+        runner = self._runner(deadline=time.time() + 60)
+        results = runner.run([_task(VACUUM, 'a'), _task(VACUUM, 'b', 3600)], [_task(ANALYZE, 'c', 3600)])
+        self.assertEqual(sorted((r['operation'], r['table_name'], r['status']) for r in results),
+                         [(ANALYZE, 'c', 'DEFERRED'), (VACUUM, 'a', 'COMPLETED'), (VACUUM, 'b', 'DEFERRED')])
+        self.assertEqual(sorted(e for e in self.log if e[0] == 'state'),
+                         [('state', 'a', True, False), ('state', 'b', False, True), ('state', 'c', False, True)])
+        self.assertNotIn('VACUUM "public"."b"', self.log)
+
+    def test_analyzes_of_vacuumed_tables_run_after_their_vacuum(self):
+        runner = self._runner(statement_seconds=0.05)
+        runner.run([_task(VACUUM, 'a'), _task(VACUUM, 'b')], [_task(ANALYZE, 'b'), _task(ANALYZE, 'c')])
+        statements = [e for e in self.log if e[0] != 'state']
+        self.assertLess(statements.index('VACUUM "public"."b"'), statements.index('ANALYZE "public"."b"'))
+        self.assertEqual(len(statements), 4)
+
+    def test_state_write_failures_do_not_stop_the_other_tasks(self):
+        runner = self._runner(deadline=time.time() + 60, fail_state_writes=True)
+        results = runner.run([_task(VACUUM, 'a'), _task(VACUUM, 'b', 3600), _task(VACUUM, 'c')],
+                             [_task(ANALYZE, 'd'), _task(ANALYZE, 'e', 3600), _task(ANALYZE, 'f')])
+        self.assertEqual(sorted((r['table_name'], r['status']) for r in results),
+                         [('a', 'COMPLETED'), ('b', 'DEFERRED'), ('c', 'COMPLETED'), ('d', 'COMPLETED'),
+                          ('e', 'DEFERRED'), ('f', 'COMPLETED')])
+
+
+class MaintenancePlannerTests(unittest.TestCase):
+
+    def test_only_tables_over_the_thresholds_are_planned(self):
+        tables = [_table('clean', unsorted_pct=5, stats_off_pct=5), _table('unsorted', unsorted_pct=50),
+                  _table('stale', stats_off_pct=50), _table('alerted', analyze_alerts=1)]
+        vacuums, analyzes = plan_maintenance_tasks(tables, {})
+        self.assertEqual([t.table_name for t in vacuums], ['unsorted'])
+        self.assertEqual(sorted(t.table_name for t in analyzes), ['alerted', 'stale'])
+
+    def test_tables_are_ranked_by_benefit_per_second(self):
+        tables = [_table('big', size_mb=100000, unsorted_pct=50), _table('scanned', unsorted_pct=50, scans=1000),
+                  _table('small', unsorted_pct=50)]
+        vacuums, _ = plan_maintenance_tasks(tables, {})
+        self.assertEqual([t.table_name for t in vacuums], ['scanned', 'small', 'big'])
+
+    def test_recorded_timings_and_deferred_tasks_are_used(self):
+        tables = [_table('a', unsorted_pct=50), _table('b', unsorted_pct=50), _table('c', unsorted_pct=50)]
+        states = {
+            (VACUUM, 'public', 'a'): TableState(600, None),
+            (VACUUM, 'public', 'c'): TableState(None, datetime(2016, 1, 1)),
+            (ANALYZE, 'public', 'b'): TableState(None, datetime(2015, 1, 1)),
+        }
+        vacuums, _ = plan_maintenance_tasks(tables, states)
+        self.assertEqual([t.table_name for t in vacuums], ['c', 'b', 'a'])
+        self.assertEqual(vacuums[2].estimated_seconds, 600)
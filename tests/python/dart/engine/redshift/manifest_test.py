@@ -0,0 +1,41 @@
+# must run pip install -e . in src/python folder before running this unit test
+import unittest
+
+from dart.engine.redshift.command.manifest import S3CopyFile, plan_manifests_by_bytes, plan_manifests_by_count, \
+    plan_manifests_in_order
+
+
+def _files(*sizes):
+    return [S3CopyFile('s3://bucket/%s' % i, None, size) for i, size in enumerate(sizes)]
+
+
+class ManifestPlannerTests(unittest.TestCase):
+
+    def test_every_file_is_planned_once(self):
+        files = _files(*[(i * 7919) % 1000 for i in range(1000)])
+        plans = list(plan_manifests_by_bytes(files, slices=8, target_bytes_per_copy=20000))
+        planned = [f for p in plans for f in p.files]
+        self.assertEqual(sorted(planned), sorted(files))
+        self.assertEqual(sum(p.planned_bytes for p in plans), sum(f.file_size for f in files))
+
+    def test_similar_sizes_are_copied_together(self):
+        files = _files(*([1] * 7 + [1000] * 4 + [1] * 5))
+        plans = list(plan_manifests_by_bytes(files, slices=4, target_bytes_per_copy=1000))
+        self.assertEqual([f.file_size for f in plans[0].files], [1000] * 4)
+        self.assertEqual([p.planned_bytes for p in plans], [4000, 12])
+
+    def test_unknown_sizes_fill_one_file_per_slice(self):
+        files = [S3CopyFile('s3://bucket/%s' % i, None) for i in range(10)]
+        plans = list(plan_manifests_by_bytes(files, slices=4, target_bytes_per_copy=400))
+        self.assertEqual([len(p.files) for p in plans], [4, 4, 2])
+
+    def test_plan_by_count_preserves_order(self):
+        files = _files(3, 1, 2)
+        plans = list(plan_manifests_by_count(files, 2))
+        self.assertEqual([p.files for p in plans], [files[:2], files[2:]])
+
+    def test_plan_in_order_groups_consecutive_files_by_bytes(self):
+        files = _files(600, 500, 100, 900, 50) + [S3CopyFile('s3://bucket/unknown', None)]
+        plans = list(plan_manifests_in_order(files, slices=4, target_bytes_per_copy=1000))
+        self.assertEqual([p.files for p in plans], [files[:2], files[2:4], files[4:]])
+        self.assertEqual([p.planned_bytes for p in plans], [1100, 1000, 300])
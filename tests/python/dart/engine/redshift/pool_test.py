@@ -0,0 +1,57 @@
+# must run pip install -e . in src/python folder before running this unit test
+import unittest
+
+from mock import Mock
+
+from dart.engine.redshift.admin.pool import RedshiftEnginePool, _reset_session, _DISCARD_ON_CHECKIN
+
+
+class RedshiftEnginePoolTests(unittest.TestCase):
+
+    def test_memoize_until_forgotten(self):
+        pool = RedshiftEnginePool()
+        values = iter(['first', 'second'])
+        self.assertEqual(pool.memoize('key', lambda: next(values)), 'first')
+        self.assertEqual(pool.memoize('key', lambda: next(values)), 'first')
+        self.assertTrue(pool.is_memoized('key'))
+        pool.forget('key')
+        self.assertFalse(pool.is_memoized('key'))
+        self.assertEqual(pool.memoize('key', lambda: next(values)), 'second')
+
+    def test_memoized_values_expire(self):
+        pool = RedshiftEnginePool(ttl_seconds=-1)
+        values = iter(['first', 'second'])
+        pool.memoize('key', lambda: next(values))
+        self.assertEqual(pool.memoize('key', lambda: next(values)), 'second')
+
+    def test_engines_are_reused_until_the_password_changes(self):
+        pool = RedshiftEnginePool()
+        engine = pool.get_engine('host', 5439, 'db', 'user', 'password')
+        self.assertIs(pool.get_engine('host', 5439, 'db', 'user', 'password'), engine)
+        self.assertIsNot(pool.get_engine('host', 5439, 'db', 'user', 'changed'), engine)
+
+    def test_disposed_engines_are_replaced(self):
+        pool = RedshiftEnginePool()
+        engine = pool.get_engine('host', 5439, 'db', 'user', 'password')
+        pool.dispose_engine('host', 5439, 'db', 'user')
+        self.assertIsNot(pool.get_engine('host', 5439, 'db', 'user', 'password'), engine)
+
+    def test_sessions_are_reset_when_connections_are_returned(self):
+        dbapi_connection, connection_record = Mock(), Mock(info={})
+        _reset_session(dbapi_connection, connection_record)
+        dbapi_connection.cursor.return_value.execute.assert_called_once_with('RESET ALL')
+        dbapi_connection.commit.assert_called_once_with()
+        connection_record.invalidate.assert_not_called()
+
+    def test_connections_that_ran_user_sql_are_closed_when_returned(self):
+        dbapi_connection, connection_record = Mock(), Mock(info={_DISCARD_ON_CHECKIN: True})
+        _reset_session(dbapi_connection, connection_record)
+        connection_record.invalidate.assert_called_once_with()
+        dbapi_connection.cursor.assert_not_called()
+        self.assertEqual(connection_record.info, {})
+
+    def test_connections_that_fail_to_reset_are_closed(self):
+        dbapi_connection, connection_record = Mock(), Mock(info={})
+        dbapi_connection.cursor.return_value.execute.side_effect = Exception('connection lost')
+        _reset_session(dbapi_connection, connection_record)
+        connection_record.invalidate.assert_called_once_with()
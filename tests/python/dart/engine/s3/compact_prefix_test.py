@@ -0,0 +1,120 @@
+# must run pip install -e . in src/python folder before running this unit test
+import gzip
+import unittest
+from io import BytesIO
+
+from mock import Mock, patch
+
+from dart.engine.s3.actions import compact_prefix
+from dart.engine.s3.actions.compact_prefix import S3PrefixCompaction
+from dart.model.action import Action, ActionData
+from dart.model.dataset import Compression, Dataset, DatasetData
+
+
+def _gzip(contents):
+    buf = BytesIO()
+    with gzip.GzipFile(fileobj=buf, mode='wb') as f:
+        f.write(contents)
+    return buf.getvalue()
+
+
+def _s3_client(objects_by_key):
+    s3_client = Mock()
+    s3_client.get_paginator.return_value.paginate.return_value = [
+        {'Contents': [{'Key': k, 'Size': len(v)} for k, v in sorted(objects_by_key.items())]}
+    ]
+    s3_client.get_object.side_effect = lambda Bucket, Key: {'Body': BytesIO(objects_by_key[Key])}
+    s3_client.create_multipart_upload.side_effect = lambda **kwargs: {'UploadId': kwargs['Key']}
+    uploaded = {}
+    s3_client.upload_part.side_effect = \
+        lambda **kwargs: uploaded.setdefault(kwargs['Key'], []).append(kwargs['Body']) or {'ETag': 'e'}
+    return s3_client, uploaded
+
+
+class S3PrefixCompactionTests(unittest.TestCase):
+
+    def test_objects_of_a_folder_are_concatenated_into_outputs_of_the_target_size(self):
+        objects = {'in/y=2016/a': 'a1\na2', 'in/y=2016/b': 'b1\n', 'in/y=2016/c': 'c1\n', 'in/y=2016/m/d': 'd1\n',
+                   'in/y=2016/z': 'z1\n'}
+        s3_client, uploaded = _s3_client(objects)
+        S3PrefixCompaction(s3_client, 's3://src/in/y=2016/', None, 's3://src/in', 's3://dst/out', Compression.NONE,
+                           9, 2, 'a1').run()
+
+        self.assertEqual({k: ''.join(v) for k, v in uploaded.items()}, {'out/y=2016/part-a1-00000': 'a1\na2\nb1\n'})
+        copies = sorted((c[1]['CopySource']['Key'], c[1]['Key']) for c in s3_client.copy_object.call_args_list)
+        self.assertEqual(copies, [('in/y=2016/c', 'out/y=2016/part-a1-00001'),
+                                  ('in/y=2016/m/d', 'out/y=2016/m/part-a1-00000'),
+                                  ('in/y=2016/z', 'out/y=2016/part-a1-00002')])
+
+    def test_gzip_members_are_concatenated_without_decompressing(self):
+        objects = {'in/a.gz': _gzip('a\n'), 'in/b.gz': _gzip('b\n')}
+        s3_client, uploaded = _s3_client(objects)
+        with patch('dart.engine.s3.actions.compact_prefix._PART_BYTES', 10):
+            S3PrefixCompaction(s3_client, 's3://src/in/', '.*\\.gz$', 's3://src/in', 's3://dst/out',
+                               Compression.GZIP, 1000, 2, 'a1').run()
+
+        output = ''.join(uploaded['out/part-a1-00000.gz'])
+        self.assertEqual(output, objects['in/a.gz'] + objects['in/b.gz'])
+        self.assertEqual(gzip.GzipFile(fileobj=BytesIO(output)).read(), 'a\nb\n')
+        self.assertTrue(all(len(p) >= 10 for p in uploaded['out/part-a1-00000.gz'][:-1]))
+
+    def test_outputs_keep_the_folders_below_the_source_root(self):
+        s3_client, _ = _s3_client({'in/y=2016/a': 'a1\n'})
+        S3PrefixCompaction(s3_client, 's3://src/in', None, 's3://src', 's3://dst/out', Compression.NONE, 9, 2,
+                           'a1').run()
+        self.assertEqual(s3_client.copy_object.call_args[1]['Key'], 'out/in/y=2016/part-a1-00000')
+
+    def test_the_output_path_and_the_prefix_must_not_overlap(self):
+        s3_client, _ = _s3_client({})
+        for prefix, output_path in [('s3://src/in/', 's3://src/in/compacted'), ('s3://src/in', 's3://src/in_compacted'),
+                                    ('s3://src/out/in/', 's3://src/out')]:
+            self.assertRaises(AssertionError, S3PrefixCompaction, s3_client, prefix, None, 's3://src', output_path,
+                              Compression.NONE, 9, 2, 'a1')
+
+
+class CompactPrefixTests(unittest.TestCase):
+
+    def setUp(self):
+        for patcher in [patch.object(compact_prefix, 'boto3'), patch.object(compact_prefix, 'S3PrefixCompaction')]:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.s3_engine = Mock()
+        self.s3_engine.dart.get_dataset.return_value = Dataset(id='ds1', data=DatasetData(
+            name='ds', table_name='t', location='s3://src/in', load_type='INSERT', data_format=None))
+
+    def _compact(self, **args):
+        args = dict({'output_path': 's3://dst/out/', 'output_dataset_id': 'ds1'}, **args)
+        compact_prefix.compact_prefix(self.s3_engine, None, Action(id='a1', data=ActionData('a', 'a', args=args)))
+
+    def test_the_dataset_is_switched_after_its_whole_location_is_compacted(self):
+        self._compact(s3_path_prefix='s3://src/in/')
+        self.assertEqual(self.s3_engine.dart.save_dataset.call_args[0][0].data.location, 's3://dst/out')
+
+    def test_the_dataset_is_switched_to_where_a_prefix_without_a_trailing_slash_is_written(self):
+        self._compact(s3_path_prefix='s3://src/in')
+        # outputs keep the folders below s3://src, e.g. s3://dst/out/in/y=2016/part-a1-00000
+        self.assertEqual(compact_prefix.S3PrefixCompaction.call_args[0][3:5], ('s3://src', 's3://dst/out'))
+        self.assertEqual(self.s3_engine.dart.save_dataset.call_args[0][0].data.location, 's3://dst/out/in')
+
+    def test_compacting_a_parent_folder_must_be_allowed_to_switch_the_dataset(self):
+        self.assertRaises(AssertionError, self._compact, s3_path_prefix='s3://src/')
+        self.s3_engine.dart.save_dataset.assert_not_called()
+
+        self._compact(s3_path_prefix='s3://src/', allow_partial_output_dataset=True)
+        self.assertEqual(self.s3_engine.dart.save_dataset.call_args[0][0].data.location, 's3://dst/out/in')
+
+    def test_partial_compactions_must_be_allowed_to_switch_the_dataset(self):
+        for args in [{'s3_path_prefix': 's3://src/in/{YEAR}/'}, {'s3_path_prefix': 's3://src/in/2016/'},
+                     {'s3_path_prefix': 's3://src/in/', 's3_path_regex': '.*\\.gz$'}]:
+            self.assertRaises(AssertionError, self._compact, **args)
+        compact_prefix.S3PrefixCompaction.return_value.run.assert_not_called()
+        self.s3_engine.dart.save_dataset.assert_not_called()
+
+        self._compact(s3_path_prefix='s3://src/in/{YEAR}/', allow_partial_output_dataset=True)
+        self.assertEqual(self.s3_engine.dart.save_dataset.call_args[0][0].data.location, 's3://dst/out')
+
+    def test_a_switched_dataset_is_left_alone(self):
+        self.s3_engine.dart.get_dataset.return_value.data.location = 's3://dst/out/in'
+        self._compact(s3_path_prefix='s3://src/in/{YEAR}/')
+        compact_prefix.S3PrefixCompaction.return_value.run.assert_called_once_with()
+        self.s3_engine.dart.save_dataset.assert_not_called()
@@ -0,0 +1,124 @@
+# must run pip install -e . in src/python folder before running this unit test
+import json
+import unittest
+from multiprocessing.pool import ThreadPool
+
+from botocore.exceptions import ClientError
+from mock import Mock, patch
+
+from dart.engine.s3.actions.copy import S3Copy, copy, run_bounded
+
+
+def _s3_client(objects, checkpoint=None):
+    s3_client = Mock()
+    s3_client.get_paginator.return_value.paginate.return_value = [
+        {'Contents': [{'Key': key, 'ETag': etag, 'Size': size} for key, etag, size in objects]}
+    ]
+    if checkpoint is None:
+        s3_client.get_object.side_effect = _client_error('NoSuchKey')
+    else:
+        s3_client.get_object.return_value = {'Body': Mock(read=lambda: json.dumps({'copied': checkpoint}))}
+    s3_client.head_object.return_value = {'ContentType': 'application/json', 'ContentEncoding': 'gzip',
+                                          'Metadata': {'m': 'v'}, 'ServerSideEncryption': 'AES256', 'Expires': None}
+    s3_client.create_multipart_upload.return_value = {'UploadId': 'upload-1'}
+    s3_client.upload_part_copy.side_effect = lambda **kwargs: {'CopyPartResult': {'ETag': 'p%s' % kwargs['PartNumber']}}
+    return s3_client
+
+
+def _client_error(code):
+    return ClientError({'Error': {'Code': code}}, 'GetObject')
+
+
+class S3CopyTests(unittest.TestCase):
+
+    @patch('dart.engine.s3.actions.copy._MIN_PART_BYTES', 40)
+    @patch('dart.engine.s3.actions.copy._MULTIPART_THRESHOLD_BYTES', 50)
+    def test_large_objects_are_copied_in_parts(self):
+        s3_client = _s3_client([('from/a', '"a"', 10), ('from/b', '"b"', 100)])
+        S3Copy(s3_client, 's3://src/from', 's3://dst/to', True, 4, 's3://artifacts/checkpoint.json').run()
+
+        s3_client.copy_object.assert_called_once_with(
+            ACL='bucket-owner-full-control', Bucket='dst', Key='to/a', CopySource={'Bucket': 'src', 'Key': 'from/a'},
+            CopySourceIfMatch='"a"')
+        s3_client.head_object.assert_called_once_with(Bucket='src', Key='from/b', IfMatch='"b"')
+        s3_client.create_multipart_upload.assert_called_once_with(
+            ACL='bucket-owner-full-control', Bucket='dst', Key='to/b', ContentType='application/json',
+            ContentEncoding='gzip', Metadata={'m': 'v'}, ServerSideEncryption='AES256')
+        ranges = sorted(c[1]['CopySourceRange'] for c in s3_client.upload_part_copy.call_args_list)
+        self.assertEqual(ranges, ['bytes=0-39', 'bytes=40-79', 'bytes=80-99'])
+        parts = s3_client.complete_multipart_upload.call_args[1]['MultipartUpload']['Parts']
+        self.assertEqual(parts, [{'ETag': 'p1', 'PartNumber': 1}, {'ETag': 'p2', 'PartNumber': 2},
+                                 {'ETag': 'p3', 'PartNumber': 3}])
+        s3_client.abort_multipart_upload.assert_not_called()
+        s3_client.delete_object.assert_called_once_with(Bucket='artifacts', Key='checkpoint.json')
+
+    def test_the_checkpoint_is_written_when_the_copy_fails(self):
+        s3_client = _s3_client([('from/a', '"a"', 10), ('from/b', '"b"', 20)])
+        s3_client.copy_object.side_effect = [None, Exception('copy failed')]
+        with self.assertRaises(Exception):
+            S3Copy(s3_client, 's3://src/from', 's3://dst/to', True, 1, 's3://artifacts/checkpoint.json').run()
+
+        checkpoint = json.loads(s3_client.put_object.call_args[1]['Body'])
+        self.assertEqual(checkpoint['copied'], {'from/a': ['"a"', 10]})
+        s3_client.delete_object.assert_not_called()
+
+    def test_objects_in_the_checkpoint_are_skipped_unless_changed(self):
+        s3_client = _s3_client([('from/a', '"a"', 10), ('from/b', '"changed"', 20)],
+                               checkpoint={'from/a': ['"a"', 10], 'from/b': ['"b"', 20]})
+        report_progress = Mock()
+        S3Copy(s3_client, 's3://src/from', 's3://dst/to', True, 4, 's3://artifacts/checkpoint.json',
+               report_progress).run()
+
+        self.assertEqual(s3_client.copy_object.call_args[1]['Key'], 'to/b')
+        self.assertEqual(s3_client.copy_object.call_count, 1)
+        stats = report_progress.call_args[0][0]
+        self.assertEqual((stats['copied_objects'], stats['skipped_objects'], stats['copied_bytes']), (1, 1, 20))
+
+
+class CopyTests(unittest.TestCase):
+
+    @patch('dart.engine.s3.actions.copy.boto3')
+    @patch('dart.engine.s3.actions.copy.S3Copy')
+    def test_progress_counts_the_objects_skipped_from_the_checkpoint(self, s3_copy, boto3):
+        s3_engine, datastore, action = Mock(), Mock(), Mock()
+        action.data.args = {'from_path': 's3://src/from', 'to_path': 's3://dst/to'}
+        action.data.extra_data = None
+        copy(s3_engine, datastore, action)
+
+        report_progress = s3_copy.call_args[0][6]
+        report_progress({'listed_bytes': 100, 'copied_bytes': 20, 'skipped_bytes': 30})
+        self.assertEqual(s3_engine.dart.patch_action.call_args[1]['progress'], 0.5)
+
+
+class RunBoundedTests(unittest.TestCase):
+
+    def test_tasks_are_pulled_as_earlier_tasks_complete(self):
+        pool = ThreadPool(2)
+        pulled = []
+
+        def tasks():
+            for i in range(10):
+                pulled.append(i)
+                yield lambda n: n * 2, (i,)
+
+        try:
+            results = []
+            for result in run_bounded(pool, tasks(), 3):
+                # no more than 3 tasks are queued or running when a result is consumed
+                self.assertLessEqual(len(pulled) - len(results), 3)
+                results.append(result)
+        finally:
+            pool.terminate()
+        self.assertEqual(sorted(results), [i * 2 for i in range(10)])
+
+    def test_task_errors_are_raised(self):
+        pool = ThreadPool(2)
+
+        def fail():
+            raise ValueError('failed')
+
+        try:
+            with self.assertRaises(ValueError):
+                list(run_bounded(pool, [(fail, ())], 3))
+        finally:
+            pool.terminate()
@@ -0,0 +1,133 @@
+# must run pip install -e . in src/python folder before running this unit test
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+from mock import Mock, patch
+
+from tests.python.dart import orm_config  # noqa, must be imported before dart.message.broker
+from dart.message.broker import LocalMessageBroker
+from dart.model.message import MessageState
+
+
+class _Handler(object):
+    """ records the messages it handles, failing those whose body is in fail_values """
+    def __init__(self, fail_values=(), seconds=0):
+        self.fail_values = set(fail_values)
+        self.seconds = seconds
+        self.handled = []
+        self.max_running = 0
+        self._running = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, message_id, message, previous_handler_failed):
+        with self._lock:
+            self._running += 1
+            self.max_running = max(self.max_running, self._running)
+        try:
+            time.sleep(self.seconds)
+            if message['value'] in self.fail_values:
+                raise Exception('failed to handle %s' % message['value'])
+            with self._lock:
+                self.handled.append(message['value'])
+        finally:
+            with self._lock:
+                self._running -= 1
+
+
+def _by_key(message_id, message):
+    return message.get('key')
+
+
+class LocalMessageBrokerTests(unittest.TestCase):
+
+    def setUp(self):
+        # handlers roll back the request's session, which needs a flask app outside of these tests
+        patcher = patch('dart.message.broker.db')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _send(self, broker, *values):
+        for value in values:
+            broker.send_message({'value': value, 'key': value[0]})
+
+    def test_messages_are_received_in_the_order_they_were_sent(self):
+        broker = LocalMessageBroker(max_messages=2, persist_messages=False)
+        self._send(broker, 'a1', 'b1', 'c1')
+        handler = _Handler()
+        broker.receive_message(handler, 0)
+        self.assertEqual(handler.handled, ['a1', 'b1'])
+        broker.receive_message(handler, 0)
+        self.assertEqual(handler.handled, ['a1', 'b1', 'c1'])
+
+    def test_failed_messages_and_the_later_ones_with_their_key_are_received_again(self):
+        broker = LocalMessageBroker(persist_messages=False)
+        self._send(broker, 'a1', 'b1', 'a2', 'b2', 'a3')
+        handler = _Handler(fail_values=['a2'])
+        broker.receive_message(handler, 0, _by_key)
+        self.assertEqual(sorted(handler.handled), ['a1', 'b1', 'b2'])
+
+        handler.fail_values = set()
+        broker.receive_message(handler, 0, _by_key)
+        self.assertEqual(handler.handled[3:], ['a2', 'a3'])
+
+    def test_a_directory_is_shared_by_brokers_in_separate_processes(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        sender = LocalMessageBroker(directory, persist_messages=False)
+        receiver = LocalMessageBroker(directory, persist_messages=False)
+        self._send(sender, 'a1', 'b1')
+
+        handler = _Handler(fail_values=['b1'])
+        receiver.receive_message(handler, 0)
+        self.assertEqual(handler.handled, ['a1'])
+        self.assertEqual(len(os.listdir(directory)), 1)
+
+        handler.fail_values = set()
+        LocalMessageBroker(directory, persist_messages=False).receive_message(handler, 0)
+        self.assertEqual(handler.handled, ['a1', 'b1'])
+        self.assertEqual(os.listdir(directory), [])
+
+
+class BatchingMessageBrokerTests(unittest.TestCase):
+
+    def setUp(self):
+        patcher = patch('dart.message.broker.db')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_keys_are_handled_concurrently_and_each_key_in_order(self):
+        broker = LocalMessageBroker(max_messages=10, handler_threads=4, persist_messages=False)
+        values = ['%s%s' % (key, i) for i in range(3) for key in 'abcd']
+        for value in values:
+            broker.send_message({'value': value, 'key': value[0]})
+        handler = _Handler(seconds=0.02)
+        broker.receive_message(handler, 0, _by_key)
+
+        self.assertEqual(sorted(handler.handled), sorted(values[:10]))
+        for key in 'abcd':
+            handled = [v for v in handler.handled if v[0] == key]
+            self.assertEqual(handled, sorted(handled))
+        self.assertGreater(handler.max_running, 1)
+
+    def test_messages_are_tracked_with_one_statement_per_batch(self):
+        message_service = Mock()
+        broker = LocalMessageBroker(max_messages=10)
+        broker.set_app_context(Mock(get=Mock(return_value=message_service)))
+        for value in ['a1', 'b1', 'c1']:
+            broker.send_message({'value': value})
+        ids = [m[0] for m in broker._messages]
+        message_service.get_messages.return_value = {ids[1]: Mock(state=MessageState.COMPLETED)}
+        handler = _Handler(fail_values=['c1'])
+        broker.receive_message(handler, 0)
+
+        # the redelivered message is not handled again, and the failed one is left running to be received again
+        self.assertEqual(handler.handled, ['a1'])
+        message_service.get_messages.assert_called_once_with(ids)
+        self.assertEqual(message_service.save_messages.call_args[0][1], MessageState.RUNNING)
+        self.assertEqual([m[0] for m in message_service.save_messages.call_args[0][0]], [ids[0], ids[2]])
+        message_service.update_messages_state.assert_called_once_with([ids[0]], MessageState.COMPLETED)
+        self.assertEqual([m[0] for m in broker._messages], [ids[2]])
@@ -0,0 +1,26 @@
+# must run pip install -e . in src/python folder before running this unit test
+import unittest
+
+from tests.python.dart import orm_config  # noqa, must be imported before dart.message.trigger_listener
+from dart.message.call import TriggerCall
+from dart.message.trigger_listener import TriggerListener
+
+
+class OrderingKeyTests(unittest.TestCase):
+
+    def test_completed_actions_are_ordered_with_their_datastore(self):
+        try_next_action = {'call': TriggerCall.TRY_NEXT_ACTION, 'datastore_id': 'd1'}
+        complete_action = {'call': TriggerCall.COMPLETE_ACTION, 'action_id': 'a1', 'action_state': 'COMPLETED',
+                           'error_message': None, 'datastore_id': 'd1'}
+        self.assertEqual(TriggerListener._ordering_key('m1', try_next_action), 'datastore:d1')
+        self.assertEqual(TriggerListener._ordering_key('m2', complete_action), 'datastore:d1')
+
+    def test_completed_actions_without_a_datastore_are_ordered_by_action(self):
+        complete_action = {'call': TriggerCall.COMPLETE_ACTION, 'action_id': 'a1', 'action_state': 'COMPLETED'}
+        self.assertEqual(TriggerListener._ordering_key('m1', complete_action), 'action:a1')
+
+    def test_triggers_are_ordered_by_trigger_then_workflow(self):
+        process_trigger = {'call': TriggerCall.PROCESS_TRIGGER, 'message': {'trigger_id': 't1', 'workflow_id': 'w1'}}
+        self.assertEqual(TriggerListener._ordering_key('m1', process_trigger), 'trigger:t1')
+        process_trigger['message'] = {'workflow_id': 'w1'}
+        self.assertEqual(TriggerListener._ordering_key('m2', process_trigger), 'workflow:w1')
@@ -0,0 +1,39 @@
+# must run pip install -e . in src/python folder before running this unit test
+from datetime import datetime, date, timedelta
+import unittest
+
+from dateutil.tz import tzutc
+
+from dart.model.action import Action, ActionData
+from dart.model.base import decode_from_dict, parse_datetime
+
+
+class BaseModelTests(unittest.TestCase):
+
+    def test_round_trip(self):
+        action = Action(id='1', version_id=2, created=datetime(2016, 1, 2, 3, 4, 5, 6000), data=ActionData(
+            name='a', action_type_name='t', args={'x': [1, {'y': 2}]}, tags=['b'], queued_time=datetime(2016, 1, 2)))
+        copy = Action.from_dict(action.to_dict())
+        self.assertEqual(copy.to_dict(), action.to_dict())
+        self.assertIsInstance(copy.data, ActionData)
+        self.assertEqual(copy.created, datetime(2016, 1, 2, 3, 4, 5, 6000))
+        self.assertEqual(copy.data.queued_time, datetime(2016, 1, 2))
+
+    def test_decoded_models_do_not_share_containers(self):
+        source = {'id': '1', 'data': {'name': 'a', 'action_type_name': 't', 'args': {'x': [1]}}}
+        action = Action.from_dict(source)
+        action.data.args['x'].append(2)
+        self.assertEqual(source['data']['args'], {'x': [1]})
+
+    def test_parse_datetime(self):
+        self.assertEqual(parse_datetime('2016-01-02T03:04:05'), datetime(2016, 1, 2, 3, 4, 5))
+        self.assertEqual(parse_datetime('2016-01-02T03:04:05.5'), datetime(2016, 1, 2, 3, 4, 5, 500000))
+        self.assertEqual(parse_datetime('2016-01-02'), datetime(2016, 1, 2))
+        self.assertEqual(parse_datetime('2016-01-02T03:04:05+00:00'), datetime(2016, 1, 2, 3, 4, 5, tzinfo=tzutc()))
+
+    def test_decode_from_dict(self):
+        self.assertEqual(decode_from_dict('datetime.date', '2016-01-02'), date(2016, 1, 2))
+        self.assertEqual(decode_from_dict('datetime.timedelta', '1 day, 01:02:03'), timedelta(1, 3723))
+        self.assertEqual(decode_from_dict('list[int]', ['1', 0]), [1, 0])
+        self.assertEqual(decode_from_dict('dict[str,datetime.date]', {'a': '2016-01-02'}), {'a': date(2016, 1, 2)})
+        self.assertEqual(decode_from_dict('str', ''), '')
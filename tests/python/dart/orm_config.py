@@ -0,0 +1,17 @@
+"""
+dart.model.orm and the python client read the config named by DART_CONFIG when they are imported, so tests that
+import them (directly or through a service) import this module first.  As the web role, dart does not connect to a
+database on import.
+"""
+import os
+import tempfile
+
+_config_file = tempfile.NamedTemporaryFile(prefix='dart-test-config-', suffix='.yaml', delete=False)
+_config_file.write("dart:\n"
+                   "  app_context:\n"
+                   "  - name: secrets\n"
+                   "    options: {kms_key_arn: unused, secrets_s3_path: 's3://unused/secrets'}\n"
+                   "auth: {use_auth: false}\n")
+_config_file.close()
+os.environ.setdefault('DART_CONFIG', _config_file.name)
+os.environ.setdefault('DART_ROLE', 'web')
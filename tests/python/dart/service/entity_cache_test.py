@@ -0,0 +1,81 @@
+# must run pip install -e . in src/python folder before running this unit test
+import json
+import sys
+import unittest
+
+from mock import Mock, patch
+
+from tests.python.dart import orm_config  # noqa, must be imported before dart.model.orm
+from dart.model.dataset import Column, Dataset, DatasetData, DataFormat, FileFormat, RowFormat
+from dart.model.orm import DatasetDao
+from dart.service.entity_cache import EntityCacheService
+
+_CONFIG = {'redis': {'host': 'localhost', 'port': 6379, 'entity_cache_ttl_seconds': {'dataset': 30}}}
+
+
+def _dataset(version_id):
+    data_format = DataFormat(FileFormat.TEXTFILE, RowFormat.JSON)
+    data = DatasetData(name='d', table_name='t', location='s3://b/p', load_type='INSERT', data_format=data_format,
+                       columns=[Column('a', 'STRING')])
+    return Dataset(id='ds1', version_id=version_id, data=data)
+
+
+def _session(dirty=(), deleted=()):
+    return Mock(info={}, dirty=list(dirty), deleted=list(deleted))
+
+
+class EntityCacheServiceTests(unittest.TestCase):
+
+    def setUp(self):
+        patcher = patch('dart.service.entity_cache.redis.StrictRedis')
+        self.redis_client = patcher.start().return_value
+        self.addCleanup(patcher.stop)
+        self.cache = EntityCacheService(_CONFIG)
+        self.load = Mock(return_value=_dataset(2))
+
+    def test_misses_are_loaded_and_cached(self):
+        self.redis_client.mget.return_value = [None, None]
+        self.assertEqual(self.cache.get_entity('dataset', 'ds1', self.load).version_id, 2)
+        self.load.assert_called_once_with('ds1')
+        key, ttl, value = self.redis_client.setex.call_args[0]
+        self.assertEqual((key, ttl, json.loads(value)['version_id']), ('dart:entity:dataset:ds1', 30, 2))
+
+    def test_hits_are_not_loaded(self):
+        self.redis_client.mget.return_value = [json.dumps(_dataset(2).to_dict()), '2']
+        self.assertEqual(self.cache.get_entity('dataset', 'ds1', self.load).version_id, 2)
+        self.load.assert_not_called()
+        self.assertEqual(self.cache.stats()['dataset'], {'hits': 1, 'misses': 0})
+
+    def test_cached_entities_older_than_the_committed_version_are_reloaded(self):
+        self.redis_client.mget.return_value = [json.dumps(_dataset(1).to_dict()), '2']
+        self.assertEqual(self.cache.get_entity('dataset', 'ds1', self.load).version_id, 2)
+        self.load.assert_called_once_with('ds1')
+
+    def test_commits_invalidate_updated_entities(self):
+        session = _session(dirty=[DatasetDao(id='ds1', version_id=3)])
+        self.cache._after_flush(session, None)
+        self.cache._after_commit(session)
+        pipeline = self.redis_client.pipeline.return_value
+        pipeline.delete.assert_called_once_with('dart:entity:dataset:ds1')
+        pipeline.setex.assert_called_once_with('dart:entity_version:dataset:ds1', 60, 3)
+        pipeline.execute.assert_called_once_with()
+
+    def test_deleted_entities_are_never_served_from_the_cache_again(self):
+        session = _session(deleted=[DatasetDao(id='ds1', version_id=3)])
+        self.cache._after_flush(session, None)
+        self.cache._after_commit(session)
+        self.redis_client.pipeline.return_value.setex.assert_called_once_with(
+            'dart:entity_version:dataset:ds1', 60, sys.maxint)
+
+    def test_rollbacks_do_not_invalidate(self):
+        session = _session(dirty=[DatasetDao(id='ds1', version_id=3)])
+        self.cache._after_flush(session, None)
+        self.cache._after_rollback(session)
+        self.cache._after_commit(session)
+        self.redis_client.pipeline.assert_not_called()
+
+    def test_lookups_go_to_the_database_without_redis(self):
+        cache = EntityCacheService({})
+        self.assertEqual(cache.get_entity('dataset', 'ds1', self.load).version_id, 2)
+        cache.install_session_hooks()
+        self.redis_client.mget.assert_not_called()
@@ -0,0 +1,91 @@
+# must run pip install -e . in src/python folder before running this unit test
+import unittest
+
+from jsonpatch import JsonPatch
+from mock import Mock, patch
+from sqlalchemy.orm.exc import StaleDataError
+
+from tests.python.dart import orm_config  # noqa, must be imported before dart.model.orm
+from dart.model.orm import ActionDao
+from dart.service.patcher import bulk_patch_data, data_patch, _data_patch_expression
+
+
+class DataPatchExpressionTests(unittest.TestCase):
+
+    def test_operations_are_applied_in_order(self):
+        expression, params = _data_patch_expression(JsonPatch([
+            {'op': 'add', 'path': '/data/state', 'value': 'SKIPPED'},
+            {'op': 'replace', 'path': '/data/args/batch_size', 'value': 2},
+            {'op': 'remove', 'path': '/data/error_message'},
+        ]))
+        self.assertEqual(expression, '(jsonb_set(jsonb_set(t.data, CAST(:path_0 AS TEXT[]), CAST(:value_0 AS JSONB),'
+                                     ' true), CAST(:path_1 AS TEXT[]), CAST(:value_1 AS JSONB), true)'
+                                     ' #- CAST(:path_2 AS TEXT[]))')
+        self.assertEqual(params, {'path_0': ['state'], 'value_0': '"SKIPPED"', 'path_1': ['args', 'batch_size'],
+                                  'value_1': '2', 'path_2': ['error_message']})
+
+    def test_json_pointer_escapes_are_undone(self):
+        _, params = _data_patch_expression(JsonPatch([{'op': 'add', 'path': '/data/tags~1x/a~0b~01', 'value': 1}]))
+        self.assertEqual(params['path_0'], ['tags/x', 'a~b~1'])
+
+    def test_values_are_serialized_as_json(self):
+        _, params = _data_patch_expression(data_patch({'extra_data': {'a': [1, None]}}))
+        self.assertEqual(params, {'path_0': ['extra_data'], 'value_0': '{"a": [1, null]}'})
+
+    def test_unsupported_operations_are_rejected(self):
+        for operation in [{'op': 'move', 'from': '/data/a', 'path': '/data/b'},
+                          {'op': 'copy', 'from': '/data/a', 'path': '/data/b'},
+                          {'op': 'test', 'path': '/data/a', 'value': 1}]:
+            self.assertRaises(ValueError, _data_patch_expression, JsonPatch([operation]))
+
+    def test_paths_outside_of_data_are_rejected(self):
+        for path in ['/id', '/version_id', '/data', '/datas/state', '']:
+            self.assertRaises(ValueError, _data_patch_expression,
+                              JsonPatch([{'op': 'add', 'path': path, 'value': 1}]))
+
+
+class BulkPatchDataTests(unittest.TestCase):
+
+    def setUp(self):
+        patcher = patch('dart.service.patcher.db')
+        self.db = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.db.session.identity_map.values.return_value = []
+        self.patch = data_patch({'state': 'SKIPPED'})
+
+    def test_rows_are_updated_by_id_and_version(self):
+        self.db.session.execute.return_value = [('a1',), ('a2',)]
+        self.assertEqual(sorted(bulk_patch_data(ActionDao, {'a1': 1, 'a2': 5}, self.patch)), ['a1', 'a2'])
+        sql, params = self.db.session.execute.call_args[0]
+        self.assertIn('UPDATE "action" AS t', str(sql))
+        self.assertIn('WHERE t.id = v.id AND t.version_id = v.version_id', str(sql))
+        self.assertEqual(dict(zip(params['ids'], params['version_ids'])), {'a1': 1, 'a2': 5})
+        self.db.session.commit.assert_called_once_with()
+
+    def test_concurrently_modified_rows_are_patched_again_at_their_new_version(self):
+        self.db.session.execute.side_effect = [[('a1',)], [('a2',)]]
+        self.db.session.query.return_value.filter.return_value.all.return_value = [('a2', 6)]
+        self.assertEqual(bulk_patch_data(ActionDao, {'a1': 1, 'a2': 5}, self.patch), ['a1', 'a2'])
+        params = self.db.session.execute.call_args[0][1]
+        self.assertEqual((params['ids'], params['version_ids']), (['a2'], [6]))
+
+    def test_deleted_rows_are_left_out(self):
+        self.db.session.execute.side_effect = [[('a1',)]]
+        self.db.session.query.return_value.filter.return_value.all.return_value = []
+        self.assertEqual(bulk_patch_data(ActionDao, {'a1': 1, 'a2': 5}, self.patch), ['a1'])
+
+    def test_rows_modified_on_every_attempt_fail_the_patch(self):
+        self.db.session.execute.return_value = []
+        self.db.session.query.return_value.filter.return_value.all.return_value = [('a1', 2)]
+        self.assertRaises(StaleDataError, bulk_patch_data, ActionDao, {'a1': 1}, self.patch, max_attempts=3)
+        self.assertEqual(self.db.session.execute.call_count, 3)
+        self.db.session.rollback.assert_called_once_with()
+        self.db.session.commit.assert_not_called()
+
+    def test_patched_instances_in_the_session_are_expired(self):
+        patched, other = ActionDao(id='a1'), ActionDao(id='a9')
+        self.db.session.identity_map.values.return_value = [patched, other]
+        self.db.session.execute.return_value = [('a1',)]
+        bulk_patch_data(ActionDao, {'a1': 1}, self.patch, commit=False)
+        self.db.session.expire.assert_called_once_with(patched)
+        self.db.session.commit.assert_not_called()
@@ -0,0 +1,32 @@
+# must run pip install -e . in src/python folder before running this unit test
+import unittest
+
+from dart.util.prefix_index import PrefixIndex
+
+
+class PrefixIndexTests(unittest.TestCase):
+
+    def setUp(self):
+        self.index = PrefixIndex()
+        self.index.put('a', 's3://bucket/data', 'A')
+        self.index.put('b', 's3://bucket/data/2016', 'B')
+        self.index.put('c', 's3://other/data', 'C')
+
+    def test_match_returns_all_prefixes(self):
+        self.assertEqual(sorted(self.index.match('s3://bucket/data/2016/01/01/file.gz')), ['A', 'B'])
+        self.assertEqual(sorted(self.index.match('s3://bucket/data/2015/file.gz')), ['A'])
+        self.assertEqual(list(self.index.match('s3://bucket/dat')), [])
+
+    def test_remove(self):
+        self.index.remove('a')
+        self.assertEqual(list(self.index.match('s3://bucket/data/2016/file.gz')), ['B'])
+        self.assertNotIn('a', self.index)
+        self.assertEqual(len(self.index), 2)
+        self.index.remove('a')
+
+    def test_put_replaces_existing_key(self):
+        self.index.put('b', 's3://other/data', 'B2')
+        self.assertEqual(list(self.index.match('s3://bucket/data/2016/file.gz')), ['A'])
+        self.assertEqual(sorted(self.index.match('s3://other/data/file.gz')), ['B2', 'C'])
+        self.assertEqual(self.index.get('b'), 'B2')
+        self.assertEqual(len(self.index), 3)